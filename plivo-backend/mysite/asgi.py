@@ -2,6 +2,8 @@
 ASGI config for mysite project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+With REALTIME_TRANSPORT = 'channels' it also serves the realtime WebSocket
+(see realtime/consumers.py).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -13,4 +15,20 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
-application = get_asgi_application()
+# Sets Django up, before anything below imports models
+django_application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+
+if settings.REALTIME_TRANSPORT == 'channels':
+    from channels.routing import ProtocolTypeRouter, URLRouter
+    from channels.security.websocket import OriginValidator
+    from realtime.routing import websocket_urlpatterns
+
+    application = ProtocolTypeRouter({
+        'http': django_application,
+        # The session cookie authenticates the socket, so only the frontend's origins may open one
+        'websocket': OriginValidator(URLRouter(websocket_urlpatterns), settings.CORS_ALLOWED_ORIGINS),
+    })
+else:
+    application = django_application
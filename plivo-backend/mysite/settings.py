@@ -37,6 +37,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
+    'channels',
     'users.apps.UsersConfig',
     'services.apps.ServicesConfig',
     'timeline.apps.TimelineConfig',
@@ -53,6 +54,11 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Report requests that run more SQL queries than their view's budget (see utils/query_budget.py)
+QUERY_BUDGET_CHECK = os.environ.get('QUERY_BUDGET_CHECK', str(DEBUG)) == 'True'
+if QUERY_BUDGET_CHECK:
+    MIDDLEWARE.insert(0, 'utils.query_budget.QueryBudgetMiddleware')
+
 ROOT_URLCONF = 'mysite.urls'
 
 TEMPLATES = [
@@ -202,6 +208,61 @@ SIMPLE_JWT = {
     'AUTH_COOKIE_SAMESITE': 'None',
 }
 
+# How realtime events leave the request: 'outbox' writes them to the outbox table
+# in the same transaction and relies on `manage.py relay_outbox`; 'direct' hands
+# them to the background publisher after commit.
+REALTIME_DELIVERY = os.environ.get('REALTIME_DELIVERY', 'outbox')
+
+# How realtime events reach WebSocket clients: 'ws_server' relays them to the standalone
+# ws_server; 'channels' serves WebSockets from this ASGI app (mysite/asgi.py) and publishes
+# them with channel_layer.group_send.
+REALTIME_TRANSPORT = os.environ.get('REALTIME_TRANSPORT', 'ws_server')
+if REALTIME_TRANSPORT == 'channels':
+    # runserver serves the ASGI app, WebSockets included
+    INSTALLED_APPS.insert(0, 'daphne')
+ASGI_APPLICATION = 'mysite.asgi.application'
+
+# Channel layer of the 'channels' transport. The in-memory layer only reaches consumers in the
+# same process, so it needs REALTIME_DELIVERY = 'direct'; use Redis (CHANNEL_LAYER_URL) in production.
+CHANNEL_LAYER_URL = os.environ.get('CHANNEL_LAYER_URL')
+if CHANNEL_LAYER_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [CHANNEL_LAYER_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+# Django cache, used for public status page responses (see utils/public_cache.py). The local memory
+# cache is per process, so with several Django processes set CACHE_URL to a shared Redis.
+CACHE_URL = os.environ.get('CACHE_URL')
+if CACHE_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_URL,
+        },
+    }
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+# Seconds a public response is cached. Changes invalidate it sooner, this bounds what they can miss
+PUBLIC_CACHE_TTL = int(os.environ.get('PUBLIC_CACHE_TTL', 60))
+
+# Redis URL of the ws_server backplane. When set, events are published to Redis
+# instead of the ws_server internal port, so any number of ws_server processes can run.
+WS_BACKPLANE_URL = os.environ.get('WS_BACKPLANE_URL')
+
+# Background publisher for realtime events (see utils/publisher.py)
+WS_PUBLISHER = {
+    'WORKERS': 1,  # events are sharded to workers by room, so per-room order is kept
+    'QUEUE_SIZE': 10000,
+    'BATCH_SIZE': 100,
+    'OVERFLOW_POLICY': 'drop_oldest',  # drop_newest, drop_oldest or spill
+    'SPILL_PATH': BASE_DIR / 'ws_spill.jsonl',
+}
+
 # Custom user model
 AUTH_USER_MODEL = 'users.User'
 # Authentication backends
@@ -0,0 +1,184 @@
+"""
+Authentication of WebSocket clients.
+
+The `access_token` cookie is verified locally during the handshake with
+the SimpleJWT signing settings, so no database call is needed to check a
+token. What a user may see (their organization) is looked up once and
+cached for `ttl` seconds, so a reconnect storm costs one query per user
+at most.
+
+Clients without a valid token are anonymous: they can still follow an
+organization's rooms, as the public status page does, but only receive
+events about publicly visible services.
+
+The cookie is sent with SameSite=None, so a browser attaches it to a
+socket opened by any page. Handshakes from pages outside the frontend's
+origins (CORS_ALLOWED_ORIGINS) are refused, as Channels' OriginValidator
+does, or such a page could act as the member visiting it.
+"""
+import asyncio
+import time
+from http.cookies import CookieError, SimpleCookie
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+import jwt
+
+DEFAULT_COOKIE = "access_token"
+DEFAULT_SCOPE_TTL = 60.0
+# Cached scopes kept before expired ones are pruned
+MAX_CACHED_SCOPES = 10000
+
+# user id -> organization id the user is a member of, None if none or inactive
+ScopeLoader = Callable[[object], Awaitable[Optional[int]]]
+
+
+class Principal:
+    """Who is on the other end of a connection"""
+    __slots__ = ("user_id", "org_id", "expires_at")
+
+    def __init__(self, user_id=None, org_id: Optional[int] = None, expires_at: Optional[float] = None):
+        self.user_id = user_id
+        self.org_id = org_id
+        # Token expiry (epoch seconds), member access ends with it
+        self.expires_at = expires_at
+
+    @property
+    def authenticated(self) -> bool:
+        return self.user_id is not None
+
+
+ANONYMOUS = Principal()
+
+
+def cookie_token(cookie_header: Optional[str], name: str = DEFAULT_COOKIE) -> Optional[str]:
+    """Value of one cookie from a Cookie header"""
+    if not cookie_header:
+        return None
+    try:
+        cookies = SimpleCookie(cookie_header)
+    except CookieError:
+        return None
+    morsel = cookies.get(name)
+    return morsel.value if morsel is not None and morsel.value else None
+
+
+class TokenVerifier:
+    """Checks SimpleJWT access tokens with the same settings as the REST API"""
+
+    def __init__(self, signing_key: str, algorithm: str = "HS256", audience=None, issuer=None,
+                 leeway: float = 0, user_id_claim: str = "user_id",
+                 token_type_claim: str = "token_type", verifying_key: Optional[str] = None):
+        # Asymmetric algorithms verify with the public key
+        self.key = verifying_key or signing_key
+        self.algorithm = algorithm
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        self.user_id_claim = user_id_claim
+        self.token_type_claim = token_type_claim
+
+    @classmethod
+    def from_settings(cls, simple_jwt: dict) -> "TokenVerifier":
+        leeway = simple_jwt.get("LEEWAY", 0)
+        return cls(
+            signing_key=simple_jwt["SIGNING_KEY"],
+            algorithm=simple_jwt.get("ALGORITHM", "HS256"),
+            audience=simple_jwt.get("AUDIENCE"),
+            issuer=simple_jwt.get("ISSUER"),
+            leeway=leeway.total_seconds() if hasattr(leeway, "total_seconds") else leeway,
+            user_id_claim=simple_jwt.get("USER_ID_CLAIM", "user_id"),
+            token_type_claim=simple_jwt.get("TOKEN_TYPE_CLAIM", "token_type"),
+            verifying_key=simple_jwt.get("VERIFYING_KEY"),
+        )
+
+    def verify(self, token: str) -> Optional[Tuple[object, Optional[float]]]:
+        """(user id, expiry) of a valid access token, None for anything else"""
+        try:
+            claims = jwt.decode(
+                token, self.key, algorithms=[self.algorithm], audience=self.audience,
+                issuer=self.issuer, leeway=self.leeway,
+                options={"verify_aud": self.audience is not None},
+            )
+        except jwt.InvalidTokenError:
+            return None
+        if self.token_type_claim and claims.get(self.token_type_claim) != "access":
+            return None
+        user_id = claims.get(self.user_id_claim)
+        if user_id is None:
+            return None
+        return user_id, claims.get("exp")
+
+
+class ScopeCache:
+    """Organization of each user, cached for `ttl` seconds with one load per user in flight"""
+
+    def __init__(self, loader: ScopeLoader, ttl: float = DEFAULT_SCOPE_TTL):
+        self.loader = loader
+        self.ttl = ttl
+        self.scopes: Dict[object, Tuple[float, Optional[int]]] = {}
+        self._loading: Dict[object, asyncio.Future] = {}
+        self.loads = 0
+
+    async def get(self, user_id) -> Optional[int]:
+        cached = self.scopes.get(user_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        future = self._loading.get(user_id)
+        if future is None:
+            future = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+        return await asyncio.shield(future)
+
+    def invalidate(self, user_id=None):
+        if user_id is None:
+            self.scopes.clear()
+        else:
+            self.scopes.pop(user_id, None)
+
+    async def _load(self, user_id) -> Optional[int]:
+        try:
+            org_id = await self.loader(user_id)
+            self.loads += 1
+            if len(self.scopes) >= MAX_CACHED_SCOPES:
+                self._prune()
+            # Unknown users are cached too, a bad token can't turn into a query per attempt
+            self.scopes[user_id] = (time.monotonic() + self.ttl, org_id)
+            return org_id
+        finally:
+            self._loading.pop(user_id, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        for user_id in [key for key, (expires, _) in self.scopes.items() if expires <= now]:
+            del self.scopes[user_id]
+
+
+class Authenticator:
+    """Turns handshake headers into a Principal"""
+
+    def __init__(self, verifier: Optional[TokenVerifier], scopes: Optional[ScopeCache],
+                 cookie_name: str = DEFAULT_COOKIE, allowed_origins: Optional[Iterable[str]] = None):
+        self.verifier = verifier
+        self.scopes = scopes
+        self.cookie_name = cookie_name
+        # None accepts any origin, which is only safe while every client is anonymous
+        self.allowed_origins = set(allowed_origins) if allowed_origins is not None else None
+
+    def origin_allowed(self, origin: Optional[str]) -> bool:
+        """Whether a handshake with this Origin header may go ahead"""
+        if self.allowed_origins is None or origin is None:
+            # Browsers always send Origin, a client without one isn't a page using a visitor's cookie
+            return True
+        return origin in self.allowed_origins
+
+    async def authenticate(self, headers) -> Principal:
+        if self.verifier is None or self.scopes is None:
+            return ANONYMOUS
+        token = cookie_token(headers.get("Cookie"), self.cookie_name)
+        if token is None:
+            return ANONYMOUS
+        verified = self.verifier.verify(token)
+        if verified is None:
+            # Like the REST API, a bad token makes the client anonymous rather than refused
+            return ANONYMOUS
+        user_id, expires_at = verified
+        return Principal(user_id, await self.scopes.get(user_id), expires_at)
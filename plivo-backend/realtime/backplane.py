@@ -0,0 +1,343 @@
+"""
+Backplanes decide how a published room message reaches the ws_server processes.
+
+LocalBackplane hands messages straight to this process's fan-out, which is
+all a single ws_server needs. RedisBackplane routes every message through a
+Redis pub/sub channel named after the room. Each ws_server process only
+subscribes to the rooms its own clients have joined, so N processes behind
+a load balancer each see exactly the traffic they need.
+
+Both assign the room sequence number used for replay. With Redis it comes
+from an INCR on a per-room key, done in the same script as the PUBLISH, so
+every process sees the same numbers. The message on the channel is
+"<seq> <json>", the JSON holding the event and every room it was published to.
+
+An event published to several rooms is one script call that goes out on
+each room's channel. The room list lets a receiving process hand each of
+its connections only one of those copies.
+
+RelayBackplane connects a worker process to the supervisor of a multi
+worker ws_server (see realtime.workers) over a Unix socket. The supervisor
+numbers every event and sends each worker a copy, so workers on one box
+need no Redis.
+
+A process can also watch every room under a prefix (e.g. `org_42_`) without
+local clients in those rooms. That is how wildcard subscriptions are served
+and what keeps an org snapshot complete.
+
+Sequence numbers are only comparable within an `epoch`. Redis numbers are
+shared by every process and outlive them; local numbers start from 1 in
+every process, so a resumed session (realtime.session) from another epoch
+can only continue a room this process has not numbered yet.
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import Callable, Dict, List, Optional, Set
+from .framing import MAX_FRAME_SIZE, encode_frame, read_frames
+from .topics import as_rooms
+
+log = logging.getLogger("ws_server.backplane")
+
+DEFAULT_CHANNEL_PREFIX = "ws:room:"
+DEFAULT_SEQUENCE_PREFIX = "ws:seq:"
+
+# KEYS: sequence key and channel of each room, ARGV[1] JSON payload
+PUBLISH_SCRIPT = """
+local seqs = {}
+for i = 1, #KEYS, 2 do
+    local seq = redis.call('INCR', KEYS[i])
+    redis.call('PUBLISH', KEYS[i + 1], seq .. ' ' .. ARGV[1])
+    seqs[#seqs + 1] = seq
+end
+return seqs
+"""
+
+# deliver(room, data, seq, rooms), rooms being every room of the event
+Deliver = Callable[[str, dict, int, List[str]], None]
+
+
+def script_keys(rooms: List[str], channel_prefix: str, sequence_prefix: str) -> list:
+    keys = []
+    for room in rooms:
+        keys += [sequence_prefix + room, channel_prefix + room]
+    return keys
+
+
+def encode_message(rooms: List[str], data: dict) -> str:
+    return json.dumps({"rooms": rooms, "data": data})
+
+
+def decode_message(raw) -> tuple:
+    """Split a "<seq> <json>" backplane message into (seq, rooms, data)"""
+    if isinstance(raw, bytes):
+        raw = raw.decode()
+    seq, _, payload = raw.partition(" ")
+    message = json.loads(payload)
+    return int(seq), message["rooms"], message["data"]
+
+
+class LocalBackplane:
+    """Single process mode, publish is a direct call into the fan-out"""
+
+    def __init__(self, deliver: Deliver):
+        self.deliver = deliver
+        self.sequences: Dict[str, int] = {}
+        self.epoch = "local:" + os.urandom(6).hex()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, room, data: dict) -> List[int]:
+        """Publish to one room or a list of rooms, returns the sequence number in each"""
+        rooms = as_rooms(room)
+        seqs = []
+        for room in rooms:
+            seq = self.sequences[room] = self.sequences.get(room, 0) + 1
+            seqs.append(seq)
+        for room, seq in zip(rooms, seqs):
+            self.deliver(room, data, seq, rooms)
+        return seqs
+
+    async def current_seq(self, room: str) -> Optional[int]:
+        """Last sequence number of a room, None if this process never numbered it"""
+        return self.sequences.get(room)
+
+    def adopt_seq(self, room: str, seq: int) -> bool:
+        """Continue numbering a room from another epoch's `seq`, if it has no numbers here yet"""
+        if room in self.sequences:
+            return False
+        self.sequences[room] = seq
+        return True
+
+    async def subscribe(self, room: str):
+        pass
+
+    async def unsubscribe(self, room: str):
+        pass
+
+    async def watch(self, prefix: str):
+        pass
+
+    async def unwatch(self, prefix: str):
+        pass
+
+
+class RedisBackplane:
+    """Shares rooms between ws_server processes through Redis pub/sub"""
+
+    def __init__(self, deliver: Deliver, url: str = "redis://localhost:6379/0",
+                 prefix: str = DEFAULT_CHANNEL_PREFIX, sequence_prefix: str = DEFAULT_SEQUENCE_PREFIX,
+                 client=None):
+        self.deliver = deliver
+        self.url = url
+        self.prefix = prefix
+        self.sequence_prefix = sequence_prefix
+        # Every process on the same Redis shares one sequence per room
+        self.epoch = "redis:" + sequence_prefix
+        self.client = client
+        self.pubsub = None
+        self.subscribed: Set[str] = set()
+        # prefix -> number of watchers, a snapshot and a wildcard can share one
+        self.watched: Dict[str, int] = {}
+        self.last_seq: Dict[str, int] = {}
+        self._has_subscriptions = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._reader = None
+
+    async def start(self):
+        if self.client is None:
+            import redis.asyncio as redis
+            self.client = redis.from_url(self.url)
+        self.pubsub = self.client.pubsub()
+        self._reader = asyncio.create_task(self._read_loop())
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        if self.pubsub is not None:
+            await self.pubsub.aclose()
+
+    def channel(self, room: str) -> str:
+        return self.prefix + room
+
+    async def publish(self, room, data: dict) -> List[int]:
+        """Publish to one room or a list of rooms, returns the sequence number in each"""
+        rooms = as_rooms(room)
+        keys = script_keys(rooms, self.prefix, self.sequence_prefix)
+        seqs = await self.client.eval(PUBLISH_SCRIPT, len(keys), *keys, encode_message(rooms, data))
+        return [int(seq) for seq in seqs]
+
+    async def current_seq(self, room: str) -> Optional[int]:
+        seq = await self.client.get(self.sequence_prefix + room)
+        return int(seq) if seq is not None else 0
+
+    def adopt_seq(self, room: str, seq: int) -> bool:
+        # Redis sequences are never restarted, there is nothing to continue
+        return False
+
+    async def subscribe(self, room: str):
+        async with self._lock:
+            if room in self.subscribed:
+                return
+            await self.pubsub.subscribe(self.channel(room))
+            self.subscribed.add(room)
+            self._has_subscriptions.set()
+
+    async def unsubscribe(self, room: str):
+        async with self._lock:
+            if room not in self.subscribed:
+                return
+            await self.pubsub.unsubscribe(self.channel(room))
+            self.subscribed.discard(room)
+            if not self._watching(room):
+                self.last_seq.pop(room, None)
+
+    async def watch(self, prefix: str):
+        """Receive every room starting with `prefix`, whether or not it has local clients"""
+        async with self._lock:
+            if prefix in self.watched:
+                self.watched[prefix] += 1
+                return
+            await self.pubsub.psubscribe(self.channel(prefix) + "*")
+            self.watched[prefix] = 1
+            self._has_subscriptions.set()
+
+    async def unwatch(self, prefix: str):
+        """Undo one watch() call, the pattern is dropped once nobody watches it"""
+        async with self._lock:
+            if prefix not in self.watched:
+                return
+            self.watched[prefix] -= 1
+            if self.watched[prefix]:
+                return
+            await self.pubsub.punsubscribe(self.channel(prefix) + "*")
+            del self.watched[prefix]
+            for room in [r for r in self.last_seq if r.startswith(prefix) and r not in self.subscribed]:
+                del self.last_seq[room]
+
+    def _watching(self, room: str) -> bool:
+        return any(room.startswith(prefix) for prefix in self.watched)
+
+    async def _read_loop(self):
+        while True:
+            # get_message needs at least one subscription on the connection
+            if not self.subscribed and not self.watched:
+                self._has_subscriptions.clear()
+                await self._has_subscriptions.wait()
+            try:
+                message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"❌ Redis backplane read failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            if not message or message.get("type") not in ("message", "pmessage"):
+                continue
+            channel = message["channel"]
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            room = channel[len(self.prefix):]
+            # A message can still arrive for a room we just unsubscribed from
+            if room not in self.subscribed and not self._watching(room):
+                continue
+            try:
+                seq, rooms, data = decode_message(message["data"])
+            except (ValueError, KeyError, TypeError):
+                log.warning(f"⚠️ Dropping malformed backplane message for room {room}")
+                continue
+            # A room that is both subscribed and watched arrives twice, back to back
+            if seq == self.last_seq.get(room):
+                continue
+            self.last_seq[room] = seq
+            self.deliver(room, data, seq, rooms)
+
+
+def encode_relay_message(seqs: List[int], rooms: List[str], data) -> bytes:
+    """Line the supervisor sends every worker for one event"""
+    return json.dumps({"seqs": seqs, "rooms": rooms, "data": data}, separators=(",", ":")).encode() + b"\n"
+
+
+class RelayBackplane:
+    """A worker's link to the supervisor, which relays every event to every worker.
+
+    Publishing hands the event to the supervisor, which numbers it, so the
+    publishing worker gets it back like the others. There is nothing to
+    subscribe to: each worker receives all events, as a single process does.
+    """
+
+    def __init__(self, deliver: Deliver, path: str):
+        self.deliver = deliver
+        self.path = path
+        # Every worker of one supervisor shares its numbering
+        self.epoch = "relay:" + path
+        self.last_seq: Dict[str, int] = {}
+        # Called when the supervisor goes away
+        self.on_close: Optional[Callable[[], None]] = None
+        self._writer = None
+        self._reader = None
+
+    async def start(self):
+        reader, self._writer = await asyncio.open_unix_connection(self.path, limit=MAX_FRAME_SIZE)
+        self._reader = asyncio.create_task(self._read_loop(reader))
+
+    async def stop(self):
+        if self._reader:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+        if self._writer is not None:
+            self._writer.close()
+
+    async def publish(self, room, data: dict) -> List[int]:
+        """Hand an event to the supervisor. Sequence numbers are not known until it comes back"""
+        self._writer.write(encode_frame(room, data))
+        await self._writer.drain()
+        return []
+
+    async def current_seq(self, room: str) -> Optional[int]:
+        return self.last_seq.get(room)
+
+    def adopt_seq(self, room: str, seq: int) -> bool:
+        # Numbering belongs to the supervisor
+        return False
+
+    async def subscribe(self, room: str):
+        pass
+
+    async def unsubscribe(self, room: str):
+        pass
+
+    async def watch(self, prefix: str):
+        pass
+
+    async def unwatch(self, prefix: str):
+        pass
+
+    async def _read_loop(self, reader):
+        try:
+            async for message in read_frames(reader):
+                try:
+                    seqs, rooms, data = message["seqs"], message["rooms"], message["data"]
+                except (KeyError, TypeError):
+                    log.warning("⚠️ Dropping malformed relay message")
+                    continue
+                for room, seq in zip(rooms, seqs):
+                    self.last_seq[room] = seq
+                    self.deliver(room, data, seq, rooms)
+        except (ConnectionError, ValueError) as e:
+            log.error(f"❌ Relay connection failed: {e}")
+        log.error("❌ Lost the connection to the supervisor")
+        if self.on_close is not None:
+            self.on_close()
@@ -0,0 +1,103 @@
+"""
+Bytes and CPU per delivered message for each wire encoding.
+
+    python -m realtime.bench_encoding --clients 200 --messages 2000
+
+Messages go through the same encode path as ws_server (one OutboundMessage
+shared by every client). "json+permessage-deflate" models the WebSocket
+extension, which keeps a compressor per client and runs it on every frame.
+"""
+import argparse
+import json
+import random
+import time
+import zlib
+
+from .encoding import ENCODING_DEFLATE, ENCODING_JSON, ENCODING_MSGPACK
+from .fanout import OutboundMessage, entity_key
+
+STATUSES = ["operational", "degraded_performance", "partial_outage", "major_outage"]
+INCIDENT_STATUSES = ["investigating", "identified", "monitoring"]
+
+
+def sample_event(index: int) -> dict:
+    """A service or incident event shaped like the ones services.signals sends"""
+    if index % 3:
+        return {
+            "type": "service_updated",
+            "data": {
+                "id": index % 50 + 1,
+                "organizationId": 1,
+                "name": f"Service {index % 50 + 1}",
+                "description": "Public API used by the dashboard and mobile apps",
+                "currentStatus": random.choice(STATUSES),
+                "publiclyVisible": True,
+                "createdAt": "2026-01-05T09:12:44.120394Z",
+                "updatedAt": f"2026-10-18T10:{index % 60:02d}:03.884213Z",
+            },
+            "organization_id": 1,
+            "room": "org_1_update",
+            "seq": index,
+        }
+    return {
+        "type": "incident_updated",
+        "data": {
+            "id": index % 20 + 1,
+            "serviceId": index % 50 + 1,
+            "title": "Elevated error rates on checkout",
+            "description": "We are investigating increased 5xx responses from the payments API.",
+            "status": random.choice(INCIDENT_STATUSES),
+            "severity": "high",
+            "createdBy": "On-call Engineer",
+            "resolvedAt": None,
+            "createdAt": "2026-10-18T09:58:10.004211Z",
+            "updatedAt": f"2026-10-18T10:{index % 60:02d}:41.512006Z",
+        },
+        "organization_id": 1,
+        "room": f"org_1_incident_{index % 50 + 1}_update",
+        "seq": index,
+    }
+
+
+def run(mode: str, events: list, clients: int) -> dict:
+    sent_bytes = 0
+    if mode == "json+permessage-deflate":
+        compressors = [zlib.compressobj(wbits=-15) for _ in range(clients)]
+    started = time.process_time()
+    for data in events:
+        message = OutboundMessage(data["room"], json.dumps(data), entity_key(data))
+        if mode == "json+permessage-deflate":
+            raw = message.payload.encode()
+            for compressor in compressors:
+                # What permessage-deflate does for each frame, minus the 4 byte sync marker
+                sent_bytes += len(compressor.compress(raw) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+            continue
+        for _ in range(clients):
+            frame = message.encoded(mode)
+            sent_bytes += len(frame.encode() if isinstance(frame, str) else frame)
+    elapsed = time.process_time() - started
+    delivered = len(events) * clients
+    return {
+        "mode": mode,
+        "bytes_per_message": round(sent_bytes / delivered, 1),
+        "cpu_us_per_message": round(elapsed / delivered * 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    events = [sample_event(i) for i in range(args.messages)]
+    print(f"{args.messages} messages to {args.clients} clients")
+    print(f"{'mode':<26}{'bytes/msg':>12}{'cpu us/msg':>14}")
+    for mode in (ENCODING_JSON, ENCODING_MSGPACK, ENCODING_DEFLATE, "json+permessage-deflate"):
+        result = run(mode, events, args.clients)
+        print(f"{result['mode']:<26}{result['bytes_per_message']:>12}{result['cpu_us_per_message']:>14}")
+
+
+if __name__ == "__main__":
+    main()
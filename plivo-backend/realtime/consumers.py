@@ -0,0 +1,117 @@
+"""
+WebSocket delivery from the Django ASGI app, for REALTIME_TRANSPORT = 'channels'.
+
+Instead of relaying events to the standalone ws_server, Django publishes
+them with `channel_layer.group_send`, one group per room, and this
+consumer forwards them to its client. Clients speak the same join / leave
+protocol as with ws_server and are authenticated the same way, from the
+`access_token` cookie (see realtime.auth).
+
+This mode trades ws_server's features for one less process and hop:
+events carry no `seq` (so no replay, snapshots or session resume), frames
+are JSON only, and clients join exact rooms, not wildcards.
+"""
+import json
+import logging
+import re
+import time
+
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from .auth import ANONYMOUS, DEFAULT_COOKIE, Authenticator, ScopeCache, TokenVerifier
+from .fanout import DEFAULT_MAX_ROOMS, private_org
+from .topics import is_pattern, valid_topic
+
+log = logging.getLogger("ws_server.consumers")
+
+# Channel layer message type, handled by RoomConsumer.room_event
+ROOM_EVENT = "room.event"
+# Group names the channel layer accepts, group_add raises TypeError for anything else
+GROUP_NAME = re.compile(r"^[a-zA-Z0-9\-_.]{1,99}$")
+
+_authenticator = None
+
+
+def group_message(rooms: list, room: str, data) -> dict:
+    """Message sent to the group of `room` for an event published to `rooms`"""
+    return {"type": ROOM_EVENT, "room": room, "rooms": rooms, "data": data}
+
+
+def get_authenticator() -> Authenticator:
+    """Process wide authenticator, built from the SimpleJWT settings on first use"""
+    global _authenticator
+    if _authenticator is None:
+        from .django_loader import load_user_org
+        _authenticator = Authenticator(
+            TokenVerifier.from_settings(settings.SIMPLE_JWT),
+            ScopeCache(load_user_org),
+            settings.SIMPLE_JWT.get("AUTH_COOKIE", DEFAULT_COOKIE),
+        )
+    return _authenticator
+
+
+class RoomConsumer(AsyncWebsocketConsumer):
+    max_rooms = DEFAULT_MAX_ROOMS
+
+    async def connect(self):
+        self.rooms = set()
+        headers = {name.decode("latin-1").title(): value.decode("latin-1") for name, value in self.scope["headers"]}
+        try:
+            self.principal = await get_authenticator().authenticate(headers)
+        except Exception as e:
+            log.warning("❌ Failed to authenticate client: %s", e)
+            self.principal = ANONYMOUS
+        await self.accept()
+
+    async def disconnect(self, code):
+        for room in self.rooms:
+            await self.channel_layer.group_discard(room, self.channel_name)
+        self.rooms.clear()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            data = json.loads(text_data or bytes_data or "")
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            await self.send_error("Invalid JSON")
+            return
+        if not isinstance(data, dict):
+            await self.send_error("Invalid JSON")
+            return
+        action = data.get("action")
+        room = data.get("room")
+        if action == "join" and room:
+            if not isinstance(room, str) or not valid_topic(room):
+                await self.send_error(f"Invalid room: {room}")
+                return
+            if is_pattern(room):
+                await self.send_error(f"Wildcard rooms are only served by ws_server: {room}")
+                return
+            if not GROUP_NAME.match(room):
+                await self.send_error(f"Invalid room: {room}")
+                return
+            if room not in self.rooms and self.max_rooms and len(self.rooms) >= self.max_rooms:
+                await self.send_error(f"Too many rooms (max {self.max_rooms})")
+                return
+            await self.channel_layer.group_add(room, self.channel_name)
+            self.rooms.add(room)
+        elif action == "leave" and room in self.rooms:
+            await self.channel_layer.group_discard(room, self.channel_name)
+            self.rooms.discard(room)
+
+    async def room_event(self, event):
+        room, rooms, data = event["room"], event["rooms"], event["data"]
+        # Sent to every room's group, a client in several of them keeps the first room's copy
+        if room in rooms and any(earlier in self.rooms for earlier in rooms[:rooms.index(room)]):
+            return
+        org_id = private_org(data)
+        if org_id is not None and not self.is_member(org_id):
+            return
+        await self.send(text_data=json.dumps(data))
+
+    def is_member(self, org_id) -> bool:
+        principal = self.principal
+        return principal.org_id == org_id and (principal.expires_at is None or principal.expires_at > time.time())
+
+    async def send_error(self, message: str):
+        await self.send(text_data=json.dumps({"error": message}))
@@ -0,0 +1,38 @@
+"""
+Database access for ws_server, which otherwise runs outside Django.
+
+Only used to seed org snapshots and to look up the organization of an
+authenticated user, both cached, so it runs once per organization or user
+rather than once per viewer or message.
+"""
+import os
+from asgiref.sync import sync_to_async
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    import django
+    django.setup()
+
+
+def _load_org(org_id: int):
+    from services.models import Service, Incident
+    services = [service.to_dict() for service in Service.objects.filter(organization_id=org_id)]
+    incidents = [
+        incident.to_dict()
+        for incident in Incident.objects.filter(service__organization_id=org_id)
+        .exclude(status='resolved')
+        .select_related('created_by')
+    ]
+    return services, incidents
+
+
+load_org_snapshot = sync_to_async(_load_org)
+
+
+def _load_user_org(user_id):
+    from users.models import User
+    return User.objects.filter(id=user_id, is_active=True).values_list('organization_id', flat=True).first()
+
+
+load_user_org = sync_to_async(_load_user_org)
@@ -0,0 +1,52 @@
+"""
+Wire encodings a client can pick when it joins.
+
+- json: text frames, the default
+- msgpack: binary MessagePack frames, smaller and cheaper to parse
+- deflate: binary frames holding zlib compressed JSON
+
+An outbound message is encoded at most once per encoding and the result is
+shared by every connection using it. That is the difference with the
+WebSocket permessage-deflate extension, which compresses every frame again
+for every client.
+"""
+import json
+import struct
+import zlib
+
+import msgpack
+
+ENCODING_JSON = "json"
+ENCODING_MSGPACK = "msgpack"
+ENCODING_DEFLATE = "deflate"
+ENCODINGS = (ENCODING_JSON, ENCODING_MSGPACK, ENCODING_DEFLATE)
+
+DEFLATE_LEVEL = 6
+
+
+def encode(encoding: str, text: str):
+    """Re-encode a message from its JSON form"""
+    if encoding == ENCODING_MSGPACK:
+        return msgpack.packb(json.loads(text), use_bin_type=True)
+    if encoding == ENCODING_DEFLATE:
+        return zlib.compress(text.encode(), DEFLATE_LEVEL)
+    return text
+
+
+def _msgpack_array_header(length: int) -> bytes:
+    if length < 16:
+        return bytes([0x90 | length])
+    if length < 0x10000:
+        return b"\xdc" + struct.pack(">H", length)
+    return b"\xdd" + struct.pack(">I", length)
+
+
+def array_frame(encoding: str, messages: list):
+    """One frame holding several messages as an array, reusing their encoded forms"""
+    if encoding == ENCODING_MSGPACK:
+        return _msgpack_array_header(len(messages)) + b"".join(m.encoded(encoding) for m in messages)
+    text = "[" + ",".join(m.payload for m in messages) + "]"
+    if encoding == ENCODING_DEFLATE:
+        # Compressed per batch, a batch is specific to its connection anyway
+        return zlib.compress(text.encode(), DEFLATE_LEVEL)
+    return text
@@ -0,0 +1,579 @@
+"""
+Concurrent fan-out of room messages to WebSocket connections.
+
+Every connection gets its own bounded send queue and a writer task, so
+publishing to a room only enqueues and never waits on a slow socket.
+Send queues have one lane per priority (see realtime.priority) and the
+most urgent lane is always sent first. When a queue is full the
+connection's slow-consumer policy decides what happens: drop the oldest
+message of the least urgent lane, conflate messages about the same
+entity (from the high-water mark on), or evict the connection.
+
+A message about an entity supersedes an earlier one about the same
+entity in the same room if it carries the full object or at least the
+fields of the earlier patch. Only superseded messages are conflated.
+
+A connection can also ask for a batch window. Its writer then waits that
+long after the first queued message, leaves out superseded messages and
+sends everything else as one array frame.
+
+Each connection has a wire encoding (see realtime.encoding). A message is
+encoded once per encoding in use, whatever the number of connections.
+
+A message about a service that is not publicly visible names the
+organization it belongs to, and is only queued on connections of that
+organization's members (see realtime.auth).
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, Optional, Set
+from .encoding import ENCODING_JSON, ENCODINGS, array_frame, encode
+from .metrics import Histogram
+from .priority import PRIORITIES, event_priority
+from .topics import TopicIndex
+
+log = logging.getLogger("ws_server.fanout")
+
+# Slow consumer policies
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_CONFLATE = "conflate"
+POLICY_EVICT = "evict"
+POLICIES = (POLICY_DROP_OLDEST, POLICY_CONFLATE, POLICY_EVICT)
+
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_SEND_TIMEOUT = 5.0
+
+# Longest batch window a client may ask for
+MAX_BATCH_MS = 1000
+
+# Close code used when a connection is evicted for being too slow
+CLOSE_SLOW_CONSUMER = 1013
+# Close code for connections evicted by the lifecycle manager (idle, dead peer)
+CLOSE_POLICY = 1008
+# Close code for connections handed off while the server drains
+CLOSE_SERVICE_RESTART = 1012
+
+# Per-connection caps, 0 means unlimited
+DEFAULT_MAX_ROOMS = 50
+DEFAULT_MAX_QUEUE_BYTES = 4 * 1024 * 1024
+
+
+def entity_key(data: dict) -> Optional[tuple]:
+    """Key identifying the entity an event is about, used for conflation"""
+    if not isinstance(data, dict):
+        return None
+    event_type = data.get("type")
+    entity = data.get("data")
+    if not event_type or not isinstance(entity, dict) or entity.get("id") is None:
+        return None
+    # service_updated / service_deleted describe the same entity
+    return (event_type.split("_", 1)[0], entity["id"])
+
+
+def patch_fields(data: dict) -> Optional[frozenset]:
+    """Fields a patch event carries, None for an event with the full object"""
+    if isinstance(data, dict) and data.get("patch") and isinstance(data.get("data"), dict):
+        return frozenset(data["data"])
+    return None
+
+
+def private_org(data: dict) -> Optional[int]:
+    """Organization an event is restricted to, None if anyone in the room may see it"""
+    if isinstance(data, dict) and data.get("public") is False:
+        return data.get("organization_id")
+    return None
+
+
+def batch_seconds(batch_ms: float) -> float:
+    return min(max(float(batch_ms), 0.0), MAX_BATCH_MS) / 1000.0
+
+
+class OutboundMessage:
+    """A message encoded once and shared by every connection it is queued on"""
+    __slots__ = (
+        "room", "payload", "key", "created_at", "fallback", "private_org", "priority", "fields", "seq", "_encoded"
+    )
+
+    def __init__(self, room: str, payload, key: Optional[tuple] = None, private_org: Optional[int] = None,
+                 priority: int = PRIORITIES[-1], fields: Optional[frozenset] = None):
+        self.room = room
+        # JSON text, other encodings are derived from it on first use
+        self.payload = payload
+        self.key = key
+        self.priority = priority
+        # Fields of a patch, None when the message carries the full entity
+        self.fields = fields
+        self.created_at = time.monotonic()
+        # Full-object version of a patch event, for connections that asked for one
+        self.fallback: Optional["OutboundMessage"] = None
+        # Only members of this organization may receive the message, None if it is public
+        self.private_org = private_org
+        # Sequence number in `room`, None for messages outside the room's sequence
+        self.seq: Optional[int] = None
+        self._encoded: Optional[dict] = None
+
+    def encoded(self, encoding: str):
+        if encoding == ENCODING_JSON:
+            return self.payload
+        if self._encoded is None:
+            self._encoded = {}
+        frame = self._encoded.get(encoding)
+        if frame is None:
+            frame = self._encoded[encoding] = encode(encoding, self.payload)
+        return frame
+
+    def copy(self) -> "OutboundMessage":
+        """Same message with a fresh timestamp, sharing the encodings already made"""
+        message = OutboundMessage(self.room, self.payload, self.key, self.private_org, self.priority, self.fields)
+        message.fallback = self.fallback
+        message.seq = self.seq
+        if self._encoded is None:
+            self._encoded = {}
+        message._encoded = self._encoded
+        return message
+
+    def supersedes(self, older: "OutboundMessage") -> bool:
+        """Whether sending this message makes `older` redundant: same entity and room, no field lost"""
+        return (
+            self.key is not None
+            and self.key == older.key
+            and self.room == older.room
+            and (self.fields is None or (older.fields is not None and older.fields <= self.fields))
+        )
+
+
+class LaneQueue:
+    """Send queue with one FIFO lane per priority, the most urgent lane first"""
+
+    def __init__(self):
+        self.lanes = tuple(deque() for _ in PRIORITIES)
+        self.length = 0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __iter__(self):
+        for lane in self.lanes:
+            yield from lane
+
+    def append(self, message: OutboundMessage):
+        self.lanes[message.priority].append(message)
+        self.length += 1
+
+    def popleft(self) -> OutboundMessage:
+        for lane in self.lanes:
+            if lane:
+                self.length -= 1
+                return lane.popleft()
+        raise IndexError("pop from an empty queue")
+
+    def pop_least_urgent(self, priority: int) -> Optional[OutboundMessage]:
+        """Oldest message of the least urgent lane, if that lane is no more urgent than `priority`"""
+        for lane in reversed(self.lanes[priority:]):
+            if lane:
+                self.length -= 1
+                return lane.popleft()
+        return None
+
+    def remove_superseded(self, message: OutboundMessage) -> list:
+        """Take out queued messages of the same or a lower priority that `message` supersedes"""
+        removed = []
+        for lane in self.lanes[message.priority:]:
+            stale = [queued for queued in lane if message.supersedes(queued)]
+            for queued in stale:
+                lane.remove(queued)
+            removed += stale
+        self.length -= len(removed)
+        return removed
+
+    def clear(self):
+        for lane in self.lanes:
+            lane.clear()
+        self.length = 0
+
+    def depths(self) -> list:
+        return [len(lane) for lane in self.lanes]
+
+
+class LatencyStats:
+    """Delivery latency of one room, kept as a bounded sample window"""
+
+    def __init__(self, window: int = 1024):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct: float) -> float:
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "p50_ms": round(self.percentile(50) * 1000, 3),
+            "p99_ms": round(self.percentile(99) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+        }
+
+
+class Connection:
+    """A WebSocket connection with a bounded send queue drained by a writer task"""
+
+    def __init__(self, websocket, engine: "FanoutEngine", max_queue: int, policy: str):
+        self.websocket = websocket
+        self.engine = engine
+        self.max_queue = max_queue
+        self.policy = policy
+        self.rooms: Set[str] = set()
+        self.queue = LaneQueue()
+        # Size of the queued payloads, capped by the engine's max_queue_bytes
+        self.queued_bytes = 0
+        self.dropped = 0
+        self.closed = False
+        self.last_activity = time.monotonic()
+        self.batch_window = engine.batch_window
+        self.encoding = ENCODING_JSON
+        # Receive full objects instead of patches when the server can build them
+        self.full_objects = False
+        # Organization whose private events this connection receives, set from its token
+        self.member_of: Optional[int] = None
+        self.member_until: Optional[float] = None
+        # room -> highest seq written to the socket, see resume_seqs for what a session token resumes from
+        self.sent_seq: Dict[str, int] = {}
+        self._sending = False
+        self._in_flight: list = []
+        self._wakeup = asyncio.Event()
+        self._writer: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+
+    def offer(self, message: OutboundMessage) -> bool:
+        """Queue a message without blocking. Returns False if it was filtered out or the connection evicted"""
+        if self.closed:
+            return False
+        if message.private_org is not None and message.private_org != self.member_of:
+            self.engine.filtered += 1
+            return False
+        if self.full_objects and message.fallback is not None:
+            message = message.fallback
+        if self.policy == POLICY_CONFLATE and message.key is not None and len(self.queue) >= self.engine.high_water:
+            self._conflate(message)
+        if len(self.queue) >= self.max_queue:
+            if self.policy == POLICY_EVICT:
+                self.engine.evict(self, "queue_full")
+                return False
+            victim = self.queue.pop_least_urgent(message.priority)
+            self.dropped += 1
+            self.engine.dropped += 1
+            if victim is None:
+                # Everything queued is more urgent than this message
+                return False
+            self.queued_bytes -= len(victim.payload)
+        max_bytes = self.engine.max_queue_bytes
+        if max_bytes and self.queued_bytes + len(message.payload) > max_bytes and self.queue:
+            self.engine.evict(self, "memory")
+            return False
+        self.queue.append(message)
+        self.queued_bytes += len(message.payload)
+        self._wakeup.set()
+        return True
+
+    def seen(self, room: str, seq: int):
+        """Record that the client is up to date with `room` as of `seq`"""
+        if seq > self.sent_seq.get(room, 0):
+            self.sent_seq[room] = seq
+
+    def resume_seqs(self) -> Dict[str, int]:
+        """
+        room -> seq the client has every message of the room up to.
+
+        Lanes let a later, more urgent message of a room go out while an
+        earlier one is still queued, so a room's highest written seq stops
+        short of its oldest message not written yet.
+        """
+        seqs = dict(self.sent_seq)
+        for message in (*self._in_flight, *self.queue):
+            if message.seq is not None and message.room in seqs:
+                seqs[message.room] = min(seqs[message.room], message.seq - 1)
+        return seqs
+
+    @property
+    def flushed(self) -> bool:
+        """Nothing queued and nothing being written"""
+        return not self.queue and not self._sending
+
+    def authorize(self, org_id: Optional[int], until: Optional[float] = None):
+        """Let the connection receive private events of `org_id` until `until` (epoch seconds)"""
+        self.member_of = org_id
+        self.member_until = until
+
+    def touch(self):
+        """Record client activity, for idle eviction"""
+        self.last_activity = time.monotonic()
+
+    def set_batch_ms(self, batch_ms: float):
+        """Batch window requested by the client, 0 sends every message on its own"""
+        self.batch_window = batch_seconds(batch_ms)
+
+    def set_encoding(self, encoding: str):
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported encoding: {encoding}")
+        self.encoding = encoding
+
+    def _conflate(self, message: OutboundMessage):
+        """Drop queued messages about the same entity that `message` makes redundant"""
+        for queued in self.queue.remove_superseded(message):
+            self.queued_bytes -= len(queued.payload)
+            self.engine.conflated += 1
+
+    async def _write_loop(self):
+        while not self.closed:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            if self.batch_window:
+                # Let a burst of updates pile up, then send it as one frame
+                await asyncio.sleep(self.batch_window)
+                batch = self._drain()
+            else:
+                batch = [self.queue.popleft()]
+                self.queued_bytes -= len(batch[0].payload)
+            if len(batch) == 1:
+                payload = batch[0].encoded(self.encoding)
+            else:
+                payload = array_frame(self.encoding, batch)
+            self._sending = True
+            self._in_flight = batch
+            try:
+                await asyncio.wait_for(
+                    self.websocket.send(payload),
+                    timeout=self.engine.send_timeout
+                )
+            except asyncio.TimeoutError:
+                self.engine.evict(self, "send_timeout")
+                return
+            except Exception:
+                self.engine.evict(self, "send_failed")
+                return
+            finally:
+                self._sending = False
+            now = time.monotonic()
+            for message in batch:
+                self.engine.record_latency(message.room, now - message.created_at)
+                if message.seq is not None:
+                    self.seen(message.room, message.seq)
+            self._in_flight = []
+
+    def _drain(self) -> list:
+        """Take everything queued in arrival order, leaving out messages a later one supersedes"""
+        # One frame either way, so keep the order events happened in rather than lane order
+        messages = sorted(self.queue, key=lambda message: message.created_at)
+        latest = {}
+        for message in messages:
+            slot = (message.room, message.key) if message.key is not None else id(message)
+            previous = latest.pop(slot, None)
+            if previous is not None and not message.supersedes(previous):
+                # A patch with other fields, both have to go out
+                latest[id(previous)] = previous
+            # Re-inserted, so the message goes out where its latest version was queued
+            latest[slot] = message
+        self.engine.coalesced += len(messages) - len(latest)
+        self.queue.clear()
+        self.queued_bytes = 0
+        return list(latest.values())
+
+    async def close(self):
+        self.closed = True
+        self._wakeup.set()
+        if self._writer and self._writer is not asyncio.current_task():
+            self._writer.cancel()
+            try:
+                await self._writer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+
+class FanoutEngine:
+    """Tracks room membership and pushes room messages to every member at once.
+
+    Connections join topics: exact rooms or `org_42_*` style wildcards, see
+    realtime.topics. on_room_created / on_room_empty are called when a topic
+    gains its first member or loses its last one, which is when a backplane
+    needs to subscribe or unsubscribe.
+    """
+
+    def __init__(self, max_queue: int = DEFAULT_QUEUE_SIZE, policy: str = POLICY_CONFLATE,
+                 send_timeout: float = DEFAULT_SEND_TIMEOUT, batch_ms: float = 0,
+                 max_rooms: int = DEFAULT_MAX_ROOMS, max_queue_bytes: int = DEFAULT_MAX_QUEUE_BYTES,
+                 high_water: Optional[int] = None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.max_queue = max_queue
+        # Queue depth from which the conflate policy drops superseded messages, half the queue by default
+        self.high_water = max_queue // 2 if high_water is None else high_water
+        self.policy = policy
+        self.send_timeout = send_timeout
+        # Batch window of new connections, each client can change its own on join
+        self.batch_window = batch_seconds(batch_ms)
+        # Rooms one connection may be in at once
+        self.max_rooms = max_rooms
+        # Bytes one connection may have waiting in its queue before it is evicted
+        self.max_queue_bytes = max_queue_bytes
+        self.index = TopicIndex()
+        # topic -> members
+        self.rooms: Dict[str, Set[Connection]] = self.index.topics
+        self.connections: Dict[object, Connection] = {}
+        self.latency: Dict[str, LatencyStats] = {}
+        # Time to queue one message on every member, per published room
+        self.fanout_time: Dict[str, Histogram] = {}
+        self.delivery_time = Histogram()
+        self.published = 0
+        self.dropped = 0
+        self.evicted = 0
+        # reason -> evicted connections
+        self.evictions: Dict[str, int] = {}
+        self.rejected_joins = 0
+        # Messages replaced by a newer version of the same entity within a batch window
+        self.coalesced = 0
+        # Queued messages dropped because a newer one about the same entity made them redundant
+        self.conflated = 0
+        # Private messages not queued on a connection outside their organization
+        self.filtered = 0
+        self.on_room_created: Optional[Callable[[str], None]] = None
+        self.on_room_empty: Optional[Callable[[str], None]] = None
+
+    def register(self, websocket) -> Connection:
+        connection = Connection(websocket, self, self.max_queue, self.policy)
+        self.connections[websocket] = connection
+        connection.start()
+        return connection
+
+    async def unregister(self, websocket):
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        self._detach(connection)
+        await connection.close()
+
+    def can_join(self, connection: Connection, room: str) -> bool:
+        return (
+            not self.max_rooms
+            or room in connection.rooms
+            or len(connection.rooms) < self.max_rooms
+        )
+
+    def join(self, connection: Connection, room: str) -> bool:
+        """Add a connection to a room. Returns False if it is already in max_rooms rooms"""
+        if not self.can_join(connection, room):
+            self.rejected_joins += 1
+            return False
+        connection.rooms.add(room)
+        connection.touch()
+        if self.index.subscribe(room, connection) and self.on_room_created:
+            self.on_room_created(room)
+        return True
+
+    def leave(self, connection: Connection, room: str):
+        connection.rooms.discard(room)
+        connection.sent_seq.pop(room, None)
+        connection.touch()
+        if self.index.unsubscribe(room, connection):
+            # Empty rooms keep nothing around, not even their latency window
+            self.latency.pop(room, None)
+            self.fanout_time.pop(room, None)
+            if self.on_room_empty:
+                self.on_room_empty(room)
+
+    def encode(self, room: str, data: dict, entity: Optional[dict] = None) -> OutboundMessage:
+        """Encode a message once. `entity` is the full object a patch applies to, if known"""
+        return OutboundMessage(
+            room, json.dumps(data), entity_key(data), private_org(data),
+            event_priority(data, entity), patch_fields(data)
+        )
+
+    def publish(self, room: str, data: dict) -> int:
+        """Encode a message once and queue it on every connection in the room"""
+        if not self.index.match(room):
+            return 0
+        return self.publish_message(self.encode(room, data))
+
+    def publish_message(self, message: OutboundMessage, skip: Iterable[str] = ()) -> int:
+        """Queue a message on every connection matching its room.
+
+        `skip` lists rooms the same event was already delivered through,
+        connections matching one of those have their copy already.
+        """
+        members = self.index.match(message.room)
+        for room in skip:
+            if members:
+                members -= self.index.match(room)
+        if not members:
+            return 0
+        self.published += 1
+        delivered = 0
+        started = time.perf_counter()
+        # match() builds a new set, eviction can't change it while we iterate
+        for connection in members:
+            if connection.offer(message):
+                delivered += 1
+        histogram = self.fanout_time.get(message.room)
+        if histogram is None:
+            histogram = self.fanout_time[message.room] = Histogram()
+        histogram.observe(time.perf_counter() - started)
+        return delivered
+
+    def evict(self, connection: Connection, reason: str, code: int = CLOSE_SLOW_CONSUMER):
+        """Drop a slow, broken or idle connection without blocking the caller"""
+        if connection.closed:
+            return
+        log.info(f"🐢 Evicting connection ({reason})")
+        self.evicted += 1
+        self.evictions[reason] = self.evictions.get(reason, 0) + 1
+        connection.closed = True
+        self._detach(connection)
+        self.connections.pop(connection.websocket, None)
+        asyncio.ensure_future(self._close_socket(connection, code, reason))
+
+    async def _close_socket(self, connection: Connection, code: int, reason: str):
+        try:
+            await connection.websocket.close(code, reason.replace("_", " "))
+        except Exception:
+            pass
+        await connection.close()
+
+    def _detach(self, connection: Connection):
+        for room in list(connection.rooms):
+            self.leave(connection, room)
+
+    def record_latency(self, room: str, seconds: float):
+        stats = self.latency.get(room)
+        if stats is None:
+            stats = self.latency[room] = LatencyStats()
+        stats.record(seconds)
+        self.delivery_time.observe(seconds)
+
+    def forget_unused_rooms(self) -> int:
+        """Drop per-room stats of rooms nobody is subscribed to any more (e.g. through a wildcard)"""
+        unused = [room for room in set(self.latency) | set(self.fanout_time) if not self.index.match(room)]
+        for room in unused:
+            self.latency.pop(room, None)
+            self.fanout_time.pop(room, None)
+        return len(unused)
+
+    def latency_report(self) -> Dict[str, dict]:
+        """Per-room delivery latency (publish to socket write)"""
+        return {room: stats.to_dict() for room, stats in self.latency.items()}
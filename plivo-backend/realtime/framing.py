@@ -0,0 +1,51 @@
+"""
+Framing for the internal publish channel between Django and ws_server.
+
+Each message is one line of JSON terminated by a newline. json.dumps
+escapes newlines inside strings, so a frame can never contain a raw one.
+Many frames can be written back to back on a single connection.
+
+A frame names its target as "room", or as "rooms" for an event that goes
+to several rooms at once.
+"""
+import json
+from .topics import as_rooms
+
+# Upper bound for a single frame, anything bigger is treated as a protocol error
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def encode_frame(room, data: dict) -> bytes:
+    """Encode one publish request as a newline terminated JSON frame"""
+    rooms = as_rooms(room)
+    target = {"room": rooms[0]} if len(rooms) == 1 else {"rooms": rooms}
+    return json.dumps({**target, "data": data}, separators=(",", ":")).encode() + b"\n"
+
+
+def frame_rooms(frame) -> list:
+    """Rooms a decoded frame is published to, empty if it names none"""
+    if not isinstance(frame, dict):
+        return []
+    if isinstance(frame.get("rooms"), list):
+        return [room for room in frame["rooms"] if isinstance(room, str) and room]
+    room = frame.get("room")
+    return [room] if isinstance(room, str) and room else []
+
+
+async def read_frames(reader):
+    """Yield decoded frames from a stream until the peer closes it.
+
+    Frames that are not valid JSON are yielded as None so the caller can
+    count them without the whole connection being dropped.
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
@@ -0,0 +1,92 @@
+"""
+Connection housekeeping for ws_server.
+
+One task sweeps every connection each ping interval instead of one
+keepalive task per socket:
+
+- pings every connection at once and evicts the ones whose pong does not
+  come back within ping_timeout (half-open TCP connections, dead peers)
+- evicts connections that have not been in any room for idle_timeout
+- drops per-room state nobody is subscribed to any more
+- takes member access away from connections whose token has expired
+
+Evictions are counted per reason in FanoutEngine.evictions.
+"""
+import asyncio
+import logging
+import time
+
+from .fanout import CLOSE_POLICY, FanoutEngine
+
+log = logging.getLogger("ws_server.lifecycle")
+
+DEFAULT_PING_INTERVAL = 20.0
+DEFAULT_PING_TIMEOUT = 20.0
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+
+class LifecycleManager:
+    def __init__(self, engine: FanoutEngine, ping_interval: float = DEFAULT_PING_INTERVAL,
+                 ping_timeout: float = DEFAULT_PING_TIMEOUT, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.engine = engine
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.idle_timeout = idle_timeout
+        self.sweeps = 0
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                log.error(f"❌ Connection sweep failed: {e}")
+
+    async def sweep(self):
+        self.sweeps += 1
+        self.evict_idle()
+        self.expire_members()
+        self.engine.forget_unused_rooms()
+        if self.ping_timeout:
+            await self.ping_all()
+
+    def evict_idle(self) -> int:
+        """Evict connections that have been in no room for idle_timeout"""
+        if not self.idle_timeout:
+            return 0
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = [
+            connection for connection in self.engine.connections.values()
+            if not connection.rooms and connection.last_activity < cutoff
+        ]
+        for connection in idle:
+            self.engine.evict(connection, "idle", CLOSE_POLICY)
+        return len(idle)
+
+    def expire_members(self) -> int:
+        """Connections whose token expired keep their rooms but only get public events"""
+        now = time.time()
+        expired = [
+            connection for connection in self.engine.connections.values()
+            if connection.member_until is not None and connection.member_until < now
+        ]
+        for connection in expired:
+            connection.authorize(None)
+        return len(expired)
+
+    async def ping_all(self) -> int:
+        """Ping every connection concurrently and evict those that don't answer in time"""
+        waiters = {}
+        for connection in list(self.engine.connections.values()):
+            try:
+                waiters[await connection.websocket.ping()] = connection
+            except Exception:
+                # Already closing, the handler cleans it up
+                continue
+        if not waiters:
+            return 0
+        _, pending = await asyncio.wait(waiters, timeout=self.ping_timeout)
+        for waiter in pending:
+            waiter.cancel()
+            self.engine.evict(waiters[waiter], "ping_timeout", CLOSE_POLICY)
+        return len(pending)
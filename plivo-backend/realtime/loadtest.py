@@ -0,0 +1,445 @@
+"""
+Load test for ws_server fan-out.
+
+    python -m realtime.loadtest --clients 10000 --rooms 1000 --rate 500 --duration 30
+
+Opens `--clients` WebSocket connections, joins each to one of `--rooms`
+rooms (uniformly or with a zipf skew, so a few rooms are very busy),
+publishes through the internal port at `--rate` messages per second and
+reports end-to-end delivery latency, throughput, drops and server RSS.
+With `--noisy-share` that fraction of the messages goes to the first
+room's organization, and latency of the other rooms is reported on its
+own, to see how much one busy tenant slows down the rest.
+
+The server is started as a subprocess by default (`--server subprocess`),
+can run in this process's event loop (`inprocess`, simpler but the clients
+compete with it for the loop) or be one that is already running (`external`).
+A subprocess ws_server can run `--workers N` processes sharing the port
+(WS_WORKERS) and on uvloop (`--uvloop`, WS_UVLOOP); RSS is then summed over
+the supervisor and its workers.
+
+`--transport channels` benchmarks the Django ASGI app instead of
+ws_server (REALTIME_TRANSPORT = 'channels'): messages are published with
+the channel layer's group_send, as Django does in that mode. Run it
+`inprocess` on the in-memory layer (the app is served by uvicorn), or as a
+`subprocess` (daphne) with CHANNEL_LAYER_URL set, as the layer must then be
+shared. Compare with `--server inprocess` / `subprocess` runs of ws_server.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+import zlib
+from pathlib import Path
+
+import msgpack
+import websockets
+
+from .framing import encode_frame
+from .topics import as_rooms
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+LOADTEST_TYPE = "loadtest"
+NOISY_ROOM = "org_0_update"
+CHANNELS_PORT = 8001
+
+
+def percentile(ordered: list, pct: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(pct / 100.0 * len(ordered)))]
+
+
+def rss_kb(pid: int) -> int:
+    """Resident set size of a process, from /proc"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    if pid == os.getpid():
+        # Peak rather than current, but better than nothing off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return 0
+
+
+def tree_rss_kb(pid: int) -> int:
+    """Resident set size of a process and its children (ws_server's workers)"""
+    total = rss_kb(pid)
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as children:
+            total += sum(tree_rss_kb(int(child)) for child in children.read().split())
+    except OSError:
+        pass
+    return total
+
+
+def assign_rooms(clients: int, rooms: int, distribution: str, skew: float) -> list:
+    if distribution == "zipf":
+        weights = [1.0 / (rank ** skew) for rank in range(1, rooms + 1)]
+        return [f"org_{r}_update" for r in random.choices(range(rooms), weights=weights, k=clients)]
+    return [f"org_{i % rooms}_update" for i in range(clients)]
+
+
+def decode(frame, encoding: str):
+    if encoding == "msgpack":
+        return msgpack.unpackb(frame)
+    if encoding == "deflate":
+        return json.loads(zlib.decompress(frame))
+    return json.loads(frame)
+
+
+class Results:
+    def __init__(self):
+        self.latencies = []
+        # Latencies outside the noisy room
+        self.quiet_latencies = []
+        self.received = 0
+        self.expected = 0
+        self.published = 0
+        self.connect_failures = 0
+        self.disconnects = 0
+        self.server_rss_kb = 0
+
+
+async def run_client(uri: str, room: str, options: dict, results: Results, joined: list, stop: asyncio.Event,
+                     origin=None):
+    try:
+        websocket = await websockets.connect(uri, max_queue=None, compression=None, origin=origin)
+    except Exception:
+        results.connect_failures += 1
+        return
+    try:
+        await websocket.send(json.dumps({"action": "join", "room": room, **options}))
+        joined.append(room)
+        encoding = options.get("encoding", "json")
+        while not stop.is_set():
+            try:
+                frame = await asyncio.wait_for(websocket.recv(), 0.5)
+            except asyncio.TimeoutError:
+                continue
+            now = time.time()
+            message = decode(frame, encoding)
+            for event in message if isinstance(message, list) else [message]:
+                if isinstance(event, dict) and event.get("type") == LOADTEST_TYPE:
+                    results.received += 1
+                    results.latencies.append(now - event["data"]["sent_at"])
+                    if room != NOISY_ROOM:
+                        results.quiet_latencies.append(now - event["data"]["sent_at"])
+    except websockets.ConnectionClosed:
+        results.disconnects += 1
+    finally:
+        await websocket.close()
+
+
+class InternalPort:
+    """Publishes through ws_server's internal listener"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.writer = None
+
+    async def open(self):
+        _, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def send(self, messages: list):
+        self.writer.write(b"".join(encode_frame(room, data) for room, data in messages))
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+class ChannelLayerSink:
+    """Publishes with group_send, as Django does with REALTIME_TRANSPORT = 'channels'"""
+
+    async def open(self):
+        from channels.layers import get_channel_layer
+        from .consumers import group_message
+        self.layer = get_channel_layer()
+        self.group_message = group_message
+
+    async def send(self, messages: list):
+        for room, data in messages:
+            rooms = as_rooms(room)
+            for target in rooms:
+                await self.layer.group_send(target, self.group_message(rooms, target, data))
+
+    def close(self):
+        pass
+
+
+async def publish(sink, rooms: dict, rate: float, duration: float, results: Results, noisy_share: float = 0.0):
+    """Publish at `rate` messages per second to rooms that have subscribers"""
+    await sink.open()
+    targets = list(rooms)
+    interval = 1.0 / rate
+    started = time.monotonic()
+    sent = 0
+    while time.monotonic() - started < duration:
+        # Catch up in bursts if the loop fell behind, so the average rate holds
+        due = int((time.monotonic() - started) / interval) + 1
+        messages = []
+        while sent < due:
+            if noisy_share and NOISY_ROOM in rooms and random.random() < noisy_share:
+                room = NOISY_ROOM
+            else:
+                room = random.choice(targets)
+            messages.append((room, {
+                "type": LOADTEST_TYPE,
+                "data": {"id": sent, "sent_at": time.time()},
+                "room": room,
+            }))
+            results.expected += rooms[room]
+            sent += 1
+        await sink.send(messages)
+        await asyncio.sleep(interval)
+    results.published = sent
+    sink.close()
+
+
+async def wait_for_port(host: str, port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def start_inprocess():
+    """Run ws_server's listeners on this event loop, with its logging silenced"""
+    sys.stdout = open(os.devnull, "w")
+    logging.getLogger("ws_server").setLevel(logging.ERROR)
+    sys.path.insert(0, str(BASE_DIR))
+    import ws_server
+    from websockets.server import serve
+    await ws_server.backplane.start()
+    asyncio.ensure_future(ws_server.scheduler.run())
+    server = await serve(ws_server.handler, "localhost", 8765, max_queue=None)
+    internal = await asyncio.start_server(ws_server.handle_internal, "localhost", 9000)
+    return server, internal
+
+
+def setup_channels():
+    os.environ["REALTIME_TRANSPORT"] = "channels"
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
+    sys.path.insert(0, str(BASE_DIR))
+    import django
+    django.setup()
+
+
+async def start_channels_inprocess(port: int):
+    """Serve the Django ASGI app with uvicorn on this event loop"""
+    import uvicorn
+    from mysite.asgi import application
+    config = uvicorn.Config(application, host="localhost", port=port, log_level="error", lifespan="off")
+    server = uvicorn.Server(config)
+    task = asyncio.ensure_future(server.serve())
+    return server, task
+
+
+def raise_fd_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+async def run(args) -> dict:
+    results = Results()
+    process = None
+    inprocess = None
+    channels_server = None
+    stdout = sys.stdout
+    channels = args.transport == "channels"
+    url = args.url or (f"ws://localhost:{CHANNELS_PORT}/ws/" if channels else "ws://localhost:8765")
+    origin = None
+    if channels:
+        setup_channels()
+        from django.conf import settings
+        # The app only takes WebSockets from the frontend's origins
+        origin = settings.CORS_ALLOWED_ORIGINS[0]
+    if channels and args.server == "subprocess":
+        process = subprocess.Popen(
+            [sys.executable, "-m", "daphne", "-b", "localhost", "-p", str(CHANNELS_PORT), "mysite.asgi:application"],
+            cwd=BASE_DIR, env=os.environ.copy(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        server_pid = process.pid
+    elif channels and args.server == "inprocess":
+        channels_server = await start_channels_inprocess(CHANNELS_PORT)
+        server_pid = os.getpid()
+    elif args.server == "subprocess":
+        env = {**os.environ, "WS_SNAPSHOT_SEED": "0", "WS_WORKERS": str(args.workers)}
+        if args.uvloop:
+            env["WS_UVLOOP"] = "1"
+        process = subprocess.Popen(
+            [sys.executable, "ws_server.py"], cwd=BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        server_pid = process.pid
+    elif args.server == "inprocess":
+        inprocess = await start_inprocess()
+        server_pid = os.getpid()
+    else:
+        server_pid = args.server_pid
+
+    try:
+        if channels:
+            await wait_for_port("localhost", CHANNELS_PORT)
+            sink = ChannelLayerSink()
+        else:
+            await wait_for_port("localhost", 8765)
+            await wait_for_port(args.internal_host, args.internal_port)
+            sink = InternalPort(args.internal_host, args.internal_port)
+        rss_before = tree_rss_kb(server_pid) if server_pid else 0
+
+        options = {"encoding": args.encoding}
+        if args.batch_ms:
+            options["batch_ms"] = args.batch_ms
+        room_of = assign_rooms(args.clients, args.rooms, args.distribution, args.skew)
+        stop = asyncio.Event()
+        joined = []
+        clients = []
+        connect_started = time.monotonic()
+        for start in range(0, args.clients, args.connect_batch):
+            batch = [
+                asyncio.ensure_future(run_client(url, room, options, results, joined, stop, origin))
+                for room in room_of[start:start + args.connect_batch]
+            ]
+            clients += batch
+            # Let this batch finish its handshakes before opening the next one
+            settled = min(start + args.connect_batch, args.clients)
+            while len(joined) + results.connect_failures + results.disconnects < settled:
+                await asyncio.sleep(0.01)
+        connect_seconds = time.monotonic() - connect_started
+        # Joins are processed asynchronously by the server
+        await asyncio.sleep(args.settle)
+
+        subscribers = {}
+        for room in joined:
+            subscribers[room] = subscribers.get(room, 0) + 1
+        publish_started = time.monotonic()
+        await publish(sink, subscribers, args.rate, args.duration, results, args.noisy_share)
+        # Give in-flight messages time to arrive
+        await asyncio.sleep(args.drain)
+        elapsed = time.monotonic() - publish_started
+        results.server_rss_kb = tree_rss_kb(server_pid) if server_pid else 0
+
+        stop.set()
+        await asyncio.gather(*clients, return_exceptions=True)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+        if inprocess is not None:
+            for server in inprocess:
+                server.close()
+            for server in inprocess:
+                await server.wait_closed()
+            sys.stdout = stdout
+        if channels_server is not None:
+            server, task = channels_server
+            server.should_exit = True
+            await task
+
+    ordered = sorted(results.latencies)
+    quiet = sorted(results.quiet_latencies)
+    return {
+        "clients": len(joined),
+        "rooms": len(subscribers),
+        "connect_failures": results.connect_failures,
+        "connect_seconds": round(connect_seconds, 2),
+        "published": results.published,
+        "expected_deliveries": results.expected,
+        "delivered": results.received,
+        "dropped": results.expected - results.received,
+        "deliveries_per_second": round(results.received / elapsed, 1),
+        "latency_ms": {
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "p999": round(percentile(ordered, 99.9) * 1000, 3),
+            "max": round((ordered[-1] if ordered else 0) * 1000, 3),
+        },
+        "quiet_latency_ms": {
+            "p50": round(percentile(quiet, 50) * 1000, 3),
+            "p99": round(percentile(quiet, 99) * 1000, 3),
+        },
+        "server_rss_mb": {
+            "before": round(rss_before / 1024, 1),
+            "after": round(results.server_rss_kb / 1024, 1),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--distribution", choices=["uniform", "zipf"], default="uniform")
+    parser.add_argument("--skew", type=float, default=1.1, help="zipf exponent")
+    parser.add_argument("--rate", type=float, default=100, help="published messages per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of publishing")
+    parser.add_argument("--encoding", choices=["json", "msgpack", "deflate"], default="json")
+    parser.add_argument("--batch-ms", type=int, default=0)
+    parser.add_argument("--noisy-share", type=float, default=0.0,
+                        help=f"fraction of messages sent to {NOISY_ROOM}")
+    parser.add_argument("--server", choices=["subprocess", "inprocess", "external"], default="subprocess")
+    parser.add_argument("--server-pid", type=int, default=0, help="pid of an external server, for RSS")
+    parser.add_argument("--transport", choices=["ws_server", "channels"], default="ws_server",
+                        help="standalone ws_server or the Django ASGI app with Channels")
+    parser.add_argument("--workers", type=int, default=1, help="ws_server worker processes (subprocess only)")
+    parser.add_argument("--uvloop", action="store_true", help="run the ws_server subprocess on uvloop")
+    parser.add_argument("--url", default=None, help="WebSocket URL, defaults to the transport's")
+    parser.add_argument("--internal-host", default="localhost")
+    parser.add_argument("--internal-port", type=int, default=9000)
+    parser.add_argument("--connect-batch", type=int, default=200)
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds to wait after joining")
+    parser.add_argument("--drain", type=float, default=2.0, help="seconds to wait after publishing")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+    if args.transport == "channels" and (args.encoding != "json" or args.batch_ms):
+        parser.error("the channels transport only sends JSON frames one at a time")
+    if args.transport == "channels" and args.server == "subprocess" and not os.environ.get("CHANNEL_LAYER_URL"):
+        parser.error("a channels subprocess needs CHANNEL_LAYER_URL, the in-memory layer can't be published to from here")
+
+    if (args.workers > 1 or args.uvloop) and (args.transport != "ws_server" or args.server != "subprocess"):
+        parser.error("--workers and --uvloop apply to a ws_server subprocess")
+
+    limit = raise_fd_limit()
+    if args.clients * (2 if args.server != "external" else 1) > limit - 100:
+        print(f"⚠️ {args.clients} clients may exceed the open file limit ({limit})")
+    random.seed(0)
+    report = asyncio.run(run(args))
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    latency = report["latency_ms"]
+    print(f"🔌 {report['clients']} clients in {report['rooms']} rooms "
+          f"({report['connect_failures']} failed, connected in {report['connect_seconds']}s)")
+    print(f"📤 {report['published']} published, {report['delivered']}/{report['expected_deliveries']} delivered, "
+          f"{report['dropped']} dropped, {report['deliveries_per_second']} deliveries/s")
+    print(f"⏱️ latency p50 {latency['p50']} ms, p99 {latency['p99']} ms, "
+          f"p999 {latency['p999']} ms, max {latency['max']} ms")
+    if args.noisy_share:
+        quiet = report["quiet_latency_ms"]
+        print(f"🤫 latency outside {NOISY_ROOM} p50 {quiet['p50']} ms, p99 {quiet['p99']} ms")
+    print(f"🧠 server RSS {report['server_rss_mb']['before']} MB -> {report['server_rss_mb']['after']} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Leveled logging for ws_server.
+
+Messages keep the emoji style of the rest of the project but go through
+the logging module, so WS_LOG_LEVEL decides what is written. Per-message
+logs on the hot path use a sampled logger that only lets one record in
+WS_LOG_SAMPLE through. Disabled levels cost a level check and nothing else.
+"""
+import logging
+import os
+
+
+class SampleFilter(logging.Filter):
+    """Lets one in `every` records through"""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self.seen = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        self.seen += 1
+        if self.seen % self.every:
+            return False
+        if self.every > 1:
+            record.msg = f"{record.msg} (1 in {self.every})"
+        return True
+
+
+def setup_logging(level: str = None):
+    """Write ws_server logs at WS_LOG_LEVEL, other libraries only from WARNING up"""
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    logging.getLogger("ws_server").setLevel((level or os.environ.get("WS_LOG_LEVEL", "INFO")).upper())
+
+
+def sampled_logger(name: str, every: int = None) -> logging.Logger:
+    """Logger for per-message records, sampled to one in `every` (WS_LOG_SAMPLE)"""
+    logger = logging.getLogger(name)
+    if not any(isinstance(f, SampleFilter) for f in logger.filters):
+        logger.addFilter(SampleFilter(every or int(os.environ.get("WS_LOG_SAMPLE", 100))))
+    return logger
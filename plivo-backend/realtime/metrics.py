@@ -0,0 +1,232 @@
+"""
+Metrics for ws_server, served on their own port.
+
+    GET /metrics  Prometheus text format
+    GET /debug    JSON view of the same numbers plus room sizes
+
+Metrics are gathered from the live objects at scrape time, so the only
+cost between scrapes is the histogram updates on the hot path.
+"""
+import asyncio
+import json
+import logging
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .priority import PRIORITIES, PRIORITY_NAMES
+
+log = logging.getLogger("ws_server.metrics")
+
+# Seconds, from 100µs to 5s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+
+class Histogram:
+    """Fixed-bucket histogram, cheap enough to update on every message"""
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        # One slot per bound plus +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        total = 0
+        buckets = []
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            total += count
+            buckets.append(("+Inf" if bound == float("inf") else repr(bound), total))
+        return buckets
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "sum": round(self.sum, 6), "buckets": dict(self.cumulative())}
+
+
+class Metric:
+    """One metric family: samples are (labels, value), values are Histograms for histograms"""
+    __slots__ = ("name", "kind", "help", "samples")
+
+    def __init__(self, name: str, kind: str, help: str, samples):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.samples = samples if isinstance(samples, list) else [({}, samples)]
+
+
+def _labels(labels: dict, extra: str = "") -> str:
+    parts = [f'{key}="{str(value)}"' for key, value in labels.items()]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_prometheus(metrics: List[Metric]) -> str:
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for labels, value in metric.samples:
+            if metric.kind == HISTOGRAM:
+                for bound, count in value.cumulative():
+                    le = 'le="%s"' % bound
+                    lines.append(f"{metric.name}_bucket{_labels(labels, le)} {count}")
+                lines.append(f"{metric.name}_sum{_labels(labels)} {value.sum}")
+                lines.append(f"{metric.name}_count{_labels(labels)} {value.count}")
+            else:
+                lines.append(f"{metric.name}{_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def render_json(metrics: List[Metric]) -> dict:
+    view = {}
+    for metric in metrics:
+        samples = [
+            {**labels, "value": value.to_dict() if metric.kind == HISTOGRAM else value}
+            for labels, value in metric.samples
+        ]
+        view[metric.name] = samples[0]["value"] if len(samples) == 1 and not metric.samples[0][0] else samples
+    return view
+
+
+class RateMeter:
+    """Per-second rate of a counter over a sliding window of samples"""
+
+    def __init__(self, read: Callable[[], int], window: int = 10):
+        self.read = read
+        self.samples = []
+        self.window = window
+
+    def sample(self):
+        self.samples.append((time.monotonic(), self.read()))
+        del self.samples[:-self.window]
+
+    def rate(self) -> float:
+        if len(self.samples) < 2:
+            return 0.0
+        (t0, v0), (t1, v1) = self.samples[0], self.samples[-1]
+        return (v1 - v0) / (t1 - t0) if t1 > t0 else 0.0
+
+
+class LoopMonitor:
+    """Measures event loop lag: how late a sleep of `interval` wakes up"""
+
+    def __init__(self, interval: float = 0.5, meters: Optional[List[RateMeter]] = None):
+        self.interval = interval
+        self.lag = Histogram()
+        self.last_lag = 0.0
+        self.meters = meters or []
+
+    async def run(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.last_lag = max(0.0, time.monotonic() - started - self.interval)
+            self.lag.observe(self.last_lag)
+            for meter in self.meters:
+                meter.sample()
+
+
+class MetricsServer:
+    """Minimal HTTP server for scrapes, kept off the WebSocket port"""
+
+    def __init__(self, collect: Callable[[], List[Metric]], debug: Callable[[], dict]):
+        self.collect = collect
+        self.debug = debug
+
+    async def start(self, host: str, port: int):
+        server = await asyncio.start_server(self._handle, host, port)
+        log.info(f"📊 Metrics at http://{host}:{port}/metrics")
+        return server
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            # Headers are not needed, but must be read before answering
+            while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            path = parts[1].split("?")[0] if len(parts) > 1 else ""
+            if path == "/metrics":
+                status, content_type = "200 OK", "text/plain; version=0.0.4"
+                body = render_prometheus(self.collect())
+            elif path == "/debug":
+                status, content_type = "200 OK", "application/json"
+                body = json.dumps(self.debug(), indent=2)
+            else:
+                status, content_type, body = "404 Not Found", "text/plain", "not found\n"
+            payload = body.encode()
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+            )
+            await writer.drain()
+        except Exception as e:
+            log.warning(f"⚠️ Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+
+def engine_metrics(engine) -> List[Metric]:
+    """Metrics of a FanoutEngine"""
+    depths = [len(connection.queue) for connection in engine.connections.values()]
+    lanes = [0] * len(PRIORITIES)
+    for connection in engine.connections.values():
+        for priority, depth in enumerate(connection.queue.depths()):
+            lanes[priority] += depth
+    return [
+        Metric("ws_connections", GAUGE, "Open WebSocket connections", len(engine.connections)),
+        Metric("ws_rooms", GAUGE, "Rooms and wildcards with at least one member", len(engine.rooms)),
+        Metric("ws_room_members", GAUGE, "Members of the largest rooms",
+               [({"room": room}, size) for room, size in room_sizes(engine).items()]),
+        Metric("ws_messages_published_total", COUNTER, "Room messages fanned out", engine.published),
+        Metric("ws_messages_dropped_total", COUNTER, "Messages dropped by slow consumer policies", engine.dropped),
+        Metric("ws_messages_filtered_total", COUNTER, "Private messages withheld from non-members", engine.filtered),
+        Metric("ws_messages_conflated_total", COUNTER, "Queued messages superseded by a newer one", engine.conflated),
+        Metric("ws_messages_coalesced_total", COUNTER, "Messages replaced within a batch window", engine.coalesced),
+        Metric("ws_rejected_joins_total", COUNTER, "Joins refused by the per-connection room cap", engine.rejected_joins),
+        Metric("ws_evictions_total", COUNTER, "Evicted connections by reason",
+               [({"reason": reason}, count) for reason, count in engine.evictions.items()]),
+        Metric("ws_send_queue_depth_total", GAUGE, "Messages waiting in all send queues", sum(depths)),
+        Metric("ws_send_queue_depth_max", GAUGE, "Longest send queue", max(depths, default=0)),
+        Metric("ws_send_queue_lane_depth", GAUGE, "Messages waiting in all send queues, per priority lane",
+               [({"lane": PRIORITY_NAMES[priority]}, depth) for priority, depth in enumerate(lanes)]),
+        Metric("ws_fanout_seconds", HISTOGRAM, "Time to queue a message on every member, per room",
+               [({"room": room}, histogram) for room, histogram in engine.fanout_time.items()]),
+        Metric("ws_delivery_seconds", HISTOGRAM, "Publish to socket write latency", engine.delivery_time),
+    ]
+
+
+def scheduler_metrics(scheduler) -> List[Metric]:
+    """Per-tenant metrics of a FairScheduler"""
+    tenants = list(scheduler.tenants.values())
+    return [
+        Metric("ws_scheduler_pending", GAUGE, "Delivery jobs waiting for their tenant's turn", scheduler.pending),
+        Metric("ws_tenant_pending", GAUGE, "Delivery jobs waiting, per organization",
+               [({"org": tenant.key}, len(tenant.jobs)) for tenant in tenants]),
+        Metric("ws_tenant_jobs_total", COUNTER, "Delivery jobs run, per organization",
+               [({"org": tenant.key}, tenant.executed) for tenant in tenants]),
+        Metric("ws_tenant_throttled_total", COUNTER, "Turns cut short by the publish budget, per organization",
+               [({"org": tenant.key}, tenant.throttled) for tenant in tenants]),
+        Metric("ws_tenant_dropped_total", COUNTER, "Delivery jobs dropped over the pending limit, per organization",
+               [({"org": tenant.key}, tenant.dropped) for tenant in tenants]),
+        Metric("ws_tenant_queue_delay_seconds", HISTOGRAM, "Time a delivery job waited for its turn, per organization",
+               [({"org": tenant.key}, tenant.delay) for tenant in tenants]),
+    ]
+
+
+def room_sizes(engine, limit: int = 100) -> Dict[str, int]:
+    """The `limit` largest rooms by member count"""
+    ordered = sorted(engine.rooms.items(), key=lambda item: len(item[1]), reverse=True)
+    return {room: len(members) for room, members in ordered[:limit]}
@@ -0,0 +1,61 @@
+"""
+Delivery priority of room messages.
+
+Each connection's send queue has one lane per priority and always sends
+from the highest non-empty lane, so when a client falls behind a critical
+incident or an outage still goes out ahead of routine edits:
+
+- critical: an unresolved incident of high or critical severity being
+  opened or changing status or severity, a service going into partial or
+  major outage, and control frames (snapshots, resync notices) that must
+  stay ahead of live events
+- high: any other incident or service creation, removal, status or
+  severity change
+- normal: everything else, e.g. description or name edits
+
+Messages of different lanes can overtake each other, so a client may see
+`seq` values out of order while it is behind. Session tokens resume a room
+from before its oldest message not sent yet, so nothing overtaken is lost.
+"""
+from typing import Optional
+
+PRIORITY_CRITICAL = 0
+PRIORITY_HIGH = 1
+PRIORITY_NORMAL = 2
+PRIORITIES = (PRIORITY_CRITICAL, PRIORITY_HIGH, PRIORITY_NORMAL)
+PRIORITY_NAMES = ("critical", "high", "normal")
+
+CONTROL_TYPES = ("snapshot", "resync_required")
+URGENT_SEVERITIES = ("high", "critical")
+URGENT_STATUSES = ("partial_outage", "major_outage")
+# Fields whose change makes an update more than a routine edit
+SIGNIFICANT_FIELDS = ("status", "severity", "currentStatus")
+
+
+def event_priority(data: dict, entity: Optional[dict] = None) -> int:
+    """Priority of an event. `entity` is the full object a patch applies to, when known"""
+    if not isinstance(data, dict):
+        return PRIORITY_NORMAL
+    event_type = data.get("type")
+    if not isinstance(event_type, str):
+        return PRIORITY_NORMAL
+    if event_type in CONTROL_TYPES:
+        return PRIORITY_CRITICAL
+    kind, _, action = event_type.partition("_")
+    if kind not in ("incident", "service"):
+        return PRIORITY_NORMAL
+    fields = data.get("data") if isinstance(data.get("data"), dict) else {}
+    significant = (
+        action in ("created", "deleted")
+        or not data.get("patch")
+        or any(name in fields for name in SIGNIFICANT_FIELDS)
+    )
+    if not significant:
+        return PRIORITY_NORMAL
+    # A patch only carries what changed, the rest comes from the entity
+    current = {**(entity or {}), **fields}
+    if kind == "incident":
+        urgent = current.get("severity") in URGENT_SEVERITIES and current.get("status") != "resolved"
+    else:
+        urgent = current.get("currentStatus") in URGENT_STATUSES
+    return PRIORITY_CRITICAL if urgent else PRIORITY_HIGH
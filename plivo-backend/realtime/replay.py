@@ -0,0 +1,98 @@
+"""
+Per-room replay buffers so reconnecting clients only receive what they missed.
+
+Every room message carries a sequence number that increases by one per
+message. Each room keeps its most recent messages in a ring buffer; a client
+that rejoins with the last sequence it saw gets the newer messages from the
+buffer, or a resync marker when they are no longer all there.
+"""
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+DEFAULT_CAPACITY = 256
+DEFAULT_MAX_ROOMS = 10000
+
+
+class RoomLog:
+    """Ring buffer of (seq, message) for one room"""
+
+    def __init__(self, capacity: int):
+        self.entries = deque(maxlen=capacity)
+        self.last_seq = 0
+
+    def append(self, seq: int, message):
+        # A jump means this process missed messages (e.g. it was not subscribed),
+        # so nothing older than `seq` can be replayed reliably any more
+        if self.entries and seq != self.last_seq + 1:
+            self.entries.clear()
+        self.entries.append((seq, message))
+        self.last_seq = seq
+
+    def since(self, last_seq: int) -> Optional[list]:
+        """Messages after `last_seq`, or None when the gap can't be filled"""
+        if last_seq == self.last_seq:
+            return []
+        if last_seq > self.last_seq or not self.entries:
+            return None
+        first_seq = self.entries[0][0]
+        if last_seq < first_seq - 1:
+            return None
+        return [message for seq, message in self.entries if seq > last_seq]
+
+
+class ReplayBuffer:
+    """Room logs for the most recently active rooms"""
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, max_rooms: int = DEFAULT_MAX_ROOMS):
+        self.capacity = capacity
+        self.max_rooms = max_rooms
+        self.logs: "OrderedDict[str, RoomLog]" = OrderedDict()
+        self.replayed = 0
+        self.resyncs = 0
+
+    def record(self, room: str, seq: int, message):
+        log = self.logs.get(room)
+        if log is None:
+            log = self.logs[room] = RoomLog(self.capacity)
+            if len(self.logs) > self.max_rooms:
+                self.logs.popitem(last=False)
+        else:
+            self.logs.move_to_end(room)
+        log.append(seq, message)
+
+    def resume(self, room: str, seq: int):
+        """Start an empty log at `seq`, for clients resuming a room this process has no messages of.
+
+        Clients that saw `seq` then miss nothing until the next message.
+        """
+        log = self.logs.get(room)
+        if log is not None and log.entries:
+            return
+        if log is None:
+            log = self.logs[room] = RoomLog(self.capacity)
+            if len(self.logs) > self.max_rooms:
+                self.logs.popitem(last=False)
+        log.last_seq = seq
+
+    def last_seq(self, room: str) -> int:
+        log = self.logs.get(room)
+        return log.last_seq if log else 0
+
+    def missed(self, room: str, last_seq: int) -> Optional[List]:
+        """Messages a client that saw `last_seq` has missed, or None if it must resync"""
+        log = self.logs.get(room)
+        if log is None:
+            # Nothing was published since this process started (or the log aged out)
+            result = [] if last_seq == 0 else None
+        else:
+            result = log.since(last_seq)
+        if result is None:
+            self.resyncs += 1
+        else:
+            self.replayed += len(result)
+        return result
+
+
+def resync_required(room: str, seq: int) -> dict:
+    """Marker telling a client to rebuild its state over REST"""
+    return {"type": "resync_required", "room": room, "seq": seq}
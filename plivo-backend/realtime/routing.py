@@ -0,0 +1,8 @@
+from django.urls import re_path
+
+from .consumers import RoomConsumer
+
+# Served at the root as ws_server is, and at /ws/ next to the REST API
+websocket_urlpatterns = [
+    re_path(r"^(ws/?)?$", RoomConsumer.as_asgi()),
+]
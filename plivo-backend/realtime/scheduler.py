@@ -0,0 +1,184 @@
+"""
+Tenant-fair scheduling of broadcast work.
+
+Fanning a message out costs time proportional to its audience, and it all
+runs on one event loop. Without scheduling, an organization publishing a
+burst of updates to big rooms holds the loop until its burst is done and
+every other organization waits behind it.
+
+Delivery jobs are queued per tenant (the organization a room belongs to)
+and run by deficit round robin: each turn a tenant gets `quantum * weight`
+credit and runs queued jobs while their cost (the audience size) fits in
+its credit, then the scheduler yields to the loop and moves on to the
+next tenant. A tenant can also have a publish budget, a token bucket of
+`rate` jobs per second with `burst` capacity; jobs over budget wait in
+the tenant's queue without holding up anyone else.
+
+Jobs of one tenant always run in the order they were submitted.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+from .metrics import Histogram
+
+log = logging.getLogger("ws_server.scheduler")
+
+DEFAULT_QUANTUM = 500
+DEFAULT_MAX_PENDING = 10000
+# Seconds an idle tenant's state (and metrics) is kept
+TENANT_IDLE_TIMEOUT = 300.0
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Seconds until the next token"""
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Tenant:
+    """Queued jobs and accounting of one organization"""
+
+    def __init__(self, key, weight: float, budget: Optional[TokenBucket]):
+        self.key = key
+        self.weight = weight
+        self.budget = budget
+        self.jobs = deque()
+        self.deficit = 0.0
+        self.delay = Histogram()
+        self.executed = 0
+        self.throttled = 0
+        self.dropped = 0
+        self.last_active = time.monotonic()
+
+
+class FairScheduler:
+    def __init__(self, quantum: float = DEFAULT_QUANTUM, rate: float = 0, burst: Optional[float] = None,
+                 max_pending: int = DEFAULT_MAX_PENDING, weights: Optional[Dict[object, float]] = None):
+        self.quantum = quantum
+        # Jobs per second per tenant, 0 = unlimited
+        self.rate = rate
+        self.burst = burst if burst is not None else max(rate, 1)
+        self.max_pending = max_pending
+        self.weights = weights or {}
+        self.tenants: Dict[object, Tenant] = {}
+        # Tenants with queued jobs, in round robin order
+        self.active = deque()
+        self._wakeup = asyncio.Event()
+
+    def tenant(self, key) -> Tenant:
+        tenant = self.tenants.get(key)
+        if tenant is None:
+            budget = TokenBucket(self.rate, self.burst) if self.rate else None
+            tenant = self.tenants[key] = Tenant(key, self.weights.get(key, 1.0), budget)
+        return tenant
+
+    def submit(self, key, job: Callable[[], None], cost: float = 1):
+        """Queue a job for a tenant. Over max_pending, the tenant's oldest job is dropped"""
+        tenant = self.tenant(key)
+        if not tenant.jobs:
+            self.active.append(tenant)
+        elif len(tenant.jobs) >= self.max_pending:
+            tenant.jobs.popleft()
+            tenant.dropped += 1
+        tenant.jobs.append((time.monotonic(), cost, job))
+        tenant.last_active = time.monotonic()
+        self._wakeup.set()
+
+    @property
+    def pending(self) -> int:
+        return sum(len(tenant.jobs) for tenant in self.active)
+
+    async def run(self):
+        last_pruned = time.monotonic()
+        while True:
+            if not self.active:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            waits = []
+            for _ in range(len(self.active)):
+                wait = self.run_turn(self.active.popleft())
+                if wait is not None:
+                    waits.append(wait)
+                # Let sockets, the internal listener and other tasks run between tenants
+                await asyncio.sleep(0)
+            if waits and len(waits) == len(self.active):
+                # Everyone left is over budget, sleep until the first token is due
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), min(waits))
+                except asyncio.TimeoutError:
+                    pass
+            if time.monotonic() - last_pruned > TENANT_IDLE_TIMEOUT:
+                last_pruned = time.monotonic()
+                self.forget_idle()
+
+    def run_turn(self, tenant: Tenant) -> Optional[float]:
+        """Run one tenant's share of jobs. Returns seconds to its next token if it ran out of budget"""
+        tenant.deficit += self.quantum * tenant.weight
+        if not self.active and tenant.jobs:
+            # Nobody to be fair to, don't make a big job wait for credit over several turns
+            tenant.deficit = max(tenant.deficit, tenant.jobs[0][1])
+        now = time.monotonic()
+        throttled = None
+        while tenant.jobs:
+            submitted_at, cost, job = tenant.jobs[0]
+            if cost > tenant.deficit:
+                break
+            if tenant.budget is not None and not tenant.budget.take(now):
+                tenant.throttled += 1
+                throttled = tenant.budget.wait_time()
+                break
+            tenant.jobs.popleft()
+            tenant.deficit -= cost
+            tenant.executed += 1
+            tenant.delay.observe(now - submitted_at)
+            try:
+                job()
+            except Exception as e:
+                # One bad job must not stop delivery for everyone
+                log.error(f"❌ Delivery for tenant {tenant.key} failed: {e}")
+            now = time.monotonic()
+        if tenant.jobs:
+            self.active.append(tenant)
+        else:
+            # Credit is not saved up while idle
+            tenant.deficit = 0.0
+            tenant.last_active = now
+        if throttled is not None:
+            # Nothing to carry over while waiting for budget
+            tenant.deficit = min(tenant.deficit, self.quantum * tenant.weight)
+        return throttled
+
+    def forget_idle(self, max_idle: float = TENANT_IDLE_TIMEOUT) -> int:
+        cutoff = time.monotonic() - max_idle
+        idle = [key for key, tenant in self.tenants.items() if not tenant.jobs and tenant.last_active < cutoff]
+        for key in idle:
+            del self.tenants[key]
+        return len(idle)
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """`42:4,7:2` -> {"42": 4.0, "7": 2.0}"""
+    weights = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        key, _, weight = item.partition(":")
+        weights[key.strip()] = float(weight)
+    return weights
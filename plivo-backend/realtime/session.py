@@ -0,0 +1,69 @@
+"""
+Resumable sessions, so clients can move between ws_server processes.
+
+A session token records what a connection was following: its topics, the
+last `seq` it was sent in each room and its join options. The token is
+signed rather than stored, so any process with the same key can resume
+it, including one started after the issuing process exited. It grants no
+access: what a resumed connection may see still comes from its cookie.
+
+Sequence numbers are only comparable within one epoch. With the Redis
+backplane they are shared by every process; a single process numbers its
+rooms from 1, so there the epoch is the process (see realtime.backplane).
+"""
+import hashlib
+import time
+from typing import Optional
+
+import jwt
+
+DEFAULT_SESSION_TTL = 300.0
+SESSION_AUDIENCE = "ws_session"
+# Join options carried over to the resumed connection
+SESSION_OPTIONS = ("encoding", "batch_ms", "full_objects")
+# `last_seq` for a room whose sequence can't be compared with this process's, always replays as a gap
+UNKNOWN_SEQ = -1
+
+
+def derive_key(secret: str) -> str:
+    """Session signing key derived from a shared secret, so tokens can't pass for anything else signed with it"""
+    return hashlib.sha256(f"ws_session:{secret}".encode()).hexdigest()
+
+
+class SessionCodec:
+    """Issues and checks session tokens (HS256 JWTs valid for `ttl` seconds)"""
+
+    def __init__(self, key: str, ttl: float = DEFAULT_SESSION_TTL):
+        self.key = key
+        self.ttl = ttl
+
+    def issue(self, connection, epoch: str) -> str:
+        claims = {
+            "aud": SESSION_AUDIENCE,
+            "exp": int(time.time() + self.ttl),
+            "epoch": epoch,
+            "topics": sorted(connection.rooms),
+            "seqs": {room: seq for room, seq in connection.resume_seqs().items() if room in connection.rooms},
+            "encoding": connection.encoding,
+            "batch_ms": round(connection.batch_window * 1000),
+            "full_objects": connection.full_objects,
+        }
+        return jwt.encode(claims, self.key, algorithm="HS256")
+
+    def load(self, token) -> Optional[dict]:
+        """Claims of a valid, unexpired session token, None for anything else"""
+        if not isinstance(token, str):
+            return None
+        try:
+            claims = jwt.decode(token, self.key, algorithms=["HS256"], audience=SESSION_AUDIENCE)
+        except jwt.InvalidTokenError:
+            return None
+        topics, seqs = claims.get("topics"), claims.get("seqs")
+        if not isinstance(topics, list) or not isinstance(seqs, dict):
+            return None
+        return claims
+
+
+def session_options(claims: dict) -> dict:
+    """Join options of a resumed session"""
+    return {name: claims[name] for name in SESSION_OPTIONS if name in claims}
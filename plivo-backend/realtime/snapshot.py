@@ -0,0 +1,171 @@
+"""
+Materialized per-organization status, kept current from the events ws_server relays.
+
+A client joining an org room can ask for a snapshot of the organization's
+services and open incidents as its first frame instead of fetching them over
+REST. Each org is seeded once from the database, by a single loader call
+shared by every concurrent joiner, and is then kept up to date from the
+relayed events.
+"""
+import asyncio
+import re
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+ORG_ROOM = re.compile(r"^org_(\d+)_update$")
+# Any room or wildcard of an organization
+ORG_TOPIC = re.compile(r"^org_(\d+)_")
+
+Loader = Callable[[int], Awaitable[Tuple[list, list]]]
+
+
+def org_room_id(room: str) -> Optional[int]:
+    """Organization id of an `org_{id}_update` room, None for any other room"""
+    match = ORG_ROOM.match(room)
+    return int(match.group(1)) if match else None
+
+
+def org_topic_id(topic: str) -> Optional[int]:
+    """Organization id of any `org_{id}_...` room or wildcard"""
+    match = ORG_TOPIC.match(topic)
+    return int(match.group(1)) if match else None
+
+
+def _is_newer(incoming: dict, current: Optional[dict]) -> bool:
+    # Events and the seed query can race, the entity version (or updatedAt) decides which one wins
+    if current is None:
+        return True
+    if incoming.get("version") is not None and current.get("version") is not None:
+        return incoming["version"] >= current["version"]
+    return (incoming.get("updatedAt") or "") >= (current.get("updatedAt") or "")
+
+
+class OrgSnapshot:
+    """Services and open incidents of one organization"""
+
+    def __init__(self):
+        self.services: Dict[object, dict] = {}
+        self.incidents: Dict[object, dict] = {}
+        self.seeded = False
+
+    def seed(self, services: list, incidents: list):
+        self.services = {s["id"]: s for s in services}
+        self.incidents = {i["id"]: i for i in incidents if i.get("status") != "resolved"}
+        self.seeded = True
+
+    def apply(self, event: dict) -> Optional[dict]:
+        """Fold an event in. Returns the entity it leaves, patches merged, if known"""
+        event_type = event.get("type")
+        data = event.get("data") or {}
+        entity_id = data.get("id")
+        if entity_id is None:
+            return None
+
+        if event_type in ("service_created", "service_updated"):
+            return self._upsert(self.services, data, event.get("patch"))
+        if event_type == "service_deleted":
+            self.services.pop(entity_id, None)
+            self.incidents = {k: v for k, v in self.incidents.items() if v.get("serviceId") != entity_id}
+        elif event_type in ("incident_created", "incident_updated"):
+            entity = self._upsert(self.incidents, data, event.get("patch"))
+            if entity is not None and entity.get("status") == "resolved":
+                self.incidents.pop(entity_id, None)
+            return entity
+        elif event_type == "incident_deleted":
+            self.incidents.pop(entity_id, None)
+        return None
+
+    @staticmethod
+    def _upsert(entities: dict, data: dict, patch: bool) -> Optional[dict]:
+        current = entities.get(data["id"])
+        if patch:
+            # A patch only holds the changed fields, it needs the entity to apply to
+            if current is None:
+                return None
+            data = {**current, **data}
+        if _is_newer(data, current):
+            entities[data["id"]] = data
+            return data
+        return current
+
+    def to_dict(self, public_only: bool = False) -> dict:
+        """Everything, or for viewers outside the org only public services and their incidents"""
+        if not public_only:
+            return {
+                "services": list(self.services.values()),
+                "incidents": list(self.incidents.values()),
+            }
+        services = [service for service in self.services.values() if service.get("publiclyVisible", True)]
+        visible = {service["id"] for service in services}
+        return {
+            "services": services,
+            "incidents": [incident for incident in self.incidents.values() if incident.get("serviceId") in visible],
+        }
+
+
+class SnapshotStore:
+    """Snapshots of every organization a client has asked about"""
+
+    def __init__(self, loader: Optional[Loader] = None):
+        self.loader = loader
+        self.orgs: Dict[int, OrgSnapshot] = {}
+        self._loading: Dict[int, asyncio.Future] = {}
+        self._pending: Dict[int, list] = {}
+        self.loads = 0
+
+    def apply(self, event: dict) -> Optional[dict]:
+        """Fold a relayed event into its organization's snapshot, if we track that org.
+
+        Returns the full entity the event leaves behind when it is known, which
+        is how patch events are expanded for clients that want full objects.
+        """
+        if not isinstance(event, dict):
+            return None
+        org_id = event.get("organization_id")
+        if org_id in self._pending:
+            # Seed query in flight, replay this on top of its result
+            self._pending[org_id].append(event)
+        elif org_id in self.orgs:
+            return self.orgs[org_id].apply(event)
+        return None
+
+    def forget(self, org_id: int):
+        """Stop tracking an org, e.g. when this process no longer receives its events"""
+        self.orgs.pop(org_id, None)
+
+    async def get(self, org_id: int) -> OrgSnapshot:
+        snapshot = self.orgs.get(org_id)
+        if snapshot is not None:
+            return snapshot
+        # Single flight: every joiner waits on the same seed query
+        future = self._loading.get(org_id)
+        if future is None:
+            # Start buffering events now, not when the task first runs
+            self._pending[org_id] = []
+            future = self._loading[org_id] = asyncio.ensure_future(self._load(org_id))
+        return await asyncio.shield(future)
+
+    async def _load(self, org_id: int) -> OrgSnapshot:
+        snapshot = OrgSnapshot()
+        try:
+            if self.loader is not None:
+                services, incidents = await self.loader(org_id)
+                snapshot.seed(services, incidents)
+                self.loads += 1
+            for event in self._pending[org_id]:
+                snapshot.apply(event)
+            self.orgs[org_id] = snapshot
+            return snapshot
+        finally:
+            self._pending.pop(org_id, None)
+            self._loading.pop(org_id, None)
+
+    def frame(self, room: str, org_id: int, snapshot: OrgSnapshot, seq: int, public_only: bool = False) -> dict:
+        """The snapshot message sent to a joining client"""
+        return {
+            "type": "snapshot",
+            "room": room,
+            "organization_id": org_id,
+            "seq": seq,
+            "complete": snapshot.seeded,
+            "data": snapshot.to_dict(public_only),
+        }
@@ -0,0 +1,1462 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import unittest
+from functools import partial
+import zlib
+from contextlib import asynccontextmanager
+import msgpack
+import websockets
+from websockets.exceptions import InvalidStatus
+from websockets.server import serve
+from asgiref.sync import sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import SimpleTestCase
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+from utils.utils import ChannelLayerPublishChannel, PublishChannel
+from utils.publisher import BackgroundPublisher, OVERFLOW_DROP_NEWEST, OVERFLOW_SPILL
+from .encoding import ENCODINGS, ENCODING_DEFLATE, ENCODING_JSON, ENCODING_MSGPACK
+from .fanout import CLOSE_POLICY, CLOSE_SERVICE_RESTART, Connection, FanoutEngine, POLICY_CONFLATE, POLICY_DROP_OLDEST, POLICY_EVICT
+from . import consumers
+from .auth import Authenticator, ScopeCache, TokenVerifier, cookie_token
+from .lifecycle import LifecycleManager
+from .log import SampleFilter
+from .metrics import COUNTER, Histogram, Metric, MetricsServer, engine_metrics, render_json, render_prometheus
+from .framing import read_frames, encode_frame, frame_rooms, MAX_FRAME_SIZE
+from .backplane import LocalBackplane, RedisBackplane, RelayBackplane
+from .priority import PRIORITY_CRITICAL, PRIORITY_HIGH, PRIORITY_NORMAL, event_priority
+from .replay import ReplayBuffer
+from .routing import websocket_urlpatterns
+from .scheduler import FairScheduler, parse_weights
+from .session import SessionCodec, session_options
+from .snapshot import OrgSnapshot, SnapshotStore, org_room_id
+from .topics import TopicIndex, valid_topic
+from .workers import Broadcaster
+import ws_server
+
+
+class FakeWebSocket:
+    """Stand-in for a websockets connection that records what it was sent"""
+
+    def __init__(self, delay=0.0, alive=True):
+        self.delay = delay
+        self.alive = alive
+        self.sent = []
+        self.closed_with = None
+
+    async def ping(self):
+        pong = asyncio.get_running_loop().create_future()
+        if self.alive:
+            pong.set_result(None)
+        return pong
+
+    async def send(self, message):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        self.sent.append(message)
+
+    async def close(self, code=1000, reason=""):
+        self.closed_with = code
+
+
+def service_event(service_id, status):
+    return {"type": "service_updated", "data": {"id": service_id, "currentStatus": status}}
+
+
+class FanoutEngineTest(SimpleTestCase):
+    async def test_slow_client_does_not_delay_others(self):
+        """A slow socket must not hold up delivery to the rest of the room"""
+        engine = FanoutEngine(send_timeout=5)
+        slow, fast = FakeWebSocket(delay=0.5), FakeWebSocket()
+        for ws in (slow, fast):
+            engine.join(engine.register(ws), "org_1_update")
+
+        delivered = engine.publish("org_1_update", service_event(1, "major_outage"))
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(delivered, 2)
+        self.assertEqual(len(fast.sent), 1)
+        self.assertEqual(slow.sent, [])
+        await engine.unregister(slow)
+        await engine.unregister(fast)
+
+    async def test_conflate_keeps_latest_version_of_entity(self):
+        """A full queue replaces older messages about the same entity"""
+        engine = FanoutEngine(max_queue=2, policy=POLICY_CONFLATE)
+        ws = FakeWebSocket(delay=0.2)
+        connection = engine.register(ws)
+        engine.join(connection, "org_1_update")
+
+        engine.publish("org_1_update", service_event(1, "operational"))
+        await asyncio.sleep(0)  # writer picks up the first message
+        engine.publish("org_1_update", service_event(1, "degraded_performance"))
+        engine.publish("org_1_update", service_event(2, "operational"))
+        engine.publish("org_1_update", service_event(1, "major_outage"))
+
+        queued = [json.loads(m.payload) for m in connection.queue]
+        # The outage is also more urgent, so it goes first
+        self.assertEqual(
+            [(m["data"]["id"], m["data"]["currentStatus"]) for m in queued],
+            [(1, "major_outage"), (2, "operational")]
+        )
+        self.assertEqual((engine.conflated, engine.dropped), (1, 0))
+        await engine.unregister(ws)
+
+    async def test_urgent_messages_overtake_routine_edits(self):
+        engine = FanoutEngine()
+        ws = FakeWebSocket(delay=0.01)
+        engine.join(engine.register(ws), "org_1_update")
+
+        engine.publish("org_1_update", {"type": "service_updated", "data": {"id": 9, "description": "a"}, "patch": True})
+        await asyncio.sleep(0)  # writer picks up the first message
+        for i in range(3):
+            engine.publish("org_1_update", {"type": "service_updated", "data": {"id": i, "description": "b"}, "patch": True})
+        engine.publish("org_1_update", {"type": "incident_created", "data": {"id": 5, "severity": "critical"}})
+        await asyncio.sleep(0.1)
+
+        # The first edit was already being sent when the incident came in
+        self.assertEqual(
+            [json.loads(m)["data"]["id"] for m in ws.sent], [9, 5, 0, 1, 2]
+        )
+        await engine.unregister(ws)
+
+    async def test_conflation_never_loses_patch_fields(self):
+        engine = FanoutEngine(max_queue=2, high_water=0)
+        ws = FakeWebSocket(delay=0.2)
+        connection = engine.register(ws)
+        engine.join(connection, "org_1_update")
+
+        def patch(**fields):
+            return {"type": "service_updated", "data": {"id": 1, **fields}, "patch": True}
+
+        engine.publish("org_1_update", patch(name="x"))
+        await asyncio.sleep(0)
+        engine.publish("org_1_update", patch(description="old"))
+        engine.publish("org_1_update", patch(name="API"))
+        engine.publish("org_1_update", patch(description="new"))
+
+        queued = [json.loads(m.payload)["data"] for m in connection.queue]
+        self.assertEqual(queued, [{"id": 1, "name": "API"}, {"id": 1, "description": "new"}])
+        self.assertEqual(engine.conflated, 1)
+        await engine.unregister(ws)
+
+    async def test_full_queue_drops_least_urgent_first(self):
+        engine = FanoutEngine(max_queue=2, policy=POLICY_DROP_OLDEST)
+        ws = FakeWebSocket(delay=0.2)
+        connection = engine.register(ws)
+        engine.join(connection, "org_1_update")
+
+        engine.publish("org_1_update", {"type": "note"})
+        await asyncio.sleep(0)
+        engine.publish("org_1_update", service_event(1, "major_outage"))
+        engine.publish("org_1_update", {"type": "note"})
+        engine.publish("org_1_update", service_event(2, "major_outage"))
+        engine.publish("org_1_update", {"type": "note"})
+
+        self.assertEqual(
+            [json.loads(m.payload)["data"]["id"] for m in connection.queue], [1, 2]
+        )
+        self.assertEqual(engine.dropped, 2)
+        await engine.unregister(ws)
+
+    async def test_drop_oldest_policy(self):
+        engine = FanoutEngine(max_queue=1, policy=POLICY_DROP_OLDEST)
+        ws = FakeWebSocket(delay=0.2)
+        connection = engine.register(ws)
+        engine.join(connection, "room")
+
+        for i in range(3):
+            engine.publish("room", {"n": i})
+
+        self.assertEqual(len(connection.queue), 1)
+        self.assertGreaterEqual(connection.dropped, 1)
+        await engine.unregister(ws)
+
+    async def test_evict_policy_removes_connection(self):
+        engine = FanoutEngine(max_queue=1, policy=POLICY_EVICT)
+        ws = FakeWebSocket(delay=0.2)
+        engine.join(engine.register(ws), "room")
+
+        for i in range(3):
+            engine.publish("room", {"n": i})
+        await asyncio.sleep(0)
+
+        self.assertEqual(engine.evicted, 1)
+        self.assertNotIn("room", engine.rooms)
+        self.assertEqual(ws.closed_with, 1013)
+
+    async def test_latency_is_reported_per_room(self):
+        engine = FanoutEngine()
+        ws = FakeWebSocket()
+        engine.join(engine.register(ws), "org_1_update")
+
+        engine.publish("org_1_update", service_event(1, "operational"))
+        await asyncio.sleep(0.01)
+
+        report = engine.latency_report()
+        self.assertEqual(report["org_1_update"]["count"], 1)
+        self.assertIn("p99_ms", report["org_1_update"])
+        await engine.unregister(ws)
+
+    async def test_batch_window_coalesces_into_one_frame(self):
+        engine = FanoutEngine()
+        ws = FakeWebSocket()
+        connection = engine.register(ws)
+        connection.set_batch_ms(50)
+        engine.join(connection, "org_1_update")
+
+        engine.publish("org_1_update", service_event(1, "operational"))
+        engine.publish("org_1_update", service_event(2, "operational"))
+        engine.publish("org_1_update", service_event(1, "degraded_performance"))
+        engine.publish("org_1_update", service_event(1, "major_outage"))
+        await asyncio.sleep(0.02)
+        self.assertEqual(ws.sent, [])
+        await asyncio.sleep(0.06)
+
+        self.assertEqual(len(ws.sent), 1)
+        frame = json.loads(ws.sent[0])
+        self.assertEqual(
+            [(event["data"]["id"], event["data"]["currentStatus"]) for event in frame],
+            [(2, "operational"), (1, "major_outage")]
+        )
+        self.assertEqual(engine.coalesced, 2)
+
+        # A lone message in the window is sent as is
+        engine.publish("org_1_update", service_event(3, "operational"))
+        await asyncio.sleep(0.08)
+        self.assertEqual(json.loads(ws.sent[1])["data"]["id"], 3)
+        await engine.unregister(ws)
+
+
+class LifecycleTest(SimpleTestCase):
+    async def test_dead_peers_are_evicted(self):
+        engine = FanoutEngine()
+        alive, dead = FakeWebSocket(), FakeWebSocket(alive=False)
+        for ws in (alive, dead):
+            engine.join(engine.register(ws), "org_1_update")
+
+        evicted = await LifecycleManager(engine, ping_timeout=0.05).ping_all()
+        await asyncio.sleep(0)
+
+        self.assertEqual(evicted, 1)
+        self.assertEqual(engine.evictions, {"ping_timeout": 1})
+        self.assertEqual(dead.closed_with, CLOSE_POLICY)
+        self.assertEqual(list(engine.connections), [alive])
+        await engine.unregister(alive)
+
+    async def test_connections_in_no_room_are_evicted_when_idle(self):
+        engine = FanoutEngine()
+        lurker, viewer = FakeWebSocket(), FakeWebSocket()
+        engine.register(lurker)
+        engine.join(engine.register(viewer), "org_1_update")
+        for connection in engine.connections.values():
+            connection.last_activity -= 120
+
+        self.assertEqual(LifecycleManager(engine, idle_timeout=60).evict_idle(), 1)
+        await asyncio.sleep(0)
+        self.assertEqual(engine.evictions, {"idle": 1})
+        self.assertEqual(list(engine.connections), [viewer])
+        await engine.unregister(viewer)
+
+    async def test_expired_tokens_lose_member_access(self):
+        engine = FanoutEngine()
+        current, expired = engine.register(FakeWebSocket()), engine.register(FakeWebSocket())
+        current.authorize(1, time.time() + 60)
+        expired.authorize(1, time.time() - 1)
+
+        self.assertEqual(LifecycleManager(engine).expire_members(), 1)
+        self.assertEqual((current.member_of, expired.member_of), (1, None))
+        for ws in list(engine.connections):
+            await engine.unregister(ws)
+
+    async def test_room_and_memory_caps(self):
+        engine = FanoutEngine(max_rooms=2, max_queue_bytes=200)
+        ws = FakeWebSocket(delay=1)
+        connection = engine.register(ws)
+        self.assertTrue(engine.join(connection, "org_1_update"))
+        self.assertTrue(engine.join(connection, "org_2_update"))
+        self.assertFalse(engine.join(connection, "org_3_update"))
+        self.assertTrue(engine.join(connection, "org_2_update"))
+        self.assertEqual(engine.rejected_joins, 1)
+
+        for i in range(10):
+            engine.publish("org_1_update", service_event(i, "operational"))
+        await asyncio.sleep(0)
+
+        self.assertEqual(engine.evictions, {"memory": 1})
+        self.assertEqual(engine.rooms, {})
+
+    async def test_room_state_is_reclaimed(self):
+        engine = FanoutEngine()
+        ws = FakeWebSocket()
+        connection = engine.register(ws)
+        engine.join(connection, "org_1_update")
+        engine.join(connection, "org_2_*")
+        engine.publish("org_1_update", service_event(1, "operational"))
+        engine.publish("org_2_incident_5_update", service_event(1, "operational"))
+        await asyncio.sleep(0.01)
+        self.assertEqual(set(engine.latency), {"org_1_update", "org_2_incident_5_update"})
+        self.assertEqual(set(engine.fanout_time), {"org_1_update", "org_2_incident_5_update"})
+
+        engine.leave(connection, "org_1_update")
+        engine.leave(connection, "org_2_*")
+        self.assertEqual(set(engine.latency), {"org_2_incident_5_update"})
+        self.assertEqual(engine.forget_unused_rooms(), 1)
+        self.assertEqual(engine.latency, {})
+        self.assertEqual(engine.fanout_time, {})
+        self.assertEqual(engine.index.root.children, {})
+        await engine.unregister(ws)
+
+
+class PriorityTest(SimpleTestCase):
+    def test_event_priority(self):
+        self.assertEqual(event_priority({"type": "incident_created", "data": {"severity": "critical"}}), PRIORITY_CRITICAL)
+        self.assertEqual(event_priority({"type": "incident_created", "data": {"severity": "low"}}), PRIORITY_HIGH)
+        self.assertEqual(event_priority(service_event(1, "partial_outage")), PRIORITY_CRITICAL)
+        self.assertEqual(event_priority(service_event(1, "operational")), PRIORITY_HIGH)
+        self.assertEqual(event_priority({"type": "snapshot", "data": {}}), PRIORITY_CRITICAL)
+
+        description = {"type": "incident_updated", "data": {"id": 1, "description": "typo"}, "patch": True}
+        self.assertEqual(event_priority(description, {"severity": "critical"}), PRIORITY_NORMAL)
+        status = {"type": "incident_updated", "data": {"id": 1, "status": "identified"}, "patch": True}
+        # Severity comes from the entity the patch applies to
+        self.assertEqual(event_priority(status, {"severity": "critical"}), PRIORITY_CRITICAL)
+        self.assertEqual(event_priority(status), PRIORITY_HIGH)
+        self.assertEqual(event_priority({"room": "lobby", "message": "hi"}), PRIORITY_NORMAL)
+
+
+class FairSchedulerTest(SimpleTestCase):
+    async def run_until_idle(self, scheduler, timeout=1.0):
+        task = asyncio.ensure_future(scheduler.run())
+        deadline = time.monotonic() + timeout
+        while scheduler.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.005)
+        task.cancel()
+
+    async def test_small_tenant_is_not_stuck_behind_a_burst(self):
+        scheduler = FairScheduler(quantum=50)
+        ran = []
+        for i in range(100):
+            scheduler.submit("big", partial(ran.append, ("big", i)), cost=25)
+        for i in range(3):
+            scheduler.submit("small", partial(ran.append, ("small", i)), cost=1)
+        await self.run_until_idle(scheduler)
+
+        self.assertEqual(len(ran), 103)
+        # All of the small tenant's work runs in its first turn, after two of the big one's jobs
+        self.assertEqual(ran[2:5], [("small", 0), ("small", 1), ("small", 2)])
+        self.assertEqual([i for tenant, i in ran if tenant == "big"], list(range(100)))
+        self.assertEqual(scheduler.tenants["small"].delay.count, 3)
+
+    async def test_weights_share_turns(self):
+        scheduler = FairScheduler(quantum=1, weights=parse_weights("a:3, b:1"))
+        ran = []
+        for i in range(8):
+            scheduler.submit("a", partial(ran.append, "a"))
+            scheduler.submit("b", partial(ran.append, "b"))
+        await self.run_until_idle(scheduler)
+        self.assertEqual("".join(ran[:8]), "aaabaaab")
+
+    async def test_publish_budget_only_slows_its_tenant(self):
+        scheduler = FairScheduler(rate=20, burst=2)
+        ran = []
+        for i in range(6):
+            scheduler.submit("noisy", partial(ran.append, "noisy"))
+        scheduler.submit("quiet", partial(ran.append, "quiet"))
+        task = asyncio.ensure_future(scheduler.run())
+        await asyncio.sleep(0.02)
+
+        self.assertEqual(ran.count("quiet"), 1)
+        self.assertLess(ran.count("noisy"), 6)
+        self.assertGreater(scheduler.tenants["noisy"].throttled, 0)
+        await asyncio.sleep(0.3)
+        self.assertEqual(ran.count("noisy"), 6)
+        task.cancel()
+
+    def test_pending_limit_drops_oldest(self):
+        scheduler = FairScheduler(max_pending=2)
+        for i in range(4):
+            scheduler.submit("org", partial(print, i))
+        tenant = scheduler.tenants["org"]
+        self.assertEqual([job.args for _, _, job in tenant.jobs], [(2,), (3,)])
+        self.assertEqual(tenant.dropped, 2)
+
+
+class EncodingTest(SimpleTestCase):
+    async def test_each_encoding_is_made_once_per_message(self):
+        engine = FanoutEngine()
+        sockets = {encoding: [FakeWebSocket(), FakeWebSocket()] for encoding in ENCODINGS}
+        for encoding, pair in sockets.items():
+            for ws in pair:
+                connection = engine.register(ws)
+                connection.set_encoding(encoding)
+                engine.join(connection, "org_1_update")
+        event = service_event(1, "major_outage")
+
+        engine.publish("org_1_update", event)
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(json.loads(sockets[ENCODING_JSON][0].sent[0]), event)
+        self.assertEqual(msgpack.unpackb(sockets[ENCODING_MSGPACK][0].sent[0]), event)
+        self.assertEqual(json.loads(zlib.decompress(sockets[ENCODING_DEFLATE][0].sent[0])), event)
+        for first, second in sockets.values():
+            # The same object, not just equal bytes
+            self.assertIs(first.sent[0], second.sent[0])
+
+    async def test_batched_msgpack_is_an_array(self):
+        engine = FanoutEngine(batch_ms=20)
+        ws = FakeWebSocket()
+        connection = engine.register(ws)
+        connection.set_encoding(ENCODING_MSGPACK)
+        engine.join(connection, "org_1_update")
+
+        events = [service_event(i, "operational") for i in range(20)]
+        for event in events:
+            engine.publish("org_1_update", event)
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(msgpack.unpackb(ws.sent[0]), events)
+
+    def test_unknown_encoding_is_rejected(self):
+        connection = Connection(FakeWebSocket(), FanoutEngine(), 1, POLICY_CONFLATE)
+        with self.assertRaises(ValueError):
+            connection.set_encoding("xml")
+
+
+def access_token(user_id, token_class=AccessToken):
+    token = token_class()
+    token["user_id"] = user_id
+    return str(token.access_token if token_class is RefreshToken else token)
+
+
+class AuthTest(SimpleTestCase):
+    def test_tokens_are_verified_with_simplejwt_settings(self):
+        verifier = TokenVerifier.from_settings(settings.SIMPLE_JWT)
+        user_id, expires_at = verifier.verify(access_token(5))
+        self.assertEqual(user_id, 5)
+        self.assertGreater(expires_at, time.time())
+
+        self.assertIsNone(verifier.verify(access_token(5)[:-2] + "xx"))
+        self.assertIsNone(TokenVerifier("another key").verify(access_token(5)))
+        refresh = RefreshToken()
+        refresh["user_id"] = 5
+        self.assertIsNone(verifier.verify(str(refresh)))
+
+    def test_cookie_token(self):
+        self.assertEqual(cookie_token("theme=dark; access_token=abc.def"), "abc.def")
+        self.assertIsNone(cookie_token("theme=dark"))
+        self.assertIsNone(cookie_token(None))
+
+    async def test_scopes_are_cached(self):
+        calls = []
+
+        async def loader(user_id):
+            calls.append(user_id)
+            await asyncio.sleep(0.01)
+            return 7
+
+        scopes = ScopeCache(loader, ttl=0.05)
+        self.assertEqual(await asyncio.gather(*[scopes.get(1) for _ in range(50)]), [7] * 50)
+        self.assertEqual(calls, [1])
+        await asyncio.sleep(0.06)
+        await scopes.get(1)
+        self.assertEqual(calls, [1, 1])
+
+    async def test_authenticated_and_anonymous_handshakes(self):
+        async def loader(user_id):
+            return 3
+
+        authenticator = Authenticator(TokenVerifier.from_settings(settings.SIMPLE_JWT), ScopeCache(loader))
+        member = await authenticator.authenticate({"Cookie": f"access_token={access_token(5)}"})
+        self.assertEqual((member.user_id, member.org_id), (5, 3))
+        for headers in ({}, {"Cookie": "access_token=garbage"}):
+            self.assertFalse((await authenticator.authenticate(headers)).authenticated)
+
+    async def test_private_events_only_reach_members(self):
+        engine = FanoutEngine()
+        member_ws, other_ws, anonymous_ws = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        for ws, org_id in ((member_ws, 1), (other_ws, 2), (anonymous_ws, None)):
+            connection = engine.register(ws)
+            connection.authorize(org_id)
+            engine.join(connection, "org_1_update")
+
+        private = {**service_event(1, "major_outage"), "organization_id": 1, "public": False}
+        self.assertEqual(engine.publish("org_1_update", private), 1)
+        engine.publish("org_1_update", {**service_event(2, "operational"), "organization_id": 1, "public": True})
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(len(member_ws.sent), 2)
+        self.assertEqual([json.loads(m)["data"]["id"] for m in other_ws.sent], [2])
+        self.assertEqual([json.loads(m)["data"]["id"] for m in anonymous_ws.sent], [2])
+        self.assertEqual(engine.filtered, 2)
+        for ws in (member_ws, other_ws, anonymous_ws):
+            await engine.unregister(ws)
+
+
+class ChannelsConsumerTest(SimpleTestCase):
+    """REALTIME_TRANSPORT = 'channels', on the in-memory channel layer"""
+
+    def setUp(self):
+        async def loader(user_id):
+            return 1
+
+        consumers._authenticator = Authenticator(TokenVerifier.from_settings(settings.SIMPLE_JWT), ScopeCache(loader))
+        self.addCleanup(setattr, consumers, "_authenticator", None)
+
+    async def connect(self, *rooms, user_id=None):
+        headers = [(b"cookie", f"access_token={access_token(user_id)}".encode())] if user_id else []
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/", headers=headers)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        for room in rooms:
+            await communicator.send_json_to({"action": "join", "room": room})
+        # Joins are handled in order, an answered bad join means the ones before it are done
+        await communicator.send_json_to({"action": "join", "room": "bad_*_room"})
+        self.assertIn("error", await communicator.receive_json_from())
+        return communicator
+
+    async def test_group_send_reaches_each_member_once(self):
+        both = await self.connect("org_1_update", "org_1_incident_2_update")
+        incidents = await self.connect("org_1_incident_2_update")
+        publish = sync_to_async(ChannelLayerPublishChannel().publish)
+
+        self.assertTrue(await publish(["org_1_update", "org_1_incident_2_update"], {"type": "service_updated", "n": 1}))
+        self.assertTrue(await publish("org_1_incident_2_update", {"type": "incident_updated", "n": 2}))
+
+        self.assertEqual([(await both.receive_json_from())["n"] for _ in range(2)], [1, 2])
+        self.assertEqual([(await incidents.receive_json_from())["n"] for _ in range(2)], [1, 2])
+        self.assertTrue(await both.receive_nothing())
+        for communicator in (both, incidents):
+            await communicator.disconnect()
+
+    async def test_rooms_the_channel_layer_refuses_are_answered(self):
+        communicator = await self.connect()
+        for room in ("room with space", "org_1_" + "x" * 100):
+            await communicator.send_json_to({"action": "join", "room": room})
+            self.assertEqual(await communicator.receive_json_from(), {"error": f"Invalid room: {room}"})
+        # Still connected and joining
+        await communicator.send_json_to({"action": "join", "room": "org_1_update"})
+        await communicator.send_json_to({"action": "join", "room": "bad_*_room"})
+        self.assertIn("error", await communicator.receive_json_from())
+        await sync_to_async(ChannelLayerPublishChannel().publish)("org_1_update", {"type": "service_updated", "n": 1})
+        self.assertEqual((await communicator.receive_json_from())["n"], 1)
+        await communicator.disconnect()
+
+    async def test_private_events_only_reach_members(self):
+        member = await self.connect("org_1_update", user_id=5)
+        anonymous = await self.connect("org_1_update")
+        publish = sync_to_async(ChannelLayerPublishChannel().publish)
+
+        await publish("org_1_update", {**service_event(1, "major_outage"), "organization_id": 1, "public": False})
+        await publish("org_1_update", {**service_event(2, "operational"), "organization_id": 1, "public": True})
+
+        self.assertEqual([(await member.receive_json_from())["data"]["id"] for _ in range(2)], [1, 2])
+        self.assertEqual((await anonymous.receive_json_from())["data"]["id"], 2)
+        self.assertTrue(await anonymous.receive_nothing())
+        for communicator in (member, anonymous):
+            await communicator.disconnect()
+
+
+class MetricsTest(SimpleTestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram((0.01, 0.1))
+        for value in (0.005, 0.05, 0.05, 3):
+            histogram.observe(value)
+        self.assertEqual(histogram.cumulative(), [("0.01", 1), ("0.1", 3), ("+Inf", 4)])
+        self.assertEqual(histogram.count, 4)
+
+    async def test_engine_metrics(self):
+        engine = FanoutEngine()
+        ws = FakeWebSocket(delay=1)
+        engine.join(engine.register(ws), "org_1_update")
+        for i in range(3):
+            engine.publish("org_1_update", service_event(i, "operational"))
+        await asyncio.sleep(0)
+
+        view = render_json(engine_metrics(engine))
+        self.assertEqual(view["ws_connections"], 1)
+        self.assertEqual(view["ws_room_members"], [{"room": "org_1_update", "value": 1}])
+        self.assertEqual(view["ws_messages_published_total"], 3)
+        self.assertEqual(view["ws_send_queue_depth_total"], 2)
+        self.assertEqual(view["ws_fanout_seconds"][0]["value"]["count"], 3)
+
+        text = render_prometheus(engine_metrics(engine))
+        self.assertIn("# TYPE ws_fanout_seconds histogram", text)
+        self.assertIn('ws_fanout_seconds_bucket{room="org_1_update",le="+Inf"} 3', text)
+        self.assertIn("ws_messages_published_total 3", text)
+        await engine.unregister(ws)
+
+    async def test_server_answers_scrapes(self):
+        metrics = [Metric("ws_test_total", COUNTER, "Test counter", 7)]
+        server = await MetricsServer(lambda: metrics, lambda: {"ok": True}).start("localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+
+        async def get(path):
+            reader, writer = await asyncio.open_connection("localhost", port)
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+            response = await reader.read()
+            writer.close()
+            return response.decode()
+
+        self.assertTrue((await get("/metrics")).endswith("# TYPE ws_test_total counter\nws_test_total 7\n"))
+        self.assertTrue((await get("/debug")).endswith('"ok": true\n}'))
+        self.assertIn("404", await get("/nope"))
+        server.close()
+        await server.wait_closed()
+
+    def test_sampled_logging(self):
+        sample = SampleFilter(10)
+        passed = [
+            sample.filter(logging.LogRecord("ws_server", logging.DEBUG, __file__, 0, "sent", None, None))
+            for _ in range(30)
+        ]
+        self.assertEqual(passed.count(True), 3)
+
+        # Lazy %-style arguments still format once the sample note is added
+        record = logging.LogRecord("ws_server", logging.DEBUG, __file__, 0, "room %s: %d", ("org_1_update", 2), None)
+        SampleFilter(1).filter(record)
+        self.assertEqual(record.getMessage(), "room org_1_update: 2")
+        sample = SampleFilter(2)
+        sample.filter(record)
+        self.assertTrue(sample.filter(record))
+        self.assertEqual(record.getMessage(), "room org_1_update: 2 (1 in 2)")
+
+
+class InternalChannelTest(SimpleTestCase):
+    async def test_many_large_frames_on_one_connection(self):
+        """Payloads bigger than a single read arrive intact and in order"""
+        received = []
+        connections = []
+
+        async def handle(reader, writer):
+            connections.append(writer)
+            async for frame in read_frames(reader):
+                received.append(frame)
+            writer.close()
+
+        server = await asyncio.start_server(handle, "localhost", 0, limit=MAX_FRAME_SIZE)
+        port = server.sockets[0].getsockname()[1]
+        channel = PublishChannel(port=port)
+        description = "x" * 200_000
+
+        self.assertTrue(await asyncio.to_thread(channel.publish, "room_a", {"description": description}))
+        self.assertTrue(await asyncio.to_thread(
+            channel.publish_many, [("room_b", {"n": 1}), ("room_c", {"n": 2})]
+        ))
+        for _ in range(100):
+            if len(received) == 3:
+                break
+            await asyncio.sleep(0.01)
+
+        self.assertEqual([f["room"] for f in received], ["room_a", "room_b", "room_c"])
+        self.assertEqual(received[0]["data"]["description"], description)
+        self.assertEqual(len(connections), 1)
+        channel.close()
+        await asyncio.sleep(0.05)  # let the handler see EOF
+        server.close()
+        await server.wait_closed()
+
+    async def test_reconnects_after_server_restart(self):
+        received = []
+        writers = []
+
+        async def handle(reader, writer):
+            writers.append(writer)
+            async for frame in read_frames(reader):
+                received.append(frame)
+            writer.close()
+
+        server = await asyncio.start_server(handle, "localhost", 0)
+        port = server.sockets[0].getsockname()[1]
+        channel = PublishChannel(port=port, reconnect_delay=0)
+        self.assertTrue(await asyncio.to_thread(channel.publish, "room", {"n": 1}))
+        await asyncio.sleep(0.05)
+
+        # Drop the server side of the connection and start listening again
+        server.close()
+        writers[0].close()
+        await server.wait_closed()
+        server = await asyncio.start_server(handle, "localhost", port)
+        await asyncio.sleep(0.05)
+
+        self.assertTrue(await asyncio.to_thread(channel.publish, "room", {"n": 2}))
+        for _ in range(100):
+            if len(received) == 2:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual([f["data"]["n"] for f in received], [1, 2])
+        self.assertEqual(len(writers), 2)
+        channel.close()
+        await asyncio.sleep(0.05)  # let the handler see EOF
+        server.close()
+        await server.wait_closed()
+
+
+class FakeChannel:
+    """PublishChannel stand-in that can be switched between up, down and blocked"""
+
+    def __init__(self):
+        self.up = True
+        self.gate = threading.Event()
+        self.gate.set()
+        self.batches = []
+
+    def publish_many(self, messages):
+        self.gate.wait()
+        if not self.up:
+            return False
+        self.batches.append(list(messages))
+        return True
+
+    def close(self):
+        pass
+
+
+class BackgroundPublisherTest(SimpleTestCase):
+    def wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_submit_does_not_wait_for_slow_server(self):
+        channel = FakeChannel()
+        channel.gate.clear()  # every publish blocks until released
+        publisher = BackgroundPublisher(queue_size=100, channel_factory=lambda: channel)
+        publisher.start()
+
+        started = time.monotonic()
+        for i in range(50):
+            self.assertTrue(publisher.submit("org_1_update", {"n": i}))
+        self.assertLess(time.monotonic() - started, 0.5)
+
+        channel.gate.set()
+        self.assertTrue(self.wait_for(lambda: publisher.stats()["published"] == 50))
+        self.assertLess(publisher.stats()["batches"], 50)
+        publisher.stop()
+
+    def test_drop_newest_when_queue_is_full(self):
+        channel = FakeChannel()
+        channel.gate.clear()
+        publisher = BackgroundPublisher(queue_size=2, overflow_policy=OVERFLOW_DROP_NEWEST,
+                                        channel_factory=lambda: channel)
+        publisher.start()
+        publisher.submit("room", {"n": 0})
+        self.assertTrue(self.wait_for(lambda: publisher.stats()["queued"] == 0))
+
+        results = [publisher.submit("room", {"n": i}) for i in range(1, 5)]
+
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(publisher.stats()["dropped"], 2)
+        channel.gate.set()
+        publisher.stop()
+
+    def test_spill_and_replay_when_server_is_down(self):
+        channel = FakeChannel()
+        channel.up = False
+        spill_path = os.path.join(tempfile.mkdtemp(), "spill.jsonl")
+        publisher = BackgroundPublisher(overflow_policy=OVERFLOW_SPILL, spill_path=spill_path,
+                                        channel_factory=lambda: channel)
+        publisher.start()
+
+        publisher.submit("room", {"n": 1})
+        self.assertTrue(self.wait_for(lambda: publisher.stats()["spilled"] == 1))
+
+        channel.up = True
+        self.assertTrue(self.wait_for(lambda: publisher.stats()["replayed"] == 1))
+        self.assertEqual(channel.batches, [[("room", {"n": 1})]])
+        self.assertFalse(os.path.exists(spill_path))
+        publisher.stop()
+
+
+class FakeRedis:
+    """In-process stand-in for the parts of redis.asyncio the backplane uses"""
+
+    def __init__(self):
+        self.pubsubs = []
+        self.sequences = {}
+
+    def pubsub(self):
+        pubsub = FakePubSub()
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+    async def eval(self, script, numkeys, *args):
+        """Runs the backplane publish script"""
+        keys, data = args[:numkeys], args[numkeys]
+        seqs = []
+        for sequence_key, channel in zip(keys[::2], keys[1::2]):
+            self.sequences[sequence_key] = seq = self.sequences.get(sequence_key, 0) + 1
+            await self.publish(channel, f"{seq} {data}")
+            seqs.append(seq)
+        return seqs
+
+    async def publish(self, channel, data):
+        receivers = 0
+        for pubsub in self.pubsubs:
+            if channel in pubsub.channels:
+                pubsub.messages.put_nowait({"type": "message", "channel": channel.encode(), "data": data.encode()})
+                receivers += 1
+            for pattern in pubsub.patterns:
+                if channel.startswith(pattern[:-1]):
+                    pubsub.messages.put_nowait({"type": "pmessage", "channel": channel.encode(), "data": data.encode()})
+                    receivers += 1
+        return receivers
+
+
+class FakePubSub:
+    def __init__(self):
+        self.channels = set()
+        self.patterns = set()
+        self.messages = asyncio.Queue()
+
+    async def subscribe(self, *channels):
+        self.channels.update(channels)
+
+    async def unsubscribe(self, *channels):
+        self.channels.difference_update(channels)
+
+    async def psubscribe(self, *patterns):
+        self.patterns.update(patterns)
+
+    async def punsubscribe(self, *patterns):
+        self.patterns.difference_update(patterns)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return await asyncio.wait_for(self.messages.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        pass
+
+
+class RedisBackplaneTest(SimpleTestCase):
+    """Two engines stand in for two ws_server processes sharing one Redis"""
+
+    async def make_process(self, client=None, url=None):
+        engine = FanoutEngine()
+        backplane = RedisBackplane(
+            lambda room, data, seq, rooms: engine.publish_message(
+                engine.encode(room, {**data, "seq": seq}), skip=rooms[:rooms.index(room)]
+            ),
+            url=url, client=client
+        )
+        engine.on_room_created = lambda room: asyncio.ensure_future(
+            backplane.watch(room[:-1]) if room.endswith("*") else backplane.subscribe(room)
+        )
+        engine.on_room_empty = lambda room: asyncio.ensure_future(
+            backplane.unwatch(room[:-1]) if room.endswith("*") else backplane.unsubscribe(room)
+        )
+        await backplane.start()
+        return engine, backplane
+
+    async def check_shared_rooms(self, client=None, url=None):
+        engine_a, backplane_a = await self.make_process(client, url)
+        engine_b, backplane_b = await self.make_process(client, url)
+        ws_a, ws_b = FakeWebSocket(), FakeWebSocket()
+        engine_a.join(engine_a.register(ws_a), "org_1_update")
+        engine_b.join(engine_b.register(ws_b), "org_1_update")
+        await asyncio.sleep(0.05)
+
+        # Only rooms with local clients are subscribed
+        self.assertEqual(backplane_a.subscribed, {"org_1_update"})
+        await backplane_a.publish("org_1_update", service_event(1, "major_outage"))
+        await backplane_a.publish("org_2_update", service_event(2, "major_outage"))
+        for _ in range(100):
+            if ws_a.sent and ws_b.sent:
+                break
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(len(ws_a.sent), 1)
+        self.assertEqual(len(ws_b.sent), 1)
+        self.assertEqual(json.loads(ws_b.sent[0])["data"]["currentStatus"], "major_outage")
+        # Both processes see the same room sequence number
+        self.assertEqual(json.loads(ws_a.sent[0])["seq"], json.loads(ws_b.sent[0])["seq"])
+
+        # The last client leaving a room unsubscribes that process
+        await engine_b.unregister(ws_b)
+        await asyncio.sleep(0.05)
+        self.assertEqual(backplane_b.subscribed, set())
+
+        await engine_a.unregister(ws_a)
+        await backplane_a.stop()
+        await backplane_b.stop()
+
+    async def test_rooms_shared_between_processes(self):
+        await self.check_shared_rooms(client=FakeRedis())
+
+    async def test_multi_room_event_reaches_wildcard_once(self):
+        client = FakeRedis()
+        engine_a, backplane_a = await self.make_process(client)
+        engine_b, backplane_b = await self.make_process(client)
+        wildcard, exact = FakeWebSocket(), FakeWebSocket()
+        engine_a.join(engine_a.register(wildcard), "org_1_*")
+        engine_b.join(engine_b.register(exact), "org_1_incident_5_update")
+        await asyncio.sleep(0.05)
+
+        seqs = await backplane_b.publish(["org_1_update", "org_1_incident_5_update"], service_event(5, "major_outage"))
+        await asyncio.sleep(0.05)
+
+        self.assertEqual(seqs, [1, 1])
+        self.assertEqual(len(wildcard.sent), 1)
+        self.assertEqual(len(exact.sent), 1)
+
+        await engine_a.unregister(wildcard)
+        await asyncio.sleep(0.05)
+        self.assertEqual(backplane_a.watched, {})
+        await engine_b.unregister(exact)
+        await backplane_a.stop()
+        await backplane_b.stop()
+
+    @unittest.skipUnless(os.environ.get("REDIS_URL"), "set REDIS_URL to run against a local redis-server")
+    async def test_rooms_shared_between_processes_with_redis(self):
+        await self.check_shared_rooms(url=os.environ["REDIS_URL"])
+
+
+class RelayBackplaneTest(SimpleTestCase):
+    """Workers of one supervisor, each receiving every event through the broadcaster"""
+
+    async def test_every_worker_gets_every_event_in_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            broadcaster = Broadcaster(os.path.join(directory, "relay.sock"))
+            server = await broadcaster.start()
+            received = [[], []]
+            workers = []
+            for delivered in received:
+                backplane = RelayBackplane(
+                    lambda room, data, seq, rooms, delivered=delivered: delivered.append((room, seq, data["n"])),
+                    broadcaster.path
+                )
+                await backplane.start()
+                workers.append(backplane)
+            for _ in range(100):
+                if len(broadcaster.workers) == 2:
+                    break
+                await asyncio.sleep(0.01)
+
+            # Django's internal port and a worker's client both publish through the supervisor
+            broadcaster.publish(["org_1_update", "org_1_incident_5_update"], {"n": 1})
+            seqs = await workers[0].publish("org_1_update", {"n": 2})
+            for _ in range(100):
+                if all(len(delivered) == 3 for delivered in received):
+                    break
+                await asyncio.sleep(0.01)
+
+            self.assertEqual(seqs, [])
+            expected = [("org_1_update", 1, 1), ("org_1_incident_5_update", 1, 1), ("org_1_update", 2, 2)]
+            self.assertEqual(received, [expected, expected])
+            self.assertEqual(await workers[1].current_seq("org_1_update"), 2)
+            self.assertEqual(workers[0].epoch, workers[1].epoch)
+
+            for backplane in workers:
+                await backplane.stop()
+            server.close()
+            await server.wait_closed()
+
+    async def test_worker_notices_supervisor_exit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            broadcaster = Broadcaster(os.path.join(directory, "relay.sock"))
+            server = await broadcaster.start()
+            closed = asyncio.Event()
+            backplane = RelayBackplane(lambda room, data, seq, rooms: None, broadcaster.path)
+            backplane.on_close = closed.set
+            await backplane.start()
+            for _ in range(100):
+                if broadcaster.workers:
+                    break
+                await asyncio.sleep(0.01)
+
+            server.close()
+            for writer in list(broadcaster.workers):
+                writer.close()
+            await asyncio.wait_for(closed.wait(), 2)
+            await backplane.stop()
+
+
+class TopicIndexTest(SimpleTestCase):
+    def test_exact_and_wildcard_matches(self):
+        index = TopicIndex()
+        index.subscribe("org_1_update", "dashboard")
+        index.subscribe("org_1_*", "all_of_org_1")
+        index.subscribe("org_1_incident_*", "incidents_of_org_1")
+        index.subscribe("org_12_*", "all_of_org_12")
+
+        self.assertEqual(index.match("org_1_update"), {"dashboard", "all_of_org_1"})
+        self.assertEqual(index.match("org_1_incident_5_update"), {"all_of_org_1", "incidents_of_org_1"})
+        self.assertEqual(index.match("org_12_update"), {"all_of_org_12"})
+        self.assertEqual(index.match("org_1"), set())
+        self.assertEqual(index.match("org_2_update"), set())
+
+    def test_unsubscribe_reports_empty_topic_and_prunes(self):
+        index = TopicIndex()
+        self.assertTrue(index.subscribe("org_1_*", "a"))
+        self.assertFalse(index.subscribe("org_1_*", "b"))
+
+        self.assertFalse(index.unsubscribe("org_1_*", "a"))
+        self.assertTrue(index.unsubscribe("org_1_*", "b"))
+        self.assertFalse(index.unsubscribe("org_1_*", "b"))
+        self.assertEqual(index.topics, {})
+        self.assertEqual(index.root.children, {})
+
+    def test_valid_topics(self):
+        self.assertTrue(valid_topic("org_1_update"))
+        self.assertTrue(valid_topic("org_1_*"))
+        self.assertFalse(valid_topic("*"))
+        self.assertFalse(valid_topic("org_*"))
+        self.assertFalse(valid_topic("org_1*"))
+        self.assertFalse(valid_topic("org_*_update"))
+        self.assertFalse(valid_topic(123))
+
+    async def test_multi_room_event_is_delivered_once_per_connection(self):
+        engine = FanoutEngine()
+        delivered = []
+        backplane = LocalBackplane(
+            lambda room, data, seq, rooms: delivered.append(engine.publish_message(
+                engine.encode(room, data), skip=rooms[:rooms.index(room)]
+            ))
+        )
+        wildcard, exact, both = FakeWebSocket(), FakeWebSocket(), FakeWebSocket()
+        engine.join(engine.register(wildcard), "org_1_*")
+        engine.join(engine.register(exact), "org_1_incident_5_update")
+        connection = engine.register(both)
+        engine.join(connection, "org_1_update")
+        engine.join(connection, "org_1_incident_5_update")
+
+        await backplane.publish(["org_1_update", "org_1_incident_5_update"], service_event(5, "major_outage"))
+        await asyncio.sleep(0.01)
+
+        self.assertEqual(delivered, [2, 1])
+        self.assertEqual([len(ws.sent) for ws in (wildcard, exact, both)], [1, 1, 1])
+
+    def test_frame_names_every_room(self):
+        frame = json.loads(encode_frame(["org_1_update", "org_1_incident_5_update"], {}))
+        self.assertEqual(frame_rooms(frame), ["org_1_update", "org_1_incident_5_update"])
+        self.assertEqual(frame_rooms(json.loads(encode_frame("org_1_update", {}))), ["org_1_update"])
+        self.assertEqual(frame_rooms({"data": {}}), [])
+
+
+class ReplayBufferTest(SimpleTestCase):
+    def test_returns_only_missed_messages(self):
+        replay = ReplayBuffer(capacity=10)
+        for seq in range(1, 6):
+            replay.record("room", seq, f"m{seq}")
+
+        self.assertEqual(replay.missed("room", 3), ["m4", "m5"])
+        self.assertEqual(replay.missed("room", 5), [])
+
+    def test_gap_older_than_buffer_requires_resync(self):
+        replay = ReplayBuffer(capacity=3)
+        for seq in range(1, 8):
+            replay.record("room", seq, f"m{seq}")
+
+        self.assertEqual(replay.missed("room", 4), ["m5", "m6", "m7"])
+        self.assertIsNone(replay.missed("room", 3))
+        self.assertEqual(replay.resyncs, 1)
+
+    def test_sequence_jump_discards_older_history(self):
+        """A process that missed messages can't vouch for anything before the jump"""
+        replay = ReplayBuffer(capacity=10)
+        replay.record("room", 1, "m1")
+        replay.record("room", 2, "m2")
+        replay.record("room", 5, "m5")
+
+        self.assertIsNone(replay.missed("room", 1))
+        self.assertEqual(replay.missed("room", 4), ["m5"])
+
+    def test_client_ahead_of_server_requires_resync(self):
+        """Sequence counters restart with the server"""
+        replay = ReplayBuffer()
+        replay.record("room", 1, "m1")
+
+        self.assertIsNone(replay.missed("room", 40))
+        self.assertIsNone(replay.missed("other_room", 3))
+        self.assertEqual(replay.missed("other_room", 0), [])
+
+
+class SessionTest(SimpleTestCase):
+    async def test_token_records_topics_and_last_sent_seq(self):
+        engine = FanoutEngine()
+        ws = FakeWebSocket()
+        connection = engine.register(ws)
+        connection.set_batch_ms(0)
+        connection.set_encoding(ENCODING_MSGPACK)
+        for room in ("org_1_update", "org_2_*"):
+            engine.join(connection, room)
+        for seq in (6, 7):
+            message = engine.encode("org_1_update", service_event(1, "operational"))
+            message.seq = seq
+            engine.publish_message(message)
+        await asyncio.sleep(0.01)
+
+        codec = SessionCodec("key", ttl=60)
+        session = codec.load(codec.issue(connection, "local:a"))
+        self.assertEqual(session["topics"], ["org_1_update", "org_2_*"])
+        self.assertEqual(session["seqs"], {"org_1_update": 7})
+        self.assertEqual(session["epoch"], "local:a")
+        self.assertEqual(session_options(session), {"encoding": ENCODING_MSGPACK, "batch_ms": 0, "full_objects": False})
+        self.assertTrue(connection.flushed)
+
+        self.assertIsNone(SessionCodec("other key").load(codec.issue(connection, "local:a")))
+        self.assertIsNone(SessionCodec("key", ttl=-10).load(SessionCodec("key", ttl=-10).issue(connection, "local:a")))
+        self.assertIsNone(codec.load(access_token(1)))
+        self.assertIsNone(codec.load(None))
+        await engine.unregister(ws)
+
+    async def test_overtaken_messages_are_resumed(self):
+        engine = FanoutEngine()
+        replay = ReplayBuffer()
+        ws = FakeWebSocket(delay=0.1)
+        connection = engine.register(ws)
+        engine.join(connection, "org_1_update")
+        events = [
+            {"type": "service_updated", "data": {"id": 1, "description": "a"}, "patch": True},
+            {"type": "service_updated", "data": {"id": 2, "description": "b"}, "patch": True},
+            {"type": "incident_created", "data": {"id": 5, "severity": "critical"}},
+        ]
+        for seq, event in enumerate(events, start=1):
+            message = engine.encode("org_1_update", {**event, "seq": seq})
+            message.seq = seq
+            replay.record("org_1_update", seq, message)
+            engine.publish_message(message)
+            await asyncio.sleep(0)  # the writer takes seq 1 right away
+
+        # seq 3 overtook seq 2, which is still queued
+        await asyncio.sleep(0.25)
+        self.assertEqual([json.loads(m)["seq"] for m in ws.sent], [1, 3])
+        self.assertEqual(connection.sent_seq, {"org_1_update": 3})
+        codec = SessionCodec("key")
+        session = codec.load(codec.issue(connection, "local:a"))
+        self.assertEqual(session["seqs"], {"org_1_update": 1})
+        self.assertEqual([m.seq for m in replay.missed("org_1_update", session["seqs"]["org_1_update"])], [2, 3])
+
+        await asyncio.sleep(0.15)
+        self.assertEqual(codec.load(codec.issue(connection, "local:a"))["seqs"], {"org_1_update": 3})
+        await engine.unregister(ws)
+
+    async def test_new_process_continues_a_resumed_room(self):
+        """A restarted single process picks up numbering where the old one left off"""
+        delivered = []
+        backplane = LocalBackplane(lambda room, data, seq, rooms: delivered.append(seq))
+        replay = ReplayBuffer()
+        self.assertNotEqual(backplane.epoch, LocalBackplane(None).epoch)
+
+        self.assertTrue(backplane.adopt_seq("org_1_update", 41))
+        replay.resume("org_1_update", 41)
+        self.assertEqual(replay.missed("org_1_update", 41), [])
+        self.assertFalse(backplane.adopt_seq("org_1_update", 12))
+
+        await backplane.publish("org_1_update", {"n": 1})
+        replay.record("org_1_update", delivered[-1], "m42")
+        self.assertEqual(delivered, [42])
+        self.assertEqual(replay.missed("org_1_update", 41), ["m42"])
+        # A room this process already numbered can't be compared with another epoch's seq
+        self.assertIsNone(replay.missed("org_1_update", 12))
+
+
+def snapshot_event(event_type, **data):
+    return {"type": event_type, "organization_id": 1, "data": data}
+
+
+class SnapshotStoreTest(SimpleTestCase):
+    async def test_concurrent_joiners_share_one_seed_query(self):
+        calls = []
+
+        async def loader(org_id):
+            calls.append(org_id)
+            await asyncio.sleep(0.05)
+            return [{"id": 1, "currentStatus": "operational", "updatedAt": "2025-01-01T00:00:00Z"}], []
+
+        store = SnapshotStore(loader)
+        snapshots = await asyncio.gather(*[store.get(1) for _ in range(20)])
+
+        self.assertEqual(calls, [1])
+        self.assertTrue(all(s is snapshots[0] for s in snapshots))
+        self.assertTrue(snapshots[0].seeded)
+
+    async def test_events_during_seed_are_applied_on_top(self):
+        loaded = asyncio.Event()
+
+        async def loader(org_id):
+            await loaded.wait()
+            return [{"id": 1, "currentStatus": "operational", "updatedAt": "2025-01-01T00:00:00Z"}], []
+
+        store = SnapshotStore(loader)
+        pending = asyncio.ensure_future(store.get(1))
+        await asyncio.sleep(0)
+        store.apply(snapshot_event("service_updated", id=1, currentStatus="major_outage",
+                                   updatedAt="2025-01-01T00:05:00Z"))
+        loaded.set()
+        snapshot = await pending
+
+        self.assertEqual(snapshot.services[1]["currentStatus"], "major_outage")
+
+    async def test_keeps_only_open_incidents(self):
+        store = SnapshotStore()
+        snapshot = await store.get(1)
+        store.apply(snapshot_event("service_created", id=1, updatedAt="a"))
+        store.apply(snapshot_event("incident_created", id=10, serviceId=1, status="investigating", updatedAt="a"))
+        store.apply(snapshot_event("incident_created", id=11, serviceId=1, status="identified", updatedAt="a"))
+        store.apply(snapshot_event("incident_updated", id=10, serviceId=1, status="resolved", updatedAt="b"))
+
+        self.assertEqual(list(snapshot.incidents), [11])
+        self.assertFalse(snapshot.seeded)
+
+        store.apply(snapshot_event("service_deleted", id=1))
+        self.assertEqual(snapshot.to_dict(), {"services": [], "incidents": []})
+
+    async def test_reopened_incident_comes_back(self):
+        store = SnapshotStore()
+        snapshot = await store.get(1)
+        opened = {"id": 10, "serviceId": 1, "title": "Outage", "severity": "high", "status": "investigating", "version": 1}
+        store.apply(snapshot_event("incident_created", **opened))
+        resolved = {**snapshot_event("incident_updated", id=10, serviceId=1, status="resolved", version=2), "patch": True}
+        self.assertEqual(store.apply(resolved)["severity"], "high")
+        self.assertEqual(snapshot.incidents, {})
+
+        # Reopening is sent in full (see services.signals.reopens_incident)
+        reopened = store.apply(snapshot_event("incident_updated", **{**opened, "version": 3}))
+        self.assertEqual(reopened["severity"], "high")
+        self.assertEqual(snapshot.incidents[10]["status"], "investigating")
+        patch = {**snapshot_event("incident_updated", id=10, serviceId=1, status="monitoring", version=4), "patch": True}
+        self.assertEqual(store.apply(patch)["title"], "Outage")
+
+    async def test_patches_merge_by_version(self):
+        store = SnapshotStore()
+        snapshot = await store.get(1)
+        store.apply(snapshot_event("service_created", id=1, name="API", currentStatus="operational", version=1))
+
+        patch = {**snapshot_event("service_updated", id=1, currentStatus="major_outage", version=3), "patch": True}
+        self.assertEqual(store.apply(patch), {"id": 1, "name": "API", "currentStatus": "major_outage", "version": 3})
+        # An older patch arriving late does not win
+        stale = {**snapshot_event("service_updated", id=1, currentStatus="degraded_performance", version=2), "patch": True}
+        self.assertEqual(store.apply(stale)["currentStatus"], "major_outage")
+        # Nothing to apply a patch to
+        unknown = {**snapshot_event("service_updated", id=2, currentStatus="operational", version=2), "patch": True}
+        self.assertIsNone(store.apply(unknown))
+        self.assertEqual(list(snapshot.services), [1])
+
+    def test_public_snapshot_leaves_out_private_services(self):
+        snapshot = OrgSnapshot()
+        snapshot.seed(
+            [{"id": 1, "publiclyVisible": True}, {"id": 2, "publiclyVisible": False}],
+            [{"id": 10, "serviceId": 1, "status": "investigating"}, {"id": 11, "serviceId": 2, "status": "identified"}],
+        )
+        public = snapshot.to_dict(public_only=True)
+        self.assertEqual([s["id"] for s in public["services"]], [1])
+        self.assertEqual([i["id"] for i in public["incidents"]], [10])
+        self.assertEqual(len(snapshot.to_dict()["services"]), 2)
+
+    async def test_full_object_connections_get_the_fallback(self):
+        engine = FanoutEngine()
+        patch_ws, full_ws = FakeWebSocket(), FakeWebSocket()
+        engine.join(engine.register(patch_ws), "org_1_update")
+        connection = engine.register(full_ws)
+        connection.full_objects = True
+        engine.join(connection, "org_1_update")
+
+        message = engine.encode("org_1_update", {"type": "service_updated", "data": {"id": 1, "version": 2}, "patch": True})
+        message.fallback = engine.encode("org_1_update", {"type": "service_updated", "data": {"id": 1, "name": "API", "version": 2}})
+        engine.publish_message(message)
+        await asyncio.sleep(0.01)
+
+        self.assertTrue(json.loads(patch_ws.sent[0])["patch"])
+        self.assertEqual(json.loads(full_ws.sent[0])["data"]["name"], "API")
+
+    def test_org_room_id(self):
+        self.assertEqual(org_room_id("org_42_update"), 42)
+        self.assertIsNone(org_room_id("org_42_incident_7_update"))
+
+
+class WsServerTest(SimpleTestCase):
+    """ws_server's handler on an ephemeral port, driven by a real websockets client"""
+
+    origin = settings.CORS_ALLOWED_ORIGINS[0]
+
+    @asynccontextmanager
+    async def running(self, loader=None):
+        async def scopes(user_id):
+            return 1
+
+        state = {
+            "authenticator": Authenticator(
+                TokenVerifier.from_settings(settings.SIMPLE_JWT), ScopeCache(scopes),
+                allowed_origins=settings.CORS_ALLOWED_ORIGINS
+            ),
+            # Delivers without the fair scheduler, whose loop isn't running here
+            "backplane": LocalBackplane(ws_server.deliver),
+            "replay": ReplayBuffer(),
+            "snapshots": SnapshotStore(loader),
+            "snapshot_orgs": set(),
+        }
+        for name, value in state.items():
+            self.addCleanup(setattr, ws_server, name, getattr(ws_server, name))
+            setattr(ws_server, name, value)
+        server = await serve(
+            ws_server.handler, "localhost", 0, create_protocol=ws_server.AuthenticatedProtocol, ping_interval=None
+        )
+        self.url = f"ws://localhost:{server.sockets[0].getsockname()[1]}"
+        try:
+            yield server
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    async def connect(self, user_id=None, origin=origin):
+        headers = {"Cookie": f"access_token={access_token(user_id)}"} if user_id else {}
+        return await websockets.connect(self.url, origin=origin, additional_headers=headers, compression=None)
+
+    async def receive(self, websocket):
+        return json.loads(await asyncio.wait_for(websocket.recv(), 2))
+
+    async def join(self, websocket, room, **options):
+        """Join and return the frames the join queued (replay, snapshot or resync marker)"""
+        await websocket.send(json.dumps({"action": "join", "room": room, **options}))
+        # Frames are handled in order, an answered bad join means the join before it is done.
+        # Errors are sent right away though, queued frames may still follow.
+        await websocket.send(json.dumps({"action": "join", "room": "bad_*_room"}))
+        frames, answered = [], False
+        while True:
+            try:
+                frame = json.loads(await asyncio.wait_for(websocket.recv(), 2 if not answered else 0.1))
+            except asyncio.TimeoutError:
+                self.assertTrue(answered)
+                return frames
+            if frame.get("error") == "Invalid room: bad_*_room":
+                answered = True
+            else:
+                frames.append(frame)
+
+    async def test_foreign_origin_is_refused(self):
+        async with self.running():
+            with self.assertRaises(InvalidStatus) as refused:
+                await self.connect(user_id=5, origin="https://attacker.example")
+            self.assertEqual(refused.exception.response.status_code, 403)
+
+            member = await self.connect(user_id=5)
+            await self.join(member, "org_1_update")
+            await ws_server.broadcast("org_1_update", {**service_event(1, "major_outage"), "organization_id": 1, "public": False})
+            self.assertEqual((await self.receive(member))["data"]["id"], 1)
+            await member.close()
+
+    async def test_room_must_be_a_string(self):
+        async with self.running():
+            websocket = await self.connect()
+            await websocket.send(json.dumps({"action": "join", "room": 123}))
+            self.assertEqual(await self.receive(websocket), {"error": "Invalid room: 123"})
+            # Still connected
+            self.assertEqual(await self.join(websocket, "org_1_update"), [])
+            await websocket.close()
+
+    async def publish(self, room, count, first_id=1):
+        for service_id in range(first_id, first_id + count):
+            await ws_server.broadcast(room, {**service_event(service_id, "operational"), "organization_id": 1, "public": True})
+
+    async def test_rejoin_replays_what_was_missed(self):
+        async with self.running():
+            watcher = await self.connect()
+            await self.join(watcher, "org_1_update")
+            await self.publish("org_1_update", 3)
+            self.assertEqual([(await self.receive(watcher))["seq"] for _ in range(3)], [1, 2, 3])
+
+            rejoining = await self.connect()
+            frames = await self.join(rejoining, "org_1_update", last_seq=1)
+            self.assertEqual([(frame["seq"], frame["data"]["id"]) for frame in frames], [(2, 2), (3, 3)])
+            for websocket in (watcher, rejoining):
+                await websocket.close()
+
+    async def test_rejoin_with_nothing_missed_is_resumable(self):
+        async with self.running():
+            await self.publish("org_1_update", 2)
+            websocket = await self.connect()
+            self.assertEqual(await self.join(websocket, "org_1_update", last_seq=2), [])
+            await websocket.send(json.dumps({"action": "session"}))
+            session = ws_server.sessions.load((await self.receive(websocket))["session"])
+            self.assertEqual(session["seqs"], {"org_1_update": 2})
+            await websocket.close()
+
+    async def test_rejoin_past_the_buffer_is_told_to_resync(self):
+        async with self.running():
+            await self.publish("org_1_update", 2)
+            websocket = await self.connect()
+            frames = await self.join(websocket, "org_1_update", last_seq=99)
+            self.assertEqual(frames, [{"type": "resync_required", "room": "org_1_update", "seq": 2}])
+            await websocket.close()
+
+    async def test_snapshot_on_join(self):
+        async def loader(org_id):
+            return [
+                {"id": 1, "name": "API", "publiclyVisible": True, "updatedAt": "a"},
+                {"id": 2, "name": "Billing", "publiclyVisible": False, "updatedAt": "a"},
+            ], []
+
+        async with self.running(loader):
+            member, anonymous = await self.connect(user_id=5), await self.connect()
+            (snapshot,) = await self.join(member, "org_1_update", snapshot=True)
+            self.assertEqual((snapshot["type"], snapshot["seq"], snapshot["complete"]), ("snapshot", 0, True))
+            self.assertEqual([service["id"] for service in snapshot["data"]["services"]], [1, 2])
+            # Outside the org, only public services
+            (snapshot,) = await self.join(anonymous, "org_1_update", snapshot=True)
+            self.assertEqual([service["id"] for service in snapshot["data"]["services"]], [1])
+
+            await self.publish("org_1_update", 1, first_id=3)
+            self.assertEqual((await self.receive(member))["seq"], 1)
+            for websocket in (member, anonymous):
+                await websocket.close()
+
+    async def test_session_resumes_rooms_from_the_last_seq_sent(self):
+        async with self.running():
+            websocket = await self.connect()
+            await self.join(websocket, "org_1_incident_2_update")
+            await self.publish("org_1_incident_2_update", 1)
+            self.assertEqual((await self.receive(websocket))["seq"], 1)
+            await websocket.send(json.dumps({"action": "session"}))
+            session = await self.receive(websocket)
+            self.assertEqual(session["type"], "session")
+            await websocket.close()
+
+            await self.publish("org_1_incident_2_update", 2, first_id=2)
+            resumed = await self.connect()
+            await resumed.send(json.dumps({"action": "resume", "session": "not a token"}))
+            self.assertEqual(await self.receive(resumed), {"error": "Invalid or expired session"})
+            await resumed.send(json.dumps({"action": "resume", "session": session["session"]}))
+            self.assertEqual([(await self.receive(resumed))["seq"] for _ in range(2)], [2, 3])
+            await resumed.close()
+
+    async def test_drain_hands_clients_off(self):
+        async with self.running() as server:
+            websocket = await self.connect()
+            await self.join(websocket, "org_1_update")
+            await self.publish("org_1_update", 1)
+            self.assertEqual((await self.receive(websocket))["seq"], 1)
+
+            await ws_server.drain(server, None)
+            notice = await self.receive(websocket)
+            self.assertEqual(notice["type"], "reconnect")
+            self.assertLessEqual(notice["retry_after_ms"], ws_server.DRAIN_JITTER_MS)
+            with self.assertRaises(websockets.ConnectionClosed):
+                await websocket.recv()
+            self.assertEqual(websocket.close_code, CLOSE_SERVICE_RESTART)
+            # The notice's session picks up where the client was
+            self.assertEqual(ws_server.sessions.load(notice["session"])["seqs"], {"org_1_update": 1})
+
+    async def test_malformed_joins_are_answered(self):
+        async with self.running():
+            websocket = await self.connect()
+            for room, error in (("org_*", "Invalid room: org_*"), ("org_1_*_update", "Invalid room: org_1_*_update")):
+                await websocket.send(json.dumps({"action": "join", "room": room}))
+                self.assertEqual(await self.receive(websocket), {"error": error})
+            await websocket.send(json.dumps({"action": "join", "room": "org_1_update", "encoding": "xml"}))
+            self.assertEqual(await self.receive(websocket), {"error": "Unsupported encoding: xml"})
+            await websocket.send("{not json")
+            self.assertEqual(await self.receive(websocket), {"error": "Invalid JSON"})
+            await websocket.close()
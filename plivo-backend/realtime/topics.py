@@ -0,0 +1,122 @@
+"""
+Topic index for room subscriptions, including prefix wildcards.
+
+Room names are split on "_" into segments and stored in a trie. A
+subscription is either an exact room (`org_42_update`) or a prefix
+wildcard ending in `*` (`org_42_*`, every room of org 42). Matching a
+published room walks one trie path, so its cost depends on the number of
+segments in the room name and not on how many subscriptions exist.
+
+An event can be published once to several rooms. Every subscriber matching
+any of them gets a single copy, the one for the first room it matches.
+"""
+from typing import Dict, List, Optional, Set, Union
+
+WILDCARD = "*"
+SEPARATOR = "_"
+
+# `*` or `org_*` would subscribe to every tenant
+MIN_PATTERN_SEGMENTS = 2
+
+
+def as_rooms(room: Union[str, List[str]]) -> List[str]:
+    """A publish target is one room or a list of rooms the same event goes to"""
+    return [room] if isinstance(room, str) else list(room)
+
+
+def is_pattern(topic: str) -> bool:
+    return topic.endswith(WILDCARD)
+
+
+def pattern_prefix(topic: str) -> str:
+    """`org_42_*` -> `org_42_`"""
+    return topic[:-len(WILDCARD)]
+
+
+def valid_topic(topic: str) -> bool:
+    if not isinstance(topic, str):
+        return False
+    if not is_pattern(topic):
+        return WILDCARD not in topic
+    prefix = pattern_prefix(topic)
+    if WILDCARD in prefix or not prefix.endswith(SEPARATOR):
+        return False
+    return len([s for s in prefix.split(SEPARATOR) if s]) >= MIN_PATTERN_SEGMENTS
+
+
+class _Node:
+    __slots__ = ("children", "exact", "wildcard")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.exact: Set = set()
+        self.wildcard: Set = set()
+
+
+class TopicIndex:
+    """Maps topics to subscribers and published rooms to every matching subscriber"""
+
+    def __init__(self):
+        self.root = _Node()
+        # topic -> subscribers, kept alongside the trie for sizes and introspection
+        self.topics: Dict[str, Set] = {}
+
+    @staticmethod
+    def _segments(topic: str):
+        if is_pattern(topic):
+            return pattern_prefix(topic).rstrip(SEPARATOR).split(SEPARATOR), True
+        return topic.split(SEPARATOR), False
+
+    def subscribe(self, topic: str, subscriber) -> bool:
+        """Returns True if this is the topic's first subscriber"""
+        segments, wildcard = self._segments(topic)
+        node = self.root
+        for segment in segments:
+            node = node.children.setdefault(segment, _Node())
+        (node.wildcard if wildcard else node.exact).add(subscriber)
+
+        members = self.topics.get(topic)
+        created = members is None
+        if created:
+            members = self.topics[topic] = set()
+        members.add(subscriber)
+        return created
+
+    def unsubscribe(self, topic: str, subscriber) -> bool:
+        """Returns True if the topic has no subscribers left"""
+        members = self.topics.get(topic)
+        if members is None or subscriber not in members:
+            return False
+        members.discard(subscriber)
+
+        segments, wildcard = self._segments(topic)
+        path = [self.root]
+        for segment in segments:
+            path.append(path[-1].children[segment])
+        (path[-1].wildcard if wildcard else path[-1].exact).discard(subscriber)
+        # Prune branches that no longer lead to any subscriber
+        for depth in range(len(segments), 0, -1):
+            node = path[depth]
+            if node.children or node.exact or node.wildcard:
+                break
+            del path[depth - 1].children[segments[depth - 1]]
+
+        if members:
+            return False
+        del self.topics[topic]
+        return True
+
+    def match(self, room: str) -> Set:
+        """Every subscriber of `room` itself or of a wildcard covering it"""
+        matched = set()
+        node: Optional[_Node] = self.root
+        segments = room.split(SEPARATOR)
+        for index, segment in enumerate(segments):
+            node = node.children.get(segment)
+            if node is None:
+                return matched
+            # `org_42_*` covers rooms below org_42, not org_42 itself
+            if node.wildcard and index < len(segments) - 1:
+                matched |= node.wildcard
+        matched |= node.exact
+        return matched
@@ -0,0 +1,183 @@
+"""
+Multi-process ws_server on one box.
+
+With WS_WORKERS=N, `python ws_server.py` becomes a supervisor that starts
+N worker processes. Workers bind the WebSocket port with SO_REUSEPORT, so
+the kernel spreads new connections over them and connection capacity
+grows with cores.
+
+Without a Redis backplane the supervisor owns the internal port. It
+numbers each event Django publishes and sends every worker a copy over a
+Unix socket (RelayBackplane on the worker side). With WS_BACKPLANE_URL
+set, workers share the internal port too and exchange events through
+Redis as separate ws_server processes do.
+
+SIGTERM is passed on to the workers, which drain their clients, and the
+supervisor exits once they have.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from .backplane import encode_relay_message
+from .framing import MAX_FRAME_SIZE, frame_rooms, read_frames
+from .topics import is_pattern
+
+log = logging.getLogger("ws_server.workers")
+
+# Bytes a worker may fall behind by before it is cut off, it then drains and restarts
+MAX_WORKER_BACKLOG = 64 * 1024 * 1024
+# Seconds between restarts of a worker that exited on its own
+RESTART_DELAY = 1.0
+# Seconds to wait for workers to connect before taking events
+STARTUP_TIMEOUT = 30.0
+
+
+def use_uvloop() -> bool:
+    """Run asyncio on uvloop if it is installed"""
+    try:
+        import uvloop
+    except ImportError:
+        log.warning("⚠️ WS_UVLOOP is set but uvloop is not installed, using the default event loop")
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+class Broadcaster:
+    """Supervisor side of the relay: numbers events per room and sends every worker a copy"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sequences: Dict[str, int] = {}
+        self.workers = set()
+        # Internal port connections from Django
+        self.publishers = set()
+        self.relayed = 0
+        self.malformed = 0
+
+    async def start(self):
+        return await asyncio.start_unix_server(self._handle_worker, self.path, limit=MAX_FRAME_SIZE)
+
+    def publish(self, rooms: List[str], data):
+        seqs = []
+        for room in rooms:
+            seq = self.sequences[room] = self.sequences.get(room, 0) + 1
+            seqs.append(seq)
+        line = encode_relay_message(seqs, rooms, data)
+        self.relayed += 1
+        for writer in list(self.workers):
+            if writer.transport.get_write_buffer_size() > MAX_WORKER_BACKLOG:
+                # A stuck worker must not make the supervisor buffer without bound
+                log.error("❌ Dropping a worker that stopped reading events")
+                self.workers.discard(writer)
+                writer.close()
+                continue
+            writer.write(line)
+
+    async def handle_frames(self, reader):
+        """Publish the frames of one connection (Django's internal port or a worker)"""
+        async for payload in read_frames(reader):
+            rooms = frame_rooms(payload)
+            if not rooms or any(is_pattern(room) for room in rooms):
+                self.malformed += 1
+                log.warning("⚠️ Dropping malformed internal frame")
+                continue
+            self.publish(rooms, payload.get("data"))
+
+    async def handle_internal(self, reader, writer):
+        self.publishers.add(writer)
+        try:
+            await self.handle_frames(reader)
+        except Exception as e:
+            log.error(f"❌ Internal publisher connection failed: {e}")
+        finally:
+            self.publishers.discard(writer)
+            writer.close()
+
+    async def _handle_worker(self, reader, writer):
+        self.workers.add(writer)
+        try:
+            # Workers publish what their clients send
+            await self.handle_frames(reader)
+        except Exception as e:
+            log.error(f"❌ Worker connection failed: {e}")
+        finally:
+            self.workers.discard(writer)
+            writer.close()
+
+
+class Supervisor:
+    """Starts the workers, restarts those that die and stops them all on SIGTERM"""
+
+    def __init__(self, count: int, internal_host: str = "localhost", internal_port: int = 9000, relay: bool = True):
+        self.count = count
+        self.internal_host = internal_host
+        self.internal_port = internal_port
+        self.relay = relay
+        self.processes: Dict[int, subprocess.Popen] = {}
+        self.servers = []
+        self.broadcaster: Optional[Broadcaster] = None
+        self.stopping = False
+
+    def spawn(self, index: int, env: dict) -> subprocess.Popen:
+        worker_env = {**env, "WS_WORKER": str(index)}
+        return subprocess.Popen([sys.executable, *sys.argv], env=worker_env)
+
+    async def run(self):
+        env = dict(os.environ)
+        directory = None
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, self.stop)
+        if self.relay:
+            directory = tempfile.mkdtemp(prefix="ws_server_")
+            broadcaster = self.broadcaster = Broadcaster(os.path.join(directory, "relay.sock"))
+            self.servers.append(await broadcaster.start())
+            env["WS_RELAY_SOCKET"] = broadcaster.path
+        for index in range(1, self.count + 1):
+            self.processes[index] = self.spawn(index, env)
+        log.info(f"👷 Started {self.count} workers")
+        if self.relay:
+            # Events taken before a worker is connected would never reach its clients
+            deadline = time.monotonic() + STARTUP_TIMEOUT
+            while len(broadcaster.workers) < self.count and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            self.servers.append(await asyncio.start_server(
+                broadcaster.handle_internal, self.internal_host, self.internal_port, limit=MAX_FRAME_SIZE
+            ))
+            log.info(f"📡 TCP listener running at {self.internal_host}:{self.internal_port}, relaying to workers")
+
+        while self.processes:
+            await asyncio.sleep(RESTART_DELAY)
+            for index, process in list(self.processes.items()):
+                if process.poll() is None:
+                    continue
+                if self.stopping:
+                    del self.processes[index]
+                else:
+                    log.error(f"❌ Worker {index} exited with {process.returncode}, restarting it")
+                    self.processes[index] = self.spawn(index, env)
+        for server in self.servers:
+            server.close()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+        log.info("🛑 All workers stopped")
+
+    def stop(self):
+        """Each worker drains its clients, then exits"""
+        self.stopping = True
+        # Publishers move to the next ws_server while the workers drain
+        for server in self.servers[1:]:
+            server.close()
+        if self.broadcaster is not None:
+            for writer in list(self.broadcaster.publishers):
+                writer.close()
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
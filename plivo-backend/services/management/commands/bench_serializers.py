@@ -0,0 +1,80 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from services.fast_serializers import incident_list, service_list
+from services.models import Service, Incident
+from services.serializers import ServiceListSerializer, IncidentListSerializer
+from users.models import Organization, User
+
+
+def make_rows(count):
+    """Unsaved services and incidents, and the .values() rows the database would return for them"""
+    now = timezone.now()
+    organization = Organization(id=1, name="Benchmark")
+    user = User(id=1, username="bench@example.com", full_name="Bench User")
+    services, service_rows, incidents, incident_rows = [], [], [], []
+    for i in range(count):
+        created_at = now - timedelta(minutes=i)
+        service = Service(
+            id=i + 1, organization=organization, name=f"Service {i}", description="A service",
+            current_status="operational", publicly_visible=True, created_at=created_at, updated_at=created_at
+        )
+        incident = Incident(
+            id=i + 1, service=service, title=f"Incident {i}", description="Something broke",
+            status="resolved", severity="high", created_by=user, resolved_at=created_at,
+            created_at=created_at, updated_at=created_at
+        )
+        services.append(service)
+        incidents.append(incident)
+        service_rows.append({
+            'id': service.id, 'organization_id': 1, 'name': service.name, 'description': service.description,
+            'current_status': service.current_status, 'publicly_visible': True,
+            'created_at': created_at, 'updated_at': created_at
+        })
+        incident_rows.append({
+            'id': incident.id, 'service_id': service.id, 'service__name': service.name, 'title': incident.title,
+            'description': incident.description, 'status': incident.status, 'severity': incident.severity,
+            'created_by__full_name': user.full_name, 'resolved_at': created_at,
+            'created_at': created_at, 'updated_at': created_at
+        })
+    return services, service_rows, incidents, incident_rows
+
+
+def rows_per_second(serialize, rows, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        serialize(rows)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(rows) / best
+
+
+class Command(BaseCommand):
+    help = "Compare rows per second of the DRF list serializers and their .values() fast paths"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=500, help='Rows serialized per run')
+        parser.add_argument('--repeat', type=int, default=20, help='Runs per serializer, the fastest is reported')
+        parser.add_argument('--render', action='store_true', help='Include rendering the rows to JSON')
+
+    def handle(self, *args, **options):
+        # Serialization only: the rows are built in memory, so no query time is included
+        services, service_rows, incidents, incident_rows = make_rows(options['rows'])
+        render = JSONRenderer().render if options['render'] else (lambda data: data)
+        cases = [
+            ("ServiceListSerializer", lambda rows: render(ServiceListSerializer(rows, many=True).data), services),
+            ("service_list (fast)", lambda rows: render(service_list.serialize(rows)), service_rows),
+            ("IncidentListSerializer", lambda rows: render(IncidentListSerializer(rows, many=True).data), incidents),
+            ("incident_list (fast)", lambda rows: render(incident_list.serialize(rows)), incident_rows),
+        ]
+        results = {}
+        for name, serialize, rows in cases:
+            results[name] = rows_per_second(serialize, rows, options['repeat'])
+            self.stdout.write(f"⏱️ {name:<24} {results[name]:>12,.0f} rows/s")
+        self.stdout.write(
+            f"🚀 services {results['service_list (fast)'] / results['ServiceListSerializer']:.1f}x, "
+            f"incidents {results['incident_list (fast)'] / results['IncidentListSerializer']:.1f}x faster"
+        )
@@ -0,0 +1,44 @@
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from services.outbox import relay_pending, purge_delivered
+from utils.utils import make_channel
+
+
+class Command(BaseCommand):
+    help = "Publish realtime events from the outbox table to the WebSocket server"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='Rows published per batch')
+        parser.add_argument('--interval', type=float, default=0.2, help='Seconds to sleep when the outbox is empty')
+        parser.add_argument('--once', action='store_true', help='Drain the outbox once and exit')
+        parser.add_argument('--retention-hours', type=int, default=24, help='Delete delivered rows older than this')
+
+    def handle(self, *args, **options):
+        channel = make_channel()
+        batch_size = options['batch_size']
+        retention = timedelta(hours=options['retention_hours'])
+        next_purge = 0.0
+        self.stdout.write("📬 Outbox relay started")
+
+        try:
+            while True:
+                delivered = relay_pending(channel, batch_size=batch_size)
+                if delivered:
+                    self.stdout.write(f"📤 Relayed {delivered} event(s)")
+
+                if time.monotonic() >= next_purge:
+                    purged = purge_delivered(timezone.now() - retention)
+                    if purged:
+                        self.stdout.write(f"🧹 Purged {purged} delivered event(s)")
+                    next_purge = time.monotonic() + 60
+
+                if delivered < batch_size:
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write("🛑 Outbox relay stopped")
+        finally:
+            channel.close()
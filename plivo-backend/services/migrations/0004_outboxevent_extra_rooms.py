@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0003_outboxevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outboxevent',
+            name='extra_rooms',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
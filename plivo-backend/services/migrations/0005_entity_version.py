@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 10:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0004_outboxevent_extra_rooms'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='incident',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('services', '0005_entity_version'),
+        ('users', '0007_user_has_access'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='incident',
+            index=models.Index(fields=['service', 'created_at', 'id'], name='incidents_service_cb934c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['organization', 'created_at', 'id'], name='services_organiz_b05ff1_idx'),
+        ),
+    ]
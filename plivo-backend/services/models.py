@@ -1,10 +1,81 @@
-from django.db import models
+from datetime import datetime
+from django.db import models, transaction
 import uuid
 from users.models import Organization
 
 # Create your models here.
 
-class Service(models.Model):
+def _api_value(value):
+    """Format a field value the way to_dict does"""
+    if isinstance(value, datetime):
+        return value.isoformat() + "Z"
+    return value
+
+
+class ChangeTrackingMixin:
+    """
+    Remembers field values as loaded or last saved, so a save can tell what changed.
+
+    Realtime events for updates only carry the changed fields (see to_patch),
+    together with `version`, which every save of an existing row increments.
+    """
+    # model field -> key in to_dict
+    PATCH_FIELDS = {}
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_values()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self._remember_values()
+
+    def _remember_values(self):
+        # __dict__ rather than getattr, so deferred fields are not loaded
+        self._saved_values = {
+            field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields
+            if field.attname in self.__dict__
+        }
+
+    def changed_fields(self):
+        """Fields that differ from the loaded row, None if the row was never loaded"""
+        saved = getattr(self, '_saved_values', None)
+        if saved is None:
+            return None
+        return [name for name, value in saved.items() if self.__dict__.get(name, value) != value]
+
+    def _save_tracked(self, *args, **kwargs):
+        # post_save writes the realtime outbox row, keep it in the same transaction
+        with transaction.atomic():
+            if not self._state.adding and self.pk is not None:
+                # Read under a row lock so concurrent saves never share a version
+                current = (
+                    type(self)._base_manager.select_for_update()
+                    .filter(pk=self.pk).values_list('version', flat=True).first()
+                )
+                if current is not None:
+                    self.version = current + 1
+                    if kwargs.get('update_fields') is not None:
+                        kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+            super().save(*args, **kwargs)
+        self._remember_values()
+
+    def to_patch(self, fields) -> dict:
+        """The given fields in to_dict format, with the entity's id and version"""
+        patch = self.patch_identity()
+        for name in fields:
+            key = self.PATCH_FIELDS.get(name)
+            if key is not None:
+                patch[key] = _api_value(getattr(self, name))
+        patch["version"] = self.version
+        patch["updatedAt"] = _api_value(self.updated_at)
+        return patch
+
+
+class Service(ChangeTrackingMixin, models.Model):
     STATUS_CHOICES = [
         ('operational', 'Operational'),
         ('degraded_performance', 'Degraded Performance'),
@@ -27,9 +98,17 @@ class Service(models.Model):
         default='operational'
     )
     publicly_visible = models.BooleanField(default=True)
+    version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    PATCH_FIELDS = {
+        'name': 'name',
+        'description': 'description',
+        'current_status': 'currentStatus',
+        'publicly_visible': 'publiclyVisible',
+    }
+
     class Meta:
         db_table = 'services'
         indexes = [
@@ -37,12 +116,26 @@ class Service(models.Model):
             models.Index(fields=['current_status']),
             models.Index(fields=['publicly_visible']),
             models.Index(fields=['created_at']),
+            # Keyset pagination of an organization's services (utils.pagination)
+            models.Index(fields=['organization', 'created_at', 'id']),
         ]
         ordering = ['-created_at']
 
     def __str__(self):
         return f"{self.name} ({self.organization.name})"
-    
+
+    def save(self, *args, **kwargs):
+        self._save_tracked(*args, **kwargs)
+
+    def patch_identity(self):
+        return {"id": self.id, "organizationId": self.organization_id}
+
+    def to_patch(self, fields) -> dict:
+        patch = super().to_patch(fields)
+        if "description" in patch:
+            patch["description"] = patch["description"] or ""
+        return patch
+
     def to_dict(self):
         """Convert model instance to dictionary format matching the API spec"""
         return {
@@ -52,12 +145,13 @@ class Service(models.Model):
             "description": self.description or "",
             "currentStatus": self.current_status,
             "publiclyVisible": self.publicly_visible,
+            "version": self.version,
             "createdAt": self.created_at.isoformat() + "Z",
             "updatedAt": self.updated_at.isoformat() + "Z"
         }
 
 
-class Incident(models.Model):
+class Incident(ChangeTrackingMixin, models.Model):
     STATUS_CHOICES = [
         ('investigating', 'Investigating'),
         ('identified', 'Identified'),
@@ -97,9 +191,18 @@ class Incident(models.Model):
         verbose_name='Created By'
     )
     resolved_at = models.DateTimeField(null=True, blank=True)
+    version = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    PATCH_FIELDS = {
+        'title': 'title',
+        'description': 'description',
+        'status': 'status',
+        'severity': 'severity',
+        'resolved_at': 'resolvedAt',
+    }
+
     class Meta:
         db_table = 'incidents'
         indexes = [
@@ -108,12 +211,26 @@ class Incident(models.Model):
             models.Index(fields=['severity']),
             models.Index(fields=['created_at']),
             models.Index(fields=['resolved_at']),
+            # Keyset pagination of a service's incidents (utils.pagination)
+            models.Index(fields=['service', 'created_at', 'id']),
         ]
         ordering = ['-created_at']
 
     def __str__(self):
         return f"{self.title} - {self.service.name}"
 
+    def save(self, *args, **kwargs):
+        self._save_tracked(*args, **kwargs)
+
+    def patch_identity(self):
+        return {"id": self.id, "serviceId": self.service_id}
+
+    def to_patch(self, fields) -> dict:
+        patch = super().to_patch(fields)
+        if "created_by_id" in fields:
+            patch["createdBy"] = self.created_by.full_name or self.created_by.username
+        return patch
+
     def to_dict(self):
         """Convert model instance to dictionary format matching the API spec"""
         return {
@@ -125,6 +242,39 @@ class Incident(models.Model):
             "severity": self.severity,
             "createdBy": self.created_by.full_name or self.created_by.username,
             "resolvedAt": self.resolved_at.isoformat() + "Z" if self.resolved_at else None,
+            "version": self.version,
             "createdAt": self.created_at.isoformat() + "Z",
             "updatedAt": self.updated_at.isoformat() + "Z"
         }
+
+
+class OutboxEvent(models.Model):
+    """
+    Realtime event waiting to be published to ws_server.
+
+    Rows are written by the Service/Incident signal handlers inside the
+    transaction of the change itself, so an event exists if and only if
+    the change was committed. The relay_outbox command publishes them in
+    order and stamps delivered_at. An event for several rooms is a single
+    row, published once to all of them.
+    """
+    room = models.CharField(max_length=200)
+    extra_rooms = models.JSONField(default=list, blank=True)
+    payload = models.JSONField()
+    attempts = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'realtime_outbox'
+        indexes = [
+            models.Index(fields=['delivered_at', 'id']),
+        ]
+        ordering = ['id']
+
+    @property
+    def rooms(self):
+        return [self.room, *self.extra_rooms]
+
+    def __str__(self):
+        return f"{self.payload.get('type')} -> {', '.join(self.rooms)}"
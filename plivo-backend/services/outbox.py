@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import OutboxEvent
+from utils.publisher import publish_event
+
+DELIVERY_OUTBOX = 'outbox'
+DELIVERY_DIRECT = 'direct'
+
+
+def enqueue_event(payload: dict, *rooms: str):
+    """
+    Record a realtime event for the given rooms.
+
+    The event is published once for all rooms, so a client subscribed to
+    more than one of them (e.g. through `org_42_*`) receives it once.
+    In outbox mode (the default) the event is written to the outbox table in
+    the caller's transaction and relay_outbox publishes it later. In direct
+    mode it is handed to the background publisher once the transaction commits,
+    so rolled back writes never produce an event.
+    """
+    if getattr(settings, 'REALTIME_DELIVERY', DELIVERY_OUTBOX) == DELIVERY_OUTBOX:
+        OutboxEvent.objects.create(room=rooms[0], extra_rooms=list(rooms[1:]), payload=payload)
+    else:
+        transaction.on_commit(lambda: publish_event(list(rooms), payload))
+
+
+def relay_pending(channel, batch_size=100) -> int:
+    """
+    Publish one batch of undelivered outbox rows and mark them delivered.
+
+    Delivery is at-least-once: a crash between publishing and marking the
+    rows delivered publishes them again on the next run.
+    Returns the number of rows delivered.
+    """
+    with transaction.atomic():
+        pending = OutboxEvent.objects.filter(delivered_at__isnull=True).order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            # Lets several relays share the table without publishing the same row twice
+            pending = pending.select_for_update(skip_locked=True)
+        events = list(pending[:batch_size])
+        if not events:
+            return 0
+
+        ids = [event.id for event in events]
+        if not channel.publish_many([(event.rooms, event.payload) for event in events]):
+            OutboxEvent.objects.filter(id__in=ids).update(attempts=F('attempts') + 1)
+            return 0
+        OutboxEvent.objects.filter(id__in=ids).update(delivered_at=timezone.now())
+        return len(events)
+
+
+def purge_delivered(older_than) -> int:
+    """Delete rows delivered before `older_than`, returns how many were removed"""
+    deleted, _ = OutboxEvent.objects.filter(delivered_at__lt=older_than).delete()
+    return deleted
@@ -133,7 +133,7 @@ class ServiceListSerializer(serializers.ModelSerializer):
     
     def get_organizationId(self, obj):
         """Return organization ID in the format xyz_corp"""
-        return f"{obj.organization.id}"
+        return f"{obj.organization_id}"
 
 
 class ServiceCreateSerializer(serializers.ModelSerializer):
@@ -4,84 +4,124 @@ from django.contrib.contenttypes.models import ContentType
 from .models import Service, Incident
 from users.models import Organization
 from timeline.models import Timeline
-from utils.utils import send_to_ws
+from .outbox import enqueue_event
+from utils.public_cache import RESOURCE_INCIDENTS, RESOURCE_SERVICES, invalidate
+from utils.versioning import bump_content_version
 import json
 
-# Global variable to store the latest event payload
-latest_event_payload = None
+def entity_payload(instance, created):
+    """
+    Full to_dict() for a new row, otherwise a patch of the fields this save changed.
 
-def get_latest_event_payload():
-    """Get the latest event payload"""
-    global latest_event_payload
-    return latest_event_payload
+    Returns (data, is_patch). A patch always carries the id, version and
+    updatedAt, plus what is needed to route it (organizationId / serviceId).
+    """
+    changed = None if created else instance.changed_fields()
+    if changed is None or reopens_incident(instance, changed):
+        return instance.to_dict(), False
+    return instance.to_patch(changed), True
+
+
+def reopens_incident(instance, changed) -> bool:
+    """
+    Whether a save moves an incident out of `resolved`.
+
+    Org snapshots drop resolved incidents, so a patch would have nothing to apply to.
+    """
+    return (
+        isinstance(instance, Incident) and 'status' in changed
+        and instance._saved_values.get('status') == 'resolved'
+    )
+
+
+def service_is_public(service) -> bool:
+    """
+    Whether events about a service may reach viewers outside its organization.
+
+    The save that hides a service still goes to them, so their view drops it.
+    """
+    return service.publicly_visible or 'publicly_visible' in (service.changed_fields() or ())
 
-def clear_latest_event_payload():
-    """Clear the latest event payload"""
-    global latest_event_payload
-    latest_event_payload = None
 
 @receiver(post_save, sender=Service)
 def service_saved(sender, instance, created, **kwargs):
     """Handle Service model save events"""
-    global latest_event_payload
-    latest_event_payload = {
+    # Public caches: the org's service list if public viewers see the change, incident lists carry the name
+    if service_is_public(instance):
+        invalidate(RESOURCE_SERVICES, instance.organization_id)
+    changed = instance.changed_fields()
+    if not created and (changed is None or 'name' in changed):
+        invalidate(RESOURCE_INCIDENTS, instance.id)
+    # ETags of the org's read endpoints change in the same transaction
+    bump_content_version(instance.organization_id)
+    data, is_patch = entity_payload(instance, created)
+    event = {
         "type": "service_updated" if not created else "service_created",
-        "data": instance.to_dict(),
+        "data": data,
         "organization_id": instance.organization_id,
-        "room": f"org_{instance.organization.id}_update"
+        "room": f"org_{instance.organization_id}_update",
+        "public": service_is_public(instance)
     }
-    print(f"📡 Service event prepared: {latest_event_payload['type']}")
+    if is_patch:
+        event["patch"] = True
+    print(f"📡 Service event prepared: {event['type']}")
     
-    # Send to WebSocket server
-    send_to_ws(latest_event_payload["room"], latest_event_payload)
-    send_to_ws(f"org_{instance.organization_id}_incident_{instance.id}_update", latest_event_payload)
+    # Written to the outbox in the same transaction as the change
+    enqueue_event(event, event["room"], f"org_{instance.organization_id}_incident_{instance.id}_update")
 
 
 @receiver(post_delete, sender=Service)
 def service_deleted(sender, instance, **kwargs):
     """Handle Service model delete events"""
-    global latest_event_payload
-    latest_event_payload = {
+    if instance.publicly_visible:
+        invalidate(RESOURCE_SERVICES, instance.organization_id)
+    invalidate(RESOURCE_INCIDENTS, instance.id)
+    bump_content_version(instance.organization_id)
+    event = {
         "type": "service_deleted",
         "data": {"id": instance.id, "organization_id": instance.organization_id},
         "organization_id": instance.organization_id,
-        "room": f"org_{instance.organization.id}_update"
+        "room": f"org_{instance.organization.id}_update",
+        "public": instance.publicly_visible
     }
-    print(f"📡 Service event prepared: {latest_event_payload['type']}")
+    print(f"📡 Service event prepared: {event['type']}")
     
-    # Send to WebSocket server
-    send_to_ws(latest_event_payload["room"], latest_event_payload)
-    send_to_ws(f"org_{instance.organization_id}_incident_{instance.id}_update", latest_event_payload)
+    # Written to the outbox in the same transaction as the change
+    enqueue_event(event, event["room"], f"org_{instance.organization_id}_incident_{instance.id}_update")
 
 @receiver(post_save, sender=Incident)
 def incident_saved(sender, instance, created, **kwargs):
     """Handle Incident model save events"""
-    global latest_event_payload
-    latest_event_payload = {
+    invalidate(RESOURCE_INCIDENTS, instance.service_id)
+    bump_content_version(instance.service.organization_id)
+    data, is_patch = entity_payload(instance, created)
+    event = {
         "type": "incident_updated" if not created else "incident_created",
-        "data": instance.to_dict(),
+        "data": data,
         "organization_id": instance.service.organization_id,
-        "room": f"org_{instance.service.organization_id}_incident_{instance.service.id}_update"
+        "room": f"org_{instance.service.organization_id}_incident_{instance.service.id}_update",
+        "public": instance.service.publicly_visible
     }
-    print(f"📡 Incident event prepared: {latest_event_payload['type']}")
+    if is_patch:
+        event["patch"] = True
+    print(f"📡 Incident event prepared: {event['type']}")
     
-    # Send to WebSocket server
-    send_to_ws(latest_event_payload["room"], latest_event_payload)
+    # Written to the outbox in the same transaction as the change
+    enqueue_event(event, event["room"])
 
 @receiver(post_delete, sender=Incident)
 def incident_deleted(sender, instance, **kwargs):
     """Handle Incident model delete events"""
-    global latest_event_payload
-    latest_event_payload = {
+    invalidate(RESOURCE_INCIDENTS, instance.service_id)
+    bump_content_version(instance.service.organization_id)
+    event = {
         "type": "incident_deleted",
         "data": {"id": instance.id, "service_id": instance.service_id},
         "organization_id": instance.service.organization_id,
-        "room": f"org_{instance.service.organization_id}_incident_{instance.service.id}_update"
+        "room": f"org_{instance.service.organization_id}_incident_{instance.service.id}_update",
+        "public": instance.service.publicly_visible
     }
-    print(f"📡 Incident event prepared: {latest_event_payload['type']}")
-    
-    # Send to WebSocket server
-    send_to_ws(latest_event_payload["room"], latest_event_payload)
-
-
+    print(f"📡 Incident event prepared: {event['type']}")
     
+    # Written to the outbox in the same transaction as the change
+    enqueue_event(event, event["room"])
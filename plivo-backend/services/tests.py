@@ -1,10 +1,23 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+import threading
+import time
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import Service
-from .serializers import ServiceSerializer, ServiceCreateSerializer, ServiceUpdateSerializer
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import Service, Incident, OutboxEvent
+from .outbox import relay_pending
+from .fast_serializers import incident_list, service_list
+from .serializers import (
+    ServiceSerializer, ServiceCreateSerializer, ServiceUpdateSerializer, ServiceListSerializer, IncidentListSerializer
+)
 from users.models import Organization
+from utils.query_budget import QueryBudgetTestMixin, count_queries
+from utils.public_cache import cached
 
 User = get_user_model()
 
@@ -260,3 +273,479 @@ class ServiceAPITest(APITestCase):
         
         # Verify the service is deleted
         self.assertFalse(Service.objects.filter(id=service.id).exists())
+
+
+class RecordingChannel:
+    """Stand-in for utils.utils.PublishChannel"""
+    def __init__(self, up=True):
+        self.up = up
+        self.published = []
+
+    def publish_many(self, messages):
+        if not self.up:
+            return False
+        self.published.extend(messages)
+        return True
+
+
+@override_settings(REALTIME_DELIVERY='outbox')
+class OutboxTest(TestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(
+            name="Test Organization",
+            domain="test.com"
+        )
+
+    def create_service(self):
+        return Service.objects.create(
+            organization=self.organization,
+            name="Test Service",
+            description="A test service"
+        )
+
+    def test_service_save_writes_one_outbox_row(self):
+        """A saved service produces a single outbox row for both of its rooms"""
+        service = self.create_service()
+
+        event = OutboxEvent.objects.get()
+        self.assertEqual(event.rooms, [
+            f"org_{self.organization.id}_update",
+            f"org_{self.organization.id}_incident_{service.id}_update",
+        ])
+        self.assertEqual(event.payload["type"], "service_created")
+
+    def test_rolled_back_save_writes_nothing(self):
+        """Events for a rolled back write never reach the outbox"""
+        try:
+            with transaction.atomic():
+                self.create_service()
+                raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_relay_publishes_in_order_and_marks_delivered(self):
+        services = [self.create_service() for _ in range(3)]
+        channel = RecordingChannel()
+
+        self.assertEqual(relay_pending(channel, batch_size=2), 2)
+        self.assertEqual(relay_pending(channel, batch_size=2), 1)
+        self.assertEqual(relay_pending(channel, batch_size=2), 0)
+
+        self.assertEqual(
+            [rooms[1] for rooms, payload in channel.published],
+            [f"org_{self.organization.id}_incident_{service.id}_update" for service in services]
+        )
+        self.assertFalse(OutboxEvent.objects.filter(delivered_at__isnull=True).exists())
+
+    def test_relay_keeps_rows_when_publish_fails(self):
+        self.create_service()
+
+        self.assertEqual(relay_pending(RecordingChannel(up=False)), 0)
+
+        self.assertEqual(OutboxEvent.objects.filter(delivered_at__isnull=True).count(), 1)
+        self.assertEqual(set(OutboxEvent.objects.values_list('attempts', flat=True)), {1})
+
+    def test_update_sends_patch_of_changed_fields(self):
+        service = self.create_service()
+        OutboxEvent.objects.all().delete()
+
+        service = Service.objects.get(id=service.id)
+        service.current_status = 'major_outage'
+        service.save()
+
+        event = OutboxEvent.objects.get().payload
+        self.assertTrue(event["patch"])
+        self.assertEqual(
+            set(event["data"]), {"id", "organizationId", "currentStatus", "version", "updatedAt"}
+        )
+        self.assertEqual(event["data"]["currentStatus"], 'major_outage')
+        self.assertEqual(event["data"]["version"], 2)
+
+    def test_incident_patch_skips_unchanged_fields(self):
+        service = self.create_service()
+        user = User.objects.create_user(
+            username="oncall@test.com", email="oncall@test.com", password="testpass123",
+            organization=self.organization
+        )
+        incident = Incident.objects.create(
+            service=service, title="Outage", description="A long description " * 50, created_by=user
+        )
+        created = OutboxEvent.objects.order_by('-id').first().payload
+        self.assertNotIn("patch", created)
+        self.assertEqual(created["data"]["version"], 1)
+        OutboxEvent.objects.all().delete()
+
+        incident = Incident.objects.get(id=incident.id)
+        incident.status = 'identified'
+        incident.save(update_fields=['status', 'updated_at'])
+
+        data = OutboxEvent.objects.get().payload["data"]
+        self.assertEqual(data["status"], 'identified')
+        self.assertEqual(data["serviceId"], service.id)
+        self.assertNotIn("description", data)
+        self.assertNotIn("createdBy", data)
+        incident.refresh_from_db()
+        self.assertEqual(incident.version, 2)
+
+    def test_reopened_incident_is_sent_in_full(self):
+        service = self.create_service()
+        user = User.objects.create_user(
+            username="oncall@test.com", email="oncall@test.com", password="testpass123",
+            organization=self.organization
+        )
+        incident = Incident.objects.create(service=service, title="Outage", description="Down", created_by=user)
+        incident.status = 'resolved'
+        incident.save()
+        self.assertTrue(OutboxEvent.objects.order_by('-id').first().payload["patch"])
+        OutboxEvent.objects.all().delete()
+
+        incident.status = 'investigating'
+        incident.save()
+
+        event = OutboxEvent.objects.get().payload
+        self.assertNotIn("patch", event)
+        self.assertEqual(event["data"], Incident.objects.get(id=incident.id).to_dict())
+
+    def test_private_service_events_are_marked(self):
+        service = self.create_service()
+        self.assertTrue(OutboxEvent.objects.get().payload["public"])
+        OutboxEvent.objects.all().delete()
+
+        service = Service.objects.get(id=service.id)
+        service.publicly_visible = False
+        service.save()
+        service = Service.objects.get(id=service.id)
+        service.current_status = 'major_outage'
+        service.save()
+
+        # The save that hides the service is still public, so public viewers drop it
+        self.assertEqual(
+            [event.payload["public"] for event in OutboxEvent.objects.order_by('id')], [True, False]
+        )
+
+
+class PaginationTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organization = Organization.objects.create(
+            name="Test Organization",
+            domain="test.com"
+        )
+        self.user = User.objects.create_user(
+            username="test@test.com",
+            email="test@test.com",
+            password="testpass123",
+            organization=self.organization,
+            role="admin"
+        )
+        self.services = [
+            Service.objects.create(organization=self.organization, name=f"Service {i}")
+            for i in range(5)
+        ]
+
+    def test_without_cursor_every_service_is_listed(self):
+        response = self.client.get(f'/api/services/{self.organization.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 5)
+
+    def test_pages_cover_every_row_once_despite_equal_timestamps(self):
+        # Rows created in the same instant are still ordered, by id
+        Service.objects.update(created_at=self.services[0].created_at)
+        url = f'/api/services/{self.organization.id}/'
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2, **({'cursor': cursor} if cursor else {})}
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen += [service['id'] for service in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(seen, [service.id for service in reversed(self.services)])
+
+    def test_incident_pages(self):
+        service = self.services[0]
+        incidents = [
+            Incident.objects.create(service=service, title=f"Incident {i}", description="", created_by=self.user)
+            for i in range(3)
+        ]
+        url = f'/api/services/{service.id}/incidents/'
+        first = self.client.get(url, {'limit': 2}).data
+        second = self.client.get(url, {'limit': 2, 'cursor': first['next_cursor']}).data
+        self.assertEqual(
+            [incident['id'] for incident in first['results'] + second['results']],
+            [incident.id for incident in reversed(incidents)]
+        )
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(len(self.client.get(url).data), 3)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f'/api/services/{self.organization.id}/', {'cursor': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class QueryBudgetTest(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(
+            name="Test Organization",
+            domain="test.com"
+        )
+        self.user = User.objects.create_user(
+            username="test@test.com",
+            email="test@test.com",
+            password="testpass123",
+            full_name="Test User",
+            organization=self.organization,
+            role="admin",
+            is_organization_admin=True
+        )
+        self.client.cookies['access_token'] = str(AccessToken.for_user(self.user))
+        self.service = Service.objects.create(organization=self.organization, name="Test Service")
+
+    def add_services(self, count):
+        for i in range(count):
+            Service.objects.create(organization=self.organization, name=f"Service {i}")
+
+    def add_incidents(self, count):
+        for i in range(count):
+            Incident.objects.create(service=self.service, title=f"Incident {i}", description="", created_by=self.user)
+
+    def test_lists(self):
+        self.assertConstantQueries(f'/api/services/{self.organization.id}/', self.add_services)
+        self.assertConstantQueries(f'/api/services/{self.organization.id}/?limit=5', self.add_services)
+        self.assertConstantQueries(f'/api/services/{self.service.id}/incidents/', self.add_incidents)
+        self.request_within_budget('get', f'/api/service/{self.service.id}/')
+
+    def test_writes(self):
+        service_data = {"name": "Other", "description": "", "currentStatus": "operational", "publiclyVisible": True}
+        response, _ = self.request_within_budget('post', '/api/services/create/', service_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        other = Service.objects.get(name="Other")
+        response, _ = self.request_within_budget(
+            'put', f'/api/services/{self.service.id}/update/', {**service_data, "currentStatus": "major_outage"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, _ = self.request_within_budget('delete', f'/api/services/{other.id}/delete/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        incident_data = {"title": "Outage", "description": "Down", "status": "investigating", "severity": "high"}
+        response, _ = self.request_within_budget('post', f'/api/services/{self.service.id}/incidents/create/', incident_data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        incident = Incident.objects.get()
+        response, _ = self.request_within_budget(
+            'put', f'/api/services/{self.service.id}/incidents/{incident.id}/update/', {**incident_data, "status": "resolved"}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, _ = self.request_within_budget('delete', f'/api/services/{self.service.id}/incidents/{incident.id}/delete/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class FastSerializerTest(TestCase):
+    """The .values() serializers must render exactly what the DRF list serializers do"""
+
+    def setUp(self):
+        self.organization = Organization.objects.create(
+            name="Test Organization",
+            domain="test.com"
+        )
+        named = User.objects.create_user(
+            username="named@test.com",
+            password="testpass123",
+            full_name="Named Ünicode",
+            organization=self.organization
+        )
+        unnamed = User.objects.create_user(
+            username="unnamed@test.com",
+            password="testpass123",
+            organization=self.organization
+        )
+        Service.objects.create(organization=self.organization, name="Private", publicly_visible=False)
+        service = Service.objects.create(
+            organization=self.organization,
+            name="API \"v2\" <edge>",
+            description="Line\nbreak",
+            current_status="partial_outage"
+        )
+        Incident.objects.create(service=service, title="Open", description="", created_by=unnamed)
+        Incident.objects.create(
+            service=service,
+            title="Resolved",
+            description="Fixed",
+            status="resolved",
+            severity="critical",
+            created_by=named,
+            resolved_at=timezone.now()
+        )
+
+    def assertSameJSON(self, drf_serializer, fast_serializer, queryset):
+        renderer = JSONRenderer()
+        expected = renderer.render(drf_serializer(queryset, many=True).data)
+        self.assertEqual(renderer.render(fast_serializer.serialize(fast_serializer.values(queryset))), expected)
+
+    def test_output_is_byte_identical(self):
+        for zone in ('UTC', 'Asia/Kolkata'):
+            with timezone.override(zone):
+                self.assertSameJSON(ServiceListSerializer, service_list, Service.objects.all())
+                self.assertSameJSON(IncidentListSerializer, incident_list, Incident.objects.all())
+
+
+class PublicCacheTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organization = Organization.objects.create(
+            name="Test Organization",
+            domain="test.com"
+        )
+        self.user = User.objects.create_user(
+            username="test@test.com",
+            password="testpass123",
+            full_name="Test User",
+            organization=self.organization,
+            role="admin"
+        )
+        self.service = Service.objects.create(organization=self.organization, name="API")
+        self.private = Service.objects.create(organization=self.organization, name="Internal", publicly_visible=False)
+
+    def get(self, url):
+        with count_queries() as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, queries.count
+
+    def test_services_are_cached_until_a_public_change(self):
+        url = f'/api/services/{self.organization.id}/'
+        self.get(url)
+        data, queries = self.get(url)
+        # A hit only reads the organization's content version, for the ETag
+        self.assertEqual(queries, 1)
+        self.assertEqual([service['name'] for service in data], ["API"])
+
+        # Public viewers don't see this one, their entry stays
+        with self.captureOnCommitCallbacks(execute=True):
+            self.private.current_status = 'major_outage'
+            self.private.save()
+        self.assertEqual(self.get(url)[1], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.current_status = 'major_outage'
+            self.service.save()
+        data, queries = self.get(url)
+        self.assertGreater(queries, 1)
+        self.assertEqual(data[0]['currentStatus'], 'major_outage')
+
+        # Pages are cached apart from the full list
+        self.assertIn('next_cursor', self.get(url + '?limit=1')[0])
+        self.assertEqual(self.get(url)[1], 1)
+
+    def test_incidents_are_invalidated_by_incident_and_service_changes(self):
+        url = f'/api/services/{self.service.id}/incidents/'
+        self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Incident.objects.create(service=self.service, title="Outage", description="", created_by=self.user)
+        data, _ = self.get(url)
+        self.assertEqual([incident['title'] for incident in data], ["Outage"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.name = "Public API"
+            self.service.save()
+        self.assertEqual(self.get(url)[0][0]['serviceName'], "Public API")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.delete()
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_authenticated_requests_bypass_the_cache(self):
+        url = f'/api/services/{self.organization.id}/'
+        self.get(url)
+        self.client.force_authenticate(user=self.user)
+        data, queries = self.get(url)
+        self.assertGreater(queries, 0)
+        self.assertEqual(len(data), 2)
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return ["result"]
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cached('services', 999, {}, compute)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [["result"]] * 5)
+
+
+class ContentVersionTest(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organization = Organization.objects.create(
+            name="Test Organization",
+            domain="test.com"
+        )
+        self.user = User.objects.create_user(
+            username="test@test.com",
+            password="testpass123",
+            full_name="Test User",
+            organization=self.organization,
+            role="admin"
+        )
+        self.service = Service.objects.create(organization=self.organization, name="API")
+        self.url = f'/api/services/{self.organization.id}/'
+
+    def revalidate(self, etag):
+        with count_queries() as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        return response, queries.count
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.client.get(self.url)['ETag']
+        response, queries = self.revalidate(etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+        self.assertEqual(queries, 1)
+        self.assertEqual(self.revalidate(f'W/{etag}')[0].status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_changes_move_the_version_on(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.service.current_status = 'major_outage'
+            self.service.save()
+        response, _ = self.revalidate(etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.revalidate(response['ETag'])[0].status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_cached_entry_keeps_its_version(self):
+        etag = self.client.get(self.url)['ETag']
+        # Moves the version on, but the public service list is unchanged
+        with self.captureOnCommitCallbacks(execute=True):
+            Incident.objects.create(service=self.service, title="Outage", description="", created_by=self.user)
+        response, queries = self.revalidate(etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(queries, 1)
+
+    def test_members_and_public_are_tagged_apart(self):
+        public = self.client.get(self.url)['ETag']
+        self.client.force_authenticate(user=self.user)
+        response, _ = self.revalidate(public)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], public)
+        self.assertIn('Cookie', response['Vary'])
+        response, queries = self.revalidate(response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(queries, 1)
+
+    def test_unknown_organization(self):
+        self.assertEqual(self.client.get('/api/services/999/').status_code, status.HTTP_404_NOT_FOUND)
@@ -3,11 +3,10 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
-from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.core.exceptions import ValidationError
 from django.db import transaction
 import json
 from .models import Service, Incident
-from users.models import Organization
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from users.permissions import IsOrganizationAdmin, IsOrganizationAdminOrTeamWithAccess
@@ -15,19 +14,47 @@ from rest_framework.response import Response
 from rest_framework import status
 from .serializers import (
     ServiceSerializer, 
-    ServiceListSerializer, 
     ServiceCreateSerializer, 
     ServiceUpdateSerializer,
     IncidentSerializer,
-    IncidentListSerializer,
     IncidentCreateSerializer,
     IncidentUpdateSerializer
 )
+from .fast_serializers import incident_list, service_list
 from timeline.views import log_timeline_event
 from users.views import public_endpoint
+from utils.pagination import InvalidCursor, page_size, paginate
+from utils.query_budget import query_budget
+from utils.public_cache import RESOURCE_INCIDENTS, RESOURCE_SERVICES, cached
+from utils.versioning import content_etag, content_version, not_modified, tagged
 
 # Create your views here.
 
+def list_data(params, queryset, serializer):
+    """
+    Every row as a list, as before, unless the client asks for pages.
+
+    With ?cursor= or ?limit= the response is one page, newest first:
+    {"results": [...], "next_cursor": "..."}, next_cursor being null on the last page.
+    `serializer` is one of the fast_serializers, rows are read with .values().
+    Raises InvalidCursor.
+    """
+    rows = serializer.values(queryset)
+    if 'cursor' not in params and 'limit' not in params:
+        return serializer.serialize(rows)
+    rows, next_cursor = paginate(rows, params.get('cursor'), page_size(params.get('limit')))
+    return {
+        'results': serializer.serialize(rows),
+        'next_cursor': next_cursor
+    }
+
+
+def page_params(request):
+    """Query parameters a cached list response depends on"""
+    return {name: request.query_params.get(name) for name in ('cursor', 'limit')}
+
+
+@query_budget(8)
 @api_view(['POST'])
 @permission_classes([IsOrganizationAdminOrTeamWithAccess])
 def create_service(request):
@@ -55,6 +82,7 @@ def create_service(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -78,6 +106,7 @@ def get_service(request, service_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -91,26 +120,42 @@ def list_services(request, org_id):
             return Response({
                 'error': 'Organization ID is required'
             }, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            try:
-                organization = Organization.objects.get(id=org_id_str)
-            except (ValueError, ObjectDoesNotExist):
-                return Response({
-                    'error': 'Organization not found'
-                }, status=status.HTTP_404_NOT_FOUND)    
-        
-        # Check if user is authenticated
-        if request.user.is_authenticated:
+        
+        # The organization's content version doubles as the check that it exists
+        try:
+            version = content_version(org_id_str)
+        except ValueError:
+            version = None
+        if version is None:
+            return Response({
+                'error': 'Organization not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        # Polls that already have this version get a 304, without reading any service
+        etag = content_etag(request, org_id_str, version)
+        unchanged = not_modified(request, etag)
+        if unchanged is not None:
+            return unchanged
+        
+        try:
+            # Check if user is authenticated
+            if not request.user.is_authenticated:
+                # Unauthenticated users can only see publicly visible services, served from the public cache
+                def public_services():
+                    services = Service.objects.filter(organization_id=org_id_str, publicly_visible=True)
+                    return version, list_data(request.query_params, services, service_list)
+                # Tagged with the version the entry was computed at, which changes that
+                # don't reach public viewers leave behind
+                data_version, data = cached(RESOURCE_SERVICES, int(org_id_str), page_params(request), public_services)
+                etag = content_etag(request, org_id_str, data_version)
+                return not_modified(request, etag) or tagged(Response(data), etag)
+            
             # Authenticated users can see all services for their organization
-            if (request.user.role == 'admin' or (request.user.role == 'team' and organization.id)):
-                services = Service.objects.filter(organization=organization)
-                serializer = ServiceListSerializer(services, many=True)
-                return Response(serializer.data)
-        else:
-            # Unauthenticated users can only see publicly visible services
-            services = Service.objects.filter(organization=organization, publicly_visible=True)
-            serializer = ServiceListSerializer(services, many=True)
-            return Response(serializer.data)
+            if request.user.role in ('admin', 'team'):
+                services = Service.objects.filter(organization_id=org_id_str)
+                return tagged(Response(list_data(request.query_params, services, service_list)), etag)
+        except InvalidCursor as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
     except Exception as e:
         return Response({
@@ -118,13 +163,14 @@ def list_services(request, org_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@query_budget(12)
 @api_view(['PUT'])
 @permission_classes([IsOrganizationAdminOrTeamWithAccess])
 def update_service(request, service_id):
     """Update a service"""
     try:
         service = Service.objects.get(id=service_id)
-        if (service.organization.id != request.user.organization.id):
+        if service.organization_id != request.user.organization_id:
             return Response({
                 'error': 'Access denied. You can only update services from your organization.'
             }, status=status.HTTP_403_FORBIDDEN)
@@ -163,13 +209,14 @@ def update_service(request, service_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@query_budget(7)
 @api_view(['DELETE'])
 @permission_classes([IsOrganizationAdminOrTeamWithAccess])
 def delete_service(request, service_id):
     """Delete a service"""
     try:
         service = Service.objects.get(id=service_id)
-        if (service.organization.id != request.user.organization.id):
+        if service.organization_id != request.user.organization_id:
             return Response({
                 'error': 'Access denied. You can only delete services from your organization.'
             }, status=status.HTTP_403_FORBIDDEN)
@@ -191,17 +238,27 @@ def delete_service(request, service_id):
 
 
 # Incident Views
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @public_endpoint
 def list_incidents(request, service_id):
     """List all incidents for a specific service"""
     try:
-        # Verify service exists and user has access
-        service = Service.objects.get(id=service_id)
-        incidents = Incident.objects.filter(service=service)
-        serializer = IncidentListSerializer(incidents, many=True)
-        return Response(serializer.data)
+        def incidents_data():
+            # Verify service exists and user has access
+            service = Service.objects.get(id=service_id)
+            # serviceName and createdBy are joined columns of the .values() rows, not a query per incident
+            incidents = Incident.objects.filter(service=service)
+            return list_data(request.query_params, incidents, incident_list)
+        
+        if request.user.is_authenticated:
+            return Response(incidents_data())
+        # Status page visitors are served from the public cache
+        return Response(cached(RESOURCE_INCIDENTS, int(service_id), page_params(request), incidents_data))
+        
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
     except Service.DoesNotExist:
         return Response({
@@ -214,6 +271,7 @@ def list_incidents(request, service_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@query_budget(13)
 @api_view(['POST'])
 @permission_classes([IsOrganizationAdminOrTeamWithAccess])
 def create_incident(request, service_id):
@@ -221,7 +279,7 @@ def create_incident(request, service_id):
     try:
         # Verify service exists and user has access
         service = Service.objects.get(id=service_id)
-        if service.organization != request.user.organization:
+        if service.organization_id != request.user.organization_id:
             return Response({
                 'error': 'Access denied. You can only create incidents for services in your organization.'
             }, status=status.HTTP_403_FORBIDDEN)
@@ -261,6 +319,7 @@ def create_incident(request, service_id):
             'error': f'Internal server error: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(14)
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_incident(request, service_id, incident_id):
@@ -268,7 +327,7 @@ def update_incident(request, service_id, incident_id):
     try:
         # Verify service exists and user has access
         service = Service.objects.get(id=service_id)
-        if service.organization != request.user.organization:
+        if service.organization_id != request.user.organization_id:
             return Response({
                 'error': 'Access denied. You can only update incidents for services in your organization.'
             }, status=status.HTTP_403_FORBIDDEN)
@@ -318,6 +377,7 @@ def update_incident(request, service_id, incident_id):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@query_budget(10)
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def delete_incident(request, service_id, incident_id):
@@ -325,7 +385,7 @@ def delete_incident(request, service_id, incident_id):
     try:
         # Verify service exists and user has access
         service = Service.objects.get(id=service_id)
-        if service.organization != request.user.organization:
+        if service.organization_id != request.user.organization_id:
             return Response({
                 'error': 'Access denied. You can only delete incidents for services in your organization.'
             }, status=status.HTTP_403_FORBIDDEN)
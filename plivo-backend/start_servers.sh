@@ -5,18 +5,34 @@ echo "🚀 Starting Plivo Backend Services..."
 # Trap signals to shut down gracefully
 cleanup() {
     echo "🛑 Shutting down servers..."
-    kill $DJANGO_PID $WS_PID 2>/dev/null
+    kill $DJANGO_PID $WS_PID $RELAY_PID 2>/dev/null
     exit 0
 }
 trap cleanup SIGINT SIGTERM
 
-# Start WebSocket server in background
-echo "📡 Starting WebSocket server..."
-python3 ws_server.py &
-WS_PID=$!
+if [ "$REALTIME_TRANSPORT" = "channels" ]; then
+    # WebSockets are served by the Django ASGI app (runserver runs daphne)
+    echo "📡 WebSockets served by Django Channels"
+    if [ -z "$CHANNEL_LAYER_URL" ]; then
+        # The in-memory channel layer only reaches this process, events can't go through the relay
+        export REALTIME_DELIVERY=direct
+    fi
+else
+    # Start WebSocket server in background
+    echo "📡 Starting WebSocket server..."
+    python3 ws_server.py &
+    WS_PID=$!
 
-# Wait a bit to avoid race conditions
-sleep 2
+    # Wait a bit to avoid race conditions
+    sleep 2
+fi
+
+if [ "$REALTIME_DELIVERY" != "direct" ]; then
+    # Start the outbox relay that publishes realtime events to the WebSocket server
+    echo "📬 Starting outbox relay..."
+    python3 manage.py relay_outbox &
+    RELAY_PID=$!
+fi
 
 # Start Django server using Render's assigned port
 echo "🌐 Starting Django server..."
@@ -24,12 +40,12 @@ PORT=${PORT:-8000}
 python3 manage.py runserver 0.0.0.0:$PORT &
 DJANGO_PID=$!
 
-echo "✅ Both servers started!"
+echo "✅ All servers started!"
 echo "   - Django: http://0.0.0.0:$PORT"
 echo "   - WebSocket: ws://localhost:8765"
 echo "   - Internal: localhost:9000"
 echo ""
-echo "Press Ctrl+C to stop both servers"
+echo "Press Ctrl+C to stop all servers"
 
-# Wait for both processes to finish
-wait $DJANGO_PID $WS_PID
+# Wait for all processes to finish
+wait $DJANGO_PID $WS_PID $RELAY_PID
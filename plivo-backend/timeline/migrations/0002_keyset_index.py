@@ -0,0 +1,21 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('timeline', '0001_initial'),
+        ('users', '0007_user_has_access'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='timeline',
+            index=models.Index(fields=['organization', 'created_at', 'id'], name='timeline_organiz_a81abf_idx'),
+        ),
+    ]
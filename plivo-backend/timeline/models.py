@@ -58,6 +58,8 @@ class Timeline(models.Model):
             models.Index(fields=['content_type', 'object_id']),
             models.Index(fields=['user']),
             models.Index(fields=['created_at']),
+            # Keyset pagination of an organization's timeline (utils.pagination)
+            models.Index(fields=['organization', 'created_at', 'id']),
         ]
         ordering = ['-created_at']
     
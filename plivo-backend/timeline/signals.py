@@ -0,0 +1,13 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Timeline
+from utils.public_cache import RESOURCE_TIMELINE, invalidate
+from utils.versioning import bump_content_version
+
+
+@receiver(post_save, sender=Timeline)
+@receiver(post_delete, sender=Timeline)
+def timeline_changed(sender, instance, **kwargs):
+    """Public timeline responses of the organization are out of date once the change commits"""
+    invalidate(RESOURCE_TIMELINE, instance.organization_id)
+    bump_content_version(instance.organization_id)
@@ -1,3 +1,86 @@
-from django.test import TestCase
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+from rest_framework.test import APITestCase
+from rest_framework import status
+from .models import Timeline
+from services.models import Service
+from users.models import Organization
+from utils.query_budget import QueryBudgetTestMixin
 
-# Create your tests here.
+User = get_user_model()
+
+
+class TimelineTest(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.organization = Organization.objects.create(
+            name="Test Organization",
+            domain="test.com"
+        )
+        self.user = User.objects.create_user(
+            username="test@test.com",
+            email="test@test.com",
+            password="testpass123",
+            organization=self.organization,
+            role="admin"
+        )
+        self.service = Service.objects.create(organization=self.organization, name="Test Service")
+        self.events = self.add_events(5)
+
+    def add_events(self, count):
+        return [
+            Timeline.objects.create(
+                organization=self.organization,
+                event_type='service_status_changed',
+                content_type=ContentType.objects.get_for_model(Service),
+                object_id=self.service.id,
+                user=self.user,
+                title=f"Event {i}"
+            )
+            for i in range(count)
+        ]
+
+    def test_cursor_continues_after_limit(self):
+        url = f'/api/timeline/{self.organization.id}/'
+        first = self.client.get(url, {'limit': 3}).data
+        self.assertEqual(first['count'], 3)
+        second = self.client.get(url, {'limit': 3, 'cursor': first['next_cursor']}).data
+        self.assertEqual(
+            [event['id'] for event in first['timeline'] + second['timeline']],
+            [event.id for event in reversed(self.events)]
+        )
+        self.assertIsNone(second['next_cursor'])
+
+    def test_default_limit(self):
+        response = self.client.get(f'/api/timeline/{self.organization.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 5)
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_query_count_does_not_grow_with_events(self):
+        # Signed in, so the queries run rather than the public cache answering
+        self.client.force_authenticate(user=self.user)
+        self.assertConstantQueries(f'/api/timeline/{self.organization.id}/', self.add_events)
+        self.assertConstantQueries(f'/api/timeline/service/{self.service.id}/', self.add_events)
+
+    def test_public_timeline_is_cached_until_an_event_is_logged(self):
+        url = f'/api/timeline/{self.organization.id}/'
+        self.assertEqual(self.client.get(url).data['count'], 5)
+        self.add_events(1)
+        # Not committed as far as the cache is concerned
+        self.assertEqual(self.client.get(url).data['count'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_events(1)
+        self.assertEqual(self.client.get(url).data['count'], 7)
+
+    def test_unchanged_timeline_is_not_modified(self):
+        url = f'/api/timeline/{self.organization.id}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_events(1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
@@ -8,6 +8,10 @@ from .models import Timeline
 from services.models import Service, Incident
 from users.permissions import IsOrganizationAdmin
 from users.views import public_endpoint
+from utils.pagination import InvalidCursor, page_size, paginate
+from utils.query_budget import query_budget
+from utils.public_cache import RESOURCE_TIMELINE, cached
+from utils.versioning import content_etag, content_version, not_modified, tagged
 from django.db import models
 
 def log_timeline_event(event_type, user, content_object, title, description="", old_value=None, new_value=None):
@@ -47,43 +51,79 @@ def log_timeline_event(event_type, user, content_object, title, description="",
         # Log error but don't fail the main operation
         print(f"Error logging timeline event: {str(e)}")
 
+def timeline_data(params, timeline_events):
+    """
+    Up to ?limit= events (default 50), newest first.
+
+    `next_cursor` continues after the last of them when passed back as
+    ?cursor=, and is null once there are no older events. Raises InvalidCursor.
+    """
+    events, next_cursor = paginate(timeline_events, params.get('cursor'), page_size(params.get('limit')))
+
+    # Convert to dictionary format
+    events_data = [event.to_dict() for event in events]
+
+    return {
+        'timeline': events_data,
+        'count': len(events_data),
+        'next_cursor': next_cursor
+    }
+
+
+def timeline_page(request, timeline_events):
+    try:
+        return Response(timeline_data(request.query_params, timeline_events))
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @public_endpoint
 def get_timeline(request, org_id):
     """Get timeline events for the user's organization"""
     try:
+        # Polls that already have the organization's content version get a 304
+        version = content_version(org_id)
+        if version is not None:
+            etag = content_etag(request, org_id, version)
+            unchanged = not_modified(request, etag)
+            if unchanged is not None:
+                return unchanged
+        
         # Get timeline events for the user's organization
         timeline_events = Timeline.objects.filter(
             organization=org_id
-        ).select_related('user', 'organization')
+        ).select_related('user', 'organization', 'content_type')
         
         # Apply filters if provided
         event_type = request.query_params.get('event_type')
         if event_type:
             timeline_events = timeline_events.filter(event_type=event_type)
         
-        # Limit results (optional)
-        limit = request.query_params.get('limit', 50)
-        try:
-            limit = int(limit)
-            timeline_events = timeline_events[:limit]
-        except ValueError:
-            timeline_events = timeline_events[:50]
-        
-        # Convert to dictionary format
-        timeline_data = [event.to_dict() for event in timeline_events]
+        if request.user.is_authenticated:
+            response = Response(timeline_data(request.query_params, timeline_events))
+            return tagged(response, etag) if version is not None else response
+        # Status page visitors are served from the public cache
+        params = {name: request.query_params.get(name) for name in ('event_type', 'cursor', 'limit')}
+        data_version, data = cached(
+            RESOURCE_TIMELINE, int(org_id), params, lambda: (version, timeline_data(request.query_params, timeline_events))
+        )
+        if data_version is None:
+            return Response(data)
+        # Tagged with the version the entry was computed at, which may be older
+        etag = content_etag(request, org_id, data_version)
+        return not_modified(request, etag) or tagged(Response(data), etag)
         
-        return Response({
-            'timeline': timeline_data,
-            'count': len(timeline_data)
-        })
+    except InvalidCursor as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
     except Exception as e:
         return Response({
             'error': f'Internal server error: {str(e)}'
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(5)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -94,31 +134,17 @@ def get_service_timeline(request, service_id):
         service = Service.objects.get(id=service_id)
         
         # Get timeline events for this service
-        service_content_type = ContentType.objects.get_for_model(Service)
-        incident_content_type = ContentType.objects.get_for_model(Incident)
+        content_types = ContentType.objects.get_for_models(Service, Incident)
+        service_content_type = content_types[Service]
+        incident_content_type = content_types[Incident]
         timeline_events = Timeline.objects.filter(
             organization=service.organization
         ).filter(
             models.Q(content_type=service_content_type, object_id=service_id) |
             models.Q(content_type=incident_content_type, object_id__in=service.incidents.values_list('id', flat=True))
-        ).select_related('user', 'organization')
+        ).select_related('user', 'organization', 'content_type')
         
-        
-        # Limit results (optional)
-        limit = request.query_params.get('limit', 50)
-        try:
-            limit = int(limit)
-            timeline_events = timeline_events[:limit]
-        except ValueError:
-            timeline_events = timeline_events[:50]
-        
-        # Convert to dictionary format
-        timeline_data = [event.to_dict() for event in timeline_events]
-        
-        return Response({
-            'timeline': timeline_data,
-            'count': len(timeline_data)
-        })
+        return timeline_page(request, timeline_events)
         
     except Service.DoesNotExist:
         return Response({
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_user_has_access'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='content_version',
+            field=models.PositiveBigIntegerField(default=1),
+        ),
+    ]
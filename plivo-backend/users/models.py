@@ -6,12 +6,26 @@ from datetime import timedelta
 from django.utils import timezone
 
 
+class OrganizationQuerySet(models.QuerySet):
+    def with_user_counts(self):
+        """Annotate user_count and active_user_count, counted in the same query"""
+        return self.annotate(
+            user_count=models.Count('users'),
+            active_user_count=models.Count('users', filter=models.Q(users__is_active=True))
+        )
+
+
 class Organization(models.Model):
     name = models.CharField(max_length=200)
     domain = models.CharField(max_length=200, unique=True, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Bumped in the same transaction as every change to the organization's services,
+    # incidents or timeline, so read endpoints can answer polls with 304 (see utils/versioning.py)
+    content_version = models.PositiveBigIntegerField(default=1)
+
+    objects = OrganizationQuerySet.as_manager()
 
     def __str__(self):
         return self.name
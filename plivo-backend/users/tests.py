@@ -1,3 +1,123 @@
-from django.test import TestCase
+from django.conf import settings
+from django.test import override_settings
+from django.urls import URLResolver, get_resolver, resolve
+from rest_framework.test import APITestCase
+from rest_framework import status
+from rest_framework_simplejwt.tokens import AccessToken
+from .models import User, Organization, InviteLink
+from utils.query_budget import QueryBudgetTestMixin, view_budget
 
-# Create your tests here.
+
+def api_views(patterns, prefix=""):
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from api_views(pattern.url_patterns, route)
+        elif route.startswith("api/"):
+            yield route, pattern.callback
+
+
+class QueryBudgetTest(QueryBudgetTestMixin, APITestCase):
+    def setUp(self):
+        self.organization = Organization.objects.create(
+            name="Test Organization",
+            domain="test.com"
+        )
+        self.admin = User.objects.create_user(
+            username="admin@test.com",
+            email="admin@test.com",
+            password="testpass123",
+            full_name="Admin",
+            organization=self.organization,
+            role="admin",
+            is_organization_admin=True
+        )
+        self.client.cookies['access_token'] = str(AccessToken.for_user(self.admin))
+        self.members = 0
+
+    def add_members(self, count):
+        for _ in range(count):
+            self.members += 1
+            member = User.objects.create_user(
+                username=f"member{self.members}@test.com",
+                password="testpass123",
+                organization=self.organization,
+                role="team"
+            )
+            InviteLink.objects.create(
+                organization=self.organization,
+                created_by=self.admin,
+                used_by=member,
+                username=member.username,
+                role="team",
+                expires_at="2099-01-01T00:00:00Z"
+            )
+            Organization.objects.create(name=f"Organization {self.members}")
+
+    def test_every_endpoint_declares_a_budget(self):
+        views = list(api_views(get_resolver().url_patterns))
+        self.assertTrue(views)
+        for route, view in views:
+            self.assertIsNotNone(view_budget(view), f"{route} declares no query budget")
+
+    def test_organizations(self):
+        self.assertConstantQueries('/api/organizations/', self.add_members)
+        self.assertConstantQueries(f'/api/organizations/{self.organization.id}/', self.add_members)
+
+    def test_team_members(self):
+        self.assertConstantQueries('/api/invite/list/', self.add_members)
+
+    def test_profile_and_invites(self):
+        self.add_members(1)
+        member = User.objects.get(username="member1@test.com")
+        self.request_within_budget('get', '/api/auth/profile/')
+        response, _ = self.request_within_budget('put', '/api/auth/profile/update/', {"full_name": "New Name"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, _ = self.request_within_budget('post', '/api/invite/create/', {"username": "new@test.com", "role": "team"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        invite = InviteLink.objects.get(username="new@test.com")
+        response, _ = self.request_within_budget('get', f'/api/invite/verify/{invite.token}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, _ = self.request_within_budget('post', '/api/invite/update-access/', {"user_id": member.id, "has_access": True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # An invited team member signs up, logs in and out
+        self.client.cookies.clear()
+        response, _ = self.request_within_budget('post', '/api/auth/signup/', {
+            "username": "new@test.com",
+            "password": "Passw0rd!23",
+            "confirm_password": "Passw0rd!23",
+            "full_name": "New Member",
+            "role": "team",
+            "token": str(invite.token)
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response, _ = self.request_within_budget('post', '/api/auth/login/', {"username": "new@test.com", "password": "Passw0rd!23"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.request_within_budget('post', '/api/auth/logout/')
+
+    def test_admin_signup(self):
+        self.client.cookies.clear()
+        response, _ = self.request_within_budget('post', '/api/auth/signup/', {
+            "username": "founder@new.com",
+            "password": "Passw0rd!23",
+            "confirm_password": "Passw0rd!23",
+            "full_name": "Founder",
+            "role": "admin",
+            "organization_name": "New Organization"
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    @override_settings(MIDDLEWARE=['utils.query_budget.QueryBudgetMiddleware', *settings.MIDDLEWARE])
+    def test_middleware_flags_requests_over_budget(self):
+        response = self.client.get('/api/organizations/')
+        self.assertEqual(response['X-Query-Count'], '2')
+        self.assertNotIn('X-Query-Budget-Exceeded', response)
+
+        view = resolve('/api/organizations/').func
+        budget, view.query_budget = view.query_budget, 1
+        try:
+            response = self.client.get('/api/organizations/')
+        finally:
+            view.query_budget = budget
+        self.assertEqual(response['X-Query-Budget-Exceeded'], '2/1')
@@ -14,6 +14,7 @@ from .validators import (
 )
 from .permissions import IsOrganizationAdmin, IsAdmin, IsTeamMember, IsTeamMemberWithAccess, IsAdminOrAuthenticated
 from .authentication import CookieJWTAuthentication
+from utils.query_budget import query_budget
 
 
 def public_endpoint(view_func):
@@ -45,6 +46,7 @@ def get_user_data(user):
     }
 
 
+@query_budget(6)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -134,6 +136,7 @@ def signup_view(request):
         )
 
 
+@query_budget(3)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -188,6 +191,7 @@ def login_view(request):
         )
 
 
+@query_budget(1)
 @api_view(['POST'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -212,6 +216,7 @@ def logout_view(request):
     return response
 
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_profile_view(request):
@@ -224,6 +229,7 @@ def user_profile_view(request):
     }, status=status.HTTP_200_OK)
 
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -232,7 +238,7 @@ def get_organizations_view(request):
     Get all organizations (for admin users) or user's organization
     """
     try:
-        organizations = Organization.objects.all()
+        organizations = Organization.objects.with_user_counts()
         organizations_data = [{
             'id': str(organization.id),
             'name': organization.name,
@@ -240,8 +246,8 @@ def get_organizations_view(request):
             'created_at': organization.created_at.isoformat(),
             'updated_at': organization.updated_at.isoformat(),
             'is_active': organization.is_active,
-            'user_count': organization.users.count(),
-            'active_user_count': organization.users.filter(is_active=True).count()
+            'user_count': organization.user_count,
+            'active_user_count': organization.active_user_count
         } for organization in organizations]
         return Response({
             'organizations': organizations_data,
@@ -255,6 +261,7 @@ def get_organizations_view(request):
         )
 
 
+@query_budget(3)
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_profile_view(request):
@@ -293,6 +300,7 @@ def update_profile_view(request):
     
 
 
+@query_budget(4)
 @api_view(['POST'])
 @permission_classes([IsOrganizationAdmin])
 def invite_url_team_member_view(request):
@@ -339,6 +347,7 @@ def invite_url_team_member_view(request):
         )
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -390,6 +399,7 @@ def verify_invite_token_view(request, token):
 
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsOrganizationAdmin])
 def get_team_members_view(request):
@@ -399,7 +409,7 @@ def get_team_members_view(request):
             created_by=request.user,
             organization=request.user.organization,
             used_by__isnull=False
-        ).order_by('-created_at')
+        ).select_related('used_by').order_by('-created_at')
         
         invite_links_data = [{
             'id': str(invite.token),
@@ -430,6 +440,7 @@ def get_team_members_view(request):
         )
 
 
+@query_budget(4)
 @api_view(['POST'])
 @permission_classes([IsOrganizationAdmin])
 def update_user_access_view(request):
@@ -466,6 +477,7 @@ def update_user_access_view(request):
         )
 
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 @public_endpoint
@@ -476,7 +488,7 @@ def get_organization_details_view(request, organization_id):
     try:
         # Check if organization exists
         try:
-            organization = Organization.objects.get(id=organization_id, is_active=True)
+            organization = Organization.objects.with_user_counts().get(id=organization_id, is_active=True)
         except Organization.DoesNotExist:
             return Response(
                 {'error': 'Organization not found'}, 
@@ -491,8 +503,8 @@ def get_organization_details_view(request, organization_id):
             'created_at': organization.created_at.isoformat(),
             'updated_at': organization.updated_at.isoformat(),
             'is_active': organization.is_active,
-            'user_count': organization.users.count(),
-            'active_user_count': organization.users.filter(is_active=True).count()
+            'user_count': organization.user_count,
+            'active_user_count': organization.active_user_count
         }
         
         return Response({
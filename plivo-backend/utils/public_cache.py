@@ -0,0 +1,96 @@
+"""
+Cache of public read responses (status pages polling without logging in).
+
+Entries are keyed by resource ('services' and 'timeline' of an
+organization, 'incidents' of a service), the `public` visibility scope,
+the query parameters that change the response and a generation number.
+The signal handlers in services.signals / timeline.signals bump the
+generation of exactly the resources a committed change affects, so stale
+entries are never read again and simply expire.
+
+A miss is computed by one caller at a time (single flight): the first to
+take the entry's lock with cache.add runs the queries, the others wait
+for its result instead of sending the same queries to the database. This
+works across processes as long as they share the cache (CACHE_URL).
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+SCOPE_PUBLIC = 'public'
+RESOURCE_SERVICES = 'services'
+RESOURCE_INCIDENTS = 'incidents'
+RESOURCE_TIMELINE = 'timeline'
+
+# Seconds a computation may hold an entry's lock, after that others compute too
+LOCK_TIMEOUT = 10
+# How long and how often callers waiting for another one's result look for it
+WAIT_TIMEOUT = 5.0
+WAIT_INTERVAL = 0.02
+
+
+def _generation_key(resource: str, scope_id) -> str:
+    return f"{SCOPE_PUBLIC}:{resource}:{scope_id}:generation"
+
+
+def _generation(resource: str, scope_id) -> int:
+    key = _generation_key(resource, scope_id)
+    generation = cache.get(key)
+    if generation is None:
+        # Starting from the clock rather than 0, so a generation lost to eviction is never reused
+        cache.add(key, time.time_ns(), timeout=None)
+        generation = cache.get(key)
+    return generation
+
+
+def invalidate(resource: str, scope_id):
+    """Stop serving the cached responses of one resource, once the current transaction commits"""
+    def bump():
+        key = _generation_key(resource, scope_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), timeout=None)
+    transaction.on_commit(bump)
+
+
+def entry_key(resource: str, scope_id, params: dict) -> str:
+    variant = urlencode(sorted((name, value) for name, value in params.items() if value is not None))
+    digest = hashlib.sha1(variant.encode()).hexdigest()
+    return f"{SCOPE_PUBLIC}:{resource}:{scope_id}:{_generation(resource, scope_id)}:{digest}"
+
+
+def cached(resource: str, scope_id, params: dict, compute):
+    """
+    Cached result of compute() for the resource and these query parameters.
+
+    Exceptions from compute() are not cached, they reach the caller.
+    """
+    key = entry_key(resource, scope_id, params)
+    data = cache.get(key)
+    if data is not None:
+        return data
+    lock = f"{key}:lock"
+    if cache.add(lock, 1, timeout=LOCK_TIMEOUT):
+        try:
+            data = compute()
+            cache.set(key, data, timeout=settings.PUBLIC_CACHE_TTL)
+        finally:
+            cache.delete(lock)
+        return data
+
+    # Someone else is computing this entry
+    deadline = time.monotonic() + WAIT_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(WAIT_INTERVAL)
+        data = cache.get(key)
+        if data is not None:
+            return data
+        if cache.get(lock) is None:
+            # It failed, or the entry was evicted already
+            break
+    return compute()
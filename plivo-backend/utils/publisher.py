@@ -0,0 +1,198 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import zlib
+from utils.utils import TRANSPORT_CHANNELS, ChannelLayerPublishChannel, make_channel, realtime_transport
+from realtime.topics import as_rooms
+
+# What to do with an event when its worker queue is full
+OVERFLOW_DROP_NEWEST = "drop_newest"
+OVERFLOW_DROP_OLDEST = "drop_oldest"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = (OVERFLOW_DROP_NEWEST, OVERFLOW_DROP_OLDEST, OVERFLOW_SPILL)
+
+
+class BackgroundPublisher:
+    """
+    Hands realtime events to worker threads so request handlers never wait on ws_server.
+
+    Events are sharded to workers by room, which keeps per-room ordering.
+    Each worker drains its bounded queue in batches and pipelines the
+    batch over its own publish channel. When a queue is full the overflow
+    policy drops the new event, drops the oldest queued one, or spills the
+    event to a JSON lines file that is replayed once ws_server is back.
+    """
+
+    def __init__(self, workers=1, queue_size=10000, batch_size=100,
+                 overflow_policy=OVERFLOW_DROP_OLDEST, spill_path=None, channel_factory=make_channel):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        if overflow_policy == OVERFLOW_SPILL and not spill_path:
+            raise ValueError("spill_path is required for the spill overflow policy")
+        self.batch_size = batch_size
+        self.overflow_policy = overflow_policy
+        self.spill_path = spill_path
+        self.channel_factory = channel_factory
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.counters = {
+            "submitted": 0,
+            "published": 0,
+            "batches": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "failed": 0,
+        }
+        self._counter_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._threads = []
+        self._stopping = threading.Event()
+
+    def start(self):
+        for index, work_queue in enumerate(self.queues):
+            thread = threading.Thread(
+                target=self._run, args=(work_queue,),
+                name=f"ws-publisher-{index}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=2.0):
+        """Stop the workers, giving them up to `timeout` seconds to flush what is queued"""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, room, data: dict) -> bool:
+        """Queue an event for one room or a list of rooms without blocking.
+        Returns False if it was dropped"""
+        self._count("submitted")
+        # Sharded by the first room, events of one entity always list the same rooms
+        work_queue = self.queues[zlib.crc32(as_rooms(room)[0].encode()) % len(self.queues)]
+        item = (room, data)
+        try:
+            work_queue.put_nowait(item)
+            return True
+        except queue.Full:
+            pass
+
+        if self.overflow_policy == OVERFLOW_SPILL:
+            self._spill([item])
+            return True
+        if self.overflow_policy == OVERFLOW_DROP_OLDEST:
+            try:
+                work_queue.get_nowait()
+                self._count("dropped")
+            except queue.Empty:
+                pass
+            try:
+                work_queue.put_nowait(item)
+                return True
+            except queue.Full:
+                pass
+        self._count("dropped")
+        return False
+
+    def stats(self) -> dict:
+        with self._counter_lock:
+            stats = dict(self.counters)
+        stats["queued"] = sum(q.qsize() for q in self.queues)
+        return stats
+
+    def _run(self, work_queue):
+        channel = self.channel_factory()
+        try:
+            while True:
+                try:
+                    first = work_queue.get(timeout=0.5)
+                except queue.Empty:
+                    if self._stopping.is_set():
+                        return
+                    self._replay_spill(channel)
+                    continue
+                batch = [first]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(work_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                self._publish(channel, batch)
+        finally:
+            channel.close()
+
+    def _publish(self, channel, batch) -> bool:
+        if channel.publish_many(batch):
+            self._count("published", len(batch))
+            self._count("batches")
+            return True
+        self._count("failed", len(batch))
+        if self.overflow_policy == OVERFLOW_SPILL:
+            self._spill(batch)
+        else:
+            self._count("dropped", len(batch))
+        return False
+
+    def _spill(self, items):
+        with self._spill_lock:
+            with open(self.spill_path, "a") as spill:
+                for room, data in items:
+                    spill.write(json.dumps({"room": room, "data": data}) + "\n")
+        self._count("spilled", len(items))
+
+    def _replay_spill(self, channel):
+        """Publish spilled events once the queue is idle"""
+        if self.overflow_policy != OVERFLOW_SPILL:
+            return
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            with open(self.spill_path) as spill:
+                items = [(e["room"], e["data"]) for e in map(json.loads, spill) if e]
+            if not items or not channel.publish_many(items):
+                return
+            os.remove(self.spill_path)
+        self._count("replayed", len(items))
+
+    def _count(self, name, amount=1):
+        with self._counter_lock:
+            self.counters[name] += amount
+
+
+_publisher = None
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> BackgroundPublisher:
+    """Process wide publisher, configured from settings.WS_PUBLISHER and started on first use"""
+    global _publisher
+    if _publisher is None:
+        with _publisher_lock:
+            if _publisher is None:
+                from django.conf import settings
+                config = getattr(settings, "WS_PUBLISHER", {})
+                publisher = BackgroundPublisher(
+                    workers=config.get("WORKERS", 1),
+                    queue_size=config.get("QUEUE_SIZE", 10000),
+                    batch_size=config.get("BATCH_SIZE", 100),
+                    overflow_policy=config.get("OVERFLOW_POLICY", OVERFLOW_DROP_OLDEST),
+                    spill_path=config.get("SPILL_PATH"),
+                )
+                publisher.start()
+                atexit.register(publisher.stop)
+                _publisher = publisher
+    return _publisher
+
+
+def publish_event(room, data: dict) -> bool:
+    """Queue a realtime event for ws_server without blocking the caller.
+
+    With the Channels transport the event goes to group_send right away: the
+    layer is already asynchronous, and the in-memory one only works from the
+    server's own event loop, not from a worker thread.
+    """
+    if realtime_transport() == TRANSPORT_CHANNELS:
+        return ChannelLayerPublishChannel().publish(room, data)
+    return get_publisher().submit(room, data)
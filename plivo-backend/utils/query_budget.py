@@ -0,0 +1,103 @@
+"""
+Per-endpoint SQL query budgets.
+
+Each API view declares how many queries a request may run:
+
+    @query_budget(3)
+    @api_view(['GET'])
+    def list_incidents(request, service_id):
+        ...
+
+Budgets are constants: an endpoint that lists rows must fetch related
+objects with select_related / annotations rather than once per row (an
+N+1), so its query count doesn't depend on how many rows come back. The
+endpoint tests check every view against its budget with small and large
+tables, and QueryBudgetMiddleware (enabled with QUERY_BUDGET_CHECK, on by
+default with DEBUG) reports requests that go over it while developing.
+"""
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.db import connection
+from django.urls import resolve
+
+
+def query_budget(queries: int):
+    """Declare the most queries one request to the decorated view may run. Goes above @api_view"""
+    def decorator(view_func):
+        view_func.query_budget = queries
+        return view_func
+    return decorator
+
+
+def view_budget(view_func):
+    """Budget declared on a view, None if it has none"""
+    return getattr(view_func, 'query_budget', None)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """Count the queries run on the default database inside the block, DEBUG or not"""
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
+
+
+class QueryBudgetMiddleware:
+    """Reports requests whose view ran more queries than its budget, with the count in X-Query-Count"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with count_queries() as queries:
+            response = self.get_response(request)
+        response['X-Query-Count'] = str(queries.count)
+        budget = getattr(request, 'query_budget', None)
+        if budget is not None and queries.count > budget:
+            response['X-Query-Budget-Exceeded'] = f"{queries.count}/{budget}"
+            print(f"⚠️ {request.method} {request.path} ran {queries.count} queries, over its budget of {budget}:")
+            for sql in queries.statements:
+                print(f"    {sql}")
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = view_budget(view_func)
+        return None
+
+
+class QueryBudgetTestMixin:
+    """For API test cases: request an endpoint and fail if it runs more queries than its view's budget"""
+
+    def request_within_budget(self, method, url, data=None):
+        budget = view_budget(resolve(urlsplit(url).path).func)
+        self.assertIsNotNone(budget, f"{url} declares no query budget")
+        with count_queries() as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLessEqual(
+            queries.count, budget,
+            f"{method.upper()} {url} ran {queries.count} queries, over its budget of {budget}:\n" + "\n".join(queries.statements)
+        )
+        return response, queries.count
+
+    def assertConstantQueries(self, url, grow, rows=10):
+        """The number of queries of GET `url` must not change after grow(rows) adds rows it returns"""
+        # Process-wide caches (e.g. ContentType) fill on the first request, so don't count that one
+        self.request_within_budget('get', url)
+        response, before = self.request_within_budget('get', url)
+        self.assertEqual(response.status_code, 200)
+        grow(rows)
+        response, after = self.request_within_budget('get', url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(before, after, f"{url} runs a query per row")
@@ -1,13 +1,186 @@
 # websockets/utils.py
+import select
 import socket
-import json
-
-def send_to_ws(room: str, data: dict):
-    try:
-        payload = json.dumps({"room": room, "data": data})
-        with socket.create_connection(("localhost", 9000), timeout=2) as s:
-            s.sendall(payload.encode())
-            response = s.recv(1024)
-            print(f"📨 WebSocket server response: {response.decode()}")
-    except Exception as e:
-        print(f"❌ Failed to send to WebSocket server: {e}")
+import threading
+import time
+from realtime.framing import encode_frame
+from realtime.backplane import (
+    DEFAULT_CHANNEL_PREFIX, DEFAULT_SEQUENCE_PREFIX, PUBLISH_SCRIPT, encode_message, script_keys
+)
+from realtime.topics import as_rooms
+
+WS_INTERNAL_HOST = "localhost"
+WS_INTERNAL_PORT = 9000
+
+# settings.REALTIME_TRANSPORT
+TRANSPORT_WS_SERVER = "ws_server"
+TRANSPORT_CHANNELS = "channels"
+
+
+class PublishChannel:
+    """
+    Long-lived connection to the ws_server internal listener.
+
+    Messages are written as newline framed JSON without waiting for a reply,
+    so several of them can be pipelined in a single write. A broken
+    connection is re-established on the next publish.
+    """
+
+    def __init__(self, host=WS_INTERNAL_HOST, port=WS_INTERNAL_PORT, timeout=2, reconnect_delay=1.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.reconnect_delay = reconnect_delay
+        self._sock = None
+        self._lock = threading.Lock()
+        self._next_attempt = 0.0
+
+    def publish(self, room, data: dict) -> bool:
+        return self.publish_many([(room, data)])
+
+    def publish_many(self, messages) -> bool:
+        """Send (room, data) pairs in one write, room being one room or a list of them.
+        Returns True once handed to the socket"""
+        frames = b"".join(encode_frame(room, data) for room, data in messages)
+        if not frames:
+            return True
+        with self._lock:
+            # One retry on a fresh connection covers a ws_server restart
+            for _ in range(2):
+                sock = self._connect()
+                if sock is None:
+                    return False
+                try:
+                    sock.sendall(frames)
+                    return True
+                except OSError as e:
+                    print(f"❌ Publish connection lost: {e}")
+                    self._reset()
+            return False
+
+    def close(self):
+        with self._lock:
+            self._reset()
+
+    def _connect(self):
+        if self._sock is not None and not self._peer_closed(self._sock):
+            return self._sock
+        self._reset()
+        # Don't hammer a server that is down, every caller would pay the connect timeout
+        if time.monotonic() < self._next_attempt:
+            return None
+        try:
+            self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError as e:
+            print(f"❌ Failed to connect to WebSocket server: {e}")
+            self._next_attempt = time.monotonic() + self.reconnect_delay
+            self._sock = None
+        return self._sock
+
+    @staticmethod
+    def _peer_closed(sock) -> bool:
+        """The server never writes, so a readable socket means it hung up"""
+        try:
+            readable, _, _ = select.select([sock], [], [], 0)
+            if not readable:
+                return False
+            return sock.recv(1, socket.MSG_PEEK) == b""
+        except OSError:
+            return True
+
+    def _reset(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+
+
+class RedisPublishChannel:
+    """
+    Publishes straight to the Redis backplane that ws_server processes subscribe to.
+
+    Same interface as PublishChannel. A batch is sent as one pipeline, each
+    message through the backplane's publish script so it gets its room sequence.
+    """
+
+    def __init__(self, url, prefix=DEFAULT_CHANNEL_PREFIX, sequence_prefix=DEFAULT_SEQUENCE_PREFIX, timeout=2):
+        import redis
+        self.prefix = prefix
+        self.sequence_prefix = sequence_prefix
+        self.client = redis.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    def publish(self, room, data: dict) -> bool:
+        return self.publish_many([(room, data)])
+
+    def publish_many(self, messages) -> bool:
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for room, data in messages:
+                rooms = as_rooms(room)
+                keys = script_keys(rooms, self.prefix, self.sequence_prefix)
+                pipeline.eval(PUBLISH_SCRIPT, len(keys), *keys, encode_message(rooms, data))
+            pipeline.execute()
+            return True
+        except Exception as e:
+            print(f"❌ Failed to publish to Redis backplane: {e}")
+            return False
+
+    def close(self):
+        self.client.close()
+
+
+class ChannelLayerPublishChannel:
+    """
+    Publishes with the Channels layer's group_send, one group per room (realtime/consumers.py).
+
+    Same interface as PublishChannel. Called from sync code; inside the ASGI
+    app that runs the send on the server's event loop.
+    """
+
+    def __init__(self, layer=None):
+        if layer is None:
+            from channels.layers import get_channel_layer
+            layer = get_channel_layer()
+        self.layer = layer
+
+    def publish(self, room, data: dict) -> bool:
+        return self.publish_many([(room, data)])
+
+    def publish_many(self, messages) -> bool:
+        from asgiref.sync import async_to_sync
+        try:
+            async_to_sync(self._send)(messages)
+            return True
+        except Exception as e:
+            print(f"❌ Failed to publish to the channel layer: {e}")
+            return False
+
+    async def _send(self, messages):
+        from realtime.consumers import group_message
+        for room, data in messages:
+            rooms = as_rooms(room)
+            for target in rooms:
+                await self.layer.group_send(target, group_message(rooms, target, data))
+
+    def close(self):
+        pass
+
+
+def realtime_transport() -> str:
+    from django.conf import settings
+    return getattr(settings, "REALTIME_TRANSPORT", TRANSPORT_WS_SERVER)
+
+
+def make_channel():
+    """Publish channel for this process: the channel layer with the Channels transport,
+    Redis when settings.WS_BACKPLANE_URL is set, else the internal port"""
+    from django.conf import settings
+    if realtime_transport() == TRANSPORT_CHANNELS:
+        return ChannelLayerPublishChannel()
+    url = getattr(settings, "WS_BACKPLANE_URL", None)
+    if url:
+        return RedisPublishChannel(url)
+    return PublishChannel()
@@ -0,0 +1,63 @@
+"""
+Per-organization content version, served as an ETag.
+
+Organization.content_version is incremented in the transaction of every
+change to the organization's services, incidents or timeline (see the
+signal handlers), so it only ever grows and is committed with the change.
+list_services and get_timeline tag their responses with it; a poll whose
+If-None-Match still holds the current tag gets a 304 after a single
+primary key lookup, without reading services, incidents or the timeline
+or serializing anything.
+
+A response is tagged with the version read before its data, so the tag
+is never newer than the data: at worst a client downloads an unchanged
+payload once more, it is never told to keep an outdated one. Public
+cache entries keep the version they were computed at, and are served
+with it: an entry outlives changes public viewers don't see, and a
+client holding its tag gets a 304 from the cache.
+"""
+from typing import Optional
+
+from django.db.models import F
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from rest_framework import status
+from rest_framework.response import Response
+
+from users.models import Organization
+
+
+def content_version(org_id) -> Optional[int]:
+    """Current content version of an organization, None if it doesn't exist"""
+    return Organization.objects.filter(id=org_id).values_list('content_version', flat=True).first()
+
+
+def bump_content_version(org_id):
+    if org_id is not None:
+        Organization.objects.filter(id=org_id).update(content_version=F('content_version') + 1)
+
+
+def content_etag(request, org_id, version) -> str:
+    # Signed-in users may see more than the public, so their responses are tagged apart
+    scope = 'members' if request.user.is_authenticated else 'public'
+    return f'"org{org_id}-{scope}-v{version}"'
+
+
+def tagged(response, etag: str):
+    """Tag a response, and have clients revalidate it on every poll"""
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def not_modified(request, etag: str) -> Optional[Response]:
+    """A 304 response if the request's If-None-Match has `etag`, None otherwise"""
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return None
+    # If-None-Match uses the weak comparison
+    tags = [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(header)]
+    if etag in tags or '*' in tags:
+        return tagged(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+    return None
@@ -1,35 +1,268 @@
 import asyncio
+import http
 import json
+import logging
+import os
+import random
+import signal
+from functools import partial
 from websockets.server import serve, WebSocketServerProtocol
-from typing import Dict, Set
+from realtime.framing import read_frames, frame_rooms, MAX_FRAME_SIZE
+from realtime.fanout import (
+    FanoutEngine, DEFAULT_QUEUE_SIZE, DEFAULT_SEND_TIMEOUT, POLICY_CONFLATE, DEFAULT_MAX_ROOMS, DEFAULT_MAX_QUEUE_BYTES,
+    CLOSE_SERVICE_RESTART
+)
+from realtime.lifecycle import LifecycleManager, DEFAULT_PING_INTERVAL, DEFAULT_PING_TIMEOUT, DEFAULT_IDLE_TIMEOUT
+from realtime.backplane import LocalBackplane, RedisBackplane, RelayBackplane
+from realtime.replay import ReplayBuffer, DEFAULT_CAPACITY, resync_required
+from realtime.snapshot import SnapshotStore, org_room_id, org_topic_id
+from realtime.topics import is_pattern, pattern_prefix, valid_topic
+from realtime.encoding import ENCODINGS
+from realtime.scheduler import FairScheduler, DEFAULT_QUANTUM, DEFAULT_MAX_PENDING, parse_weights
+from realtime.session import DEFAULT_SESSION_TTL, UNKNOWN_SEQ, SessionCodec, derive_key, session_options
+from realtime.auth import ANONYMOUS, DEFAULT_COOKIE, DEFAULT_SCOPE_TTL, Authenticator, ScopeCache, TokenVerifier
+from realtime.log import setup_logging, sampled_logger
+from realtime.workers import Supervisor, use_uvloop
+from realtime.metrics import (
+    COUNTER, GAUGE, HISTOGRAM, LoopMonitor, Metric, MetricsServer, RateMeter, engine_metrics, render_json,
+    scheduler_metrics
+)
 
-rooms: Dict[str, Set[WebSocketServerProtocol]] = {}
+log = logging.getLogger("ws_server")
+# Per-message records, one in WS_LOG_SAMPLE is written (at WS_LOG_LEVEL=DEBUG)
+delivery_log = sampled_logger("ws_server.delivery")
+
+engine = FanoutEngine(
+    max_queue=int(os.environ.get("WS_SEND_QUEUE_SIZE", DEFAULT_QUEUE_SIZE)),
+    policy=os.environ.get("WS_SLOW_CONSUMER_POLICY", POLICY_CONFLATE),
+    send_timeout=float(os.environ.get("WS_SEND_TIMEOUT", DEFAULT_SEND_TIMEOUT)),
+    # Default batch window in ms (0 = off), clients can pick their own with "batch_ms" on join
+    batch_ms=float(os.environ.get("WS_BATCH_MS", 0)),
+    # Queue depth from which superseded messages are conflated (conflate policy), default half the queue
+    high_water=int(os.environ["WS_QUEUE_HIGH_WATER"]) if os.environ.get("WS_QUEUE_HIGH_WATER") else None,
+    # Per-connection caps, 0 = unlimited
+    max_rooms=int(os.environ.get("WS_MAX_ROOMS_PER_CONNECTION", DEFAULT_MAX_ROOMS)),
+    max_queue_bytes=int(os.environ.get("WS_MAX_QUEUE_BYTES", DEFAULT_MAX_QUEUE_BYTES)),
+)
+# Pings every connection each interval and evicts dead peers and connections idle in no room.
+# WS_PING_TIMEOUT=0 / WS_IDLE_TIMEOUT=0 turn those checks off.
+lifecycle = LifecycleManager(
+    engine,
+    ping_interval=float(os.environ.get("WS_PING_INTERVAL", DEFAULT_PING_INTERVAL)),
+    ping_timeout=float(os.environ.get("WS_PING_TIMEOUT", DEFAULT_PING_TIMEOUT)),
+    idle_timeout=float(os.environ.get("WS_IDLE_TIMEOUT", DEFAULT_IDLE_TIMEOUT)),
+)
+rooms = engine.rooms
+replay = ReplayBuffer(capacity=int(os.environ.get("WS_REPLAY_CAPACITY", DEFAULT_CAPACITY)))
+snapshots = SnapshotStore()
+
+# Seed org snapshots from the database (one query per org). Set to 0 to build them from events only.
+SNAPSHOT_SEED = os.environ.get("WS_SNAPSHOT_SEED", "1") == "1"
+
+def deliver(room: str, data: dict, seq: int, rooms: list):
+    """Stamp a room message with its sequence number, keep it for replay and fan it out.
+
+    For an event published to several rooms this runs once per room, and a
+    connection matching more than one of them only gets the first room's copy.
+    """
+    entity = None
+    if isinstance(data, dict):
+        data = {**data, "seq": seq}
+        if data.get("room") not in (None, room):
+            # `seq` counts messages of the room this copy went through
+            data["seq_room"] = room
+        entity = snapshots.apply(data)
+    message = engine.encode(room, data, entity)
+    message.seq = seq
+    if entity is not None and data.get("patch"):
+        full = {key: value for key, value in data.items() if key != "patch"}
+        full["data"] = entity
+        message.fallback = engine.encode(room, full)
+        # As urgent as the change it describes, not as a newly created entity
+        message.fallback.priority = message.priority
+        message.fallback.seq = seq
+    replay.record(room, seq, message)
+    delivered = engine.publish_message(message, skip=rooms[:rooms.index(room)] if room in rooms else ())
+    delivery_log.debug("📤 Broadcasting to room %s: %d connection(s)", room, delivered)
+
+# Clients are anonymous until main() loads the SimpleJWT settings
+authenticator = Authenticator(None, None)
+# Seconds a user's organization is cached for, membership changes apply to new connections after that
+AUTH_SCOPE_TTL = float(os.environ.get("WS_AUTH_SCOPE_TTL", DEFAULT_SCOPE_TTL))
+
+class AuthenticatedProtocol(WebSocketServerProtocol):
+    """Checks the Origin and verifies the access_token cookie during the handshake"""
+    principal = ANONYMOUS
+
+    async def process_request(self, path, request_headers):
+        origin = request_headers.get("Origin")
+        if not authenticator.origin_allowed(origin):
+            log.warning(f"🚫 Refused handshake from origin {origin}")
+            return http.HTTPStatus.FORBIDDEN, [], b"Origin not allowed\n"
+        try:
+            self.principal = await authenticator.authenticate(request_headers)
+        except Exception as e:
+            log.error(f"❌ Failed to authenticate client: {e}")
+        return await super().process_request(path, request_headers)
+
+# Deliveries are queued per organization and run round robin, so one org's burst can't hold up the rest.
+# WS_ORG_RATE caps deliveries per second per org (0 = no cap), WS_ORG_WEIGHTS gives orgs a bigger share ("42:4,7:2").
+FAIR_SCHEDULING = os.environ.get("WS_FAIR_SCHEDULING", "1") == "1"
+scheduler = FairScheduler(
+    quantum=float(os.environ.get("WS_SCHEDULER_QUANTUM", DEFAULT_QUANTUM)),
+    rate=float(os.environ.get("WS_ORG_RATE", 0)),
+    burst=float(os.environ["WS_ORG_BURST"]) if os.environ.get("WS_ORG_BURST") else None,
+    max_pending=int(os.environ.get("WS_ORG_MAX_PENDING", DEFAULT_MAX_PENDING)),
+    weights=parse_weights(os.environ.get("WS_ORG_WEIGHTS", "")),
+)
+
+def tenant_of(room: str) -> str:
+    org_id = org_topic_id(room)
+    return str(org_id) if org_id is not None else "shared"
+
+def schedule_delivery(room: str, data: dict, seq: int, rooms: list):
+    if not FAIR_SCHEDULING:
+        deliver(room, data, seq, rooms)
+        return
+    # Fan-out cost grows with the audience
+    cost = 1 + len(engine.rooms.get(room, ()))
+    scheduler.submit(tenant_of(room), partial(deliver, room, data, seq, rooms), cost)
+
+# WS_WORKERS=N runs N worker processes sharing the WebSocket port with SO_REUSEPORT (see realtime/workers.py).
+# WS_WORKER and WS_RELAY_SOCKET are set by the supervisor in each worker.
+WORKERS = int(os.environ.get("WS_WORKERS", 1))
+WORKER = int(os.environ.get("WS_WORKER", 0))
+RELAY_SOCKET = os.environ.get("WS_RELAY_SOCKET")
+# Set to 1 to run on uvloop when it is installed
+UVLOOP = os.environ.get("WS_UVLOOP", "0") == "1"
+
+# Set WS_BACKPLANE_URL (e.g. redis://localhost:6379/0) to share rooms between several ws_server processes
+BACKPLANE_URL = os.environ.get("WS_BACKPLANE_URL")
+if BACKPLANE_URL:
+    backplane = RedisBackplane(schedule_delivery, BACKPLANE_URL)
+elif RELAY_SOCKET:
+    backplane = RelayBackplane(schedule_delivery, RELAY_SOCKET)
+else:
+    backplane = LocalBackplane(schedule_delivery)
+# Orgs whose rooms are watched to keep their snapshot complete
+snapshot_orgs = set()
+
+def room_created(room: str):
+    if is_pattern(room):
+        asyncio.ensure_future(backplane.watch(pattern_prefix(room)))
+    else:
+        asyncio.ensure_future(backplane.subscribe(room))
+
+def room_empty(room: str):
+    if is_pattern(room):
+        asyncio.ensure_future(backplane.unwatch(pattern_prefix(room)))
+        return
+    asyncio.ensure_future(backplane.unsubscribe(room))
+    org_id = org_room_id(room)
+    if org_id in snapshot_orgs:
+        # Nobody left to keep this snapshot for, the next joiner seeds it again
+        snapshot_orgs.discard(org_id)
+        snapshots.forget(org_id)
+        asyncio.ensure_future(backplane.unwatch(f"org_{org_id}_"))
+
+engine.on_room_created = room_created
+
+engine.on_room_empty = room_empty
+
+# Set to 0 to turn off the permessage-deflate extension, which compresses every frame once per client.
+# Clients joining with "encoding": "deflate" get frames compressed once per message instead.
+PERMESSAGE_DEFLATE = os.environ.get("WS_PERMESSAGE_DEFLATE", "1") == "1"
+
+# Session tokens let a client resume its rooms on another process, e.g. across a restart.
+# Processes resuming each other's sessions need the same WS_SESSION_KEY, by default derived from Django's SECRET_KEY.
+sessions = SessionCodec(
+    os.environ.get("WS_SESSION_KEY") or os.urandom(32).hex(),
+    ttl=float(os.environ.get("WS_SESSION_TTL", DEFAULT_SESSION_TTL)),
+)
+# On SIGTERM, send queues get up to WS_DRAIN_TIMEOUT seconds to flush before clients are handed off,
+# each told to reconnect after a random delay of up to WS_DRAIN_JITTER_MS
+DRAIN_TIMEOUT = float(os.environ.get("WS_DRAIN_TIMEOUT", 10))
+DRAIN_JITTER_MS = int(os.environ.get("WS_DRAIN_JITTER_MS", 5000))
+
+LATENCY_REPORT_INTERVAL = float(os.environ.get("WS_LATENCY_REPORT_INTERVAL", 60))
+
+# Prometheus text at /metrics and a JSON view at /debug, on their own port (0 = off)
+METRICS_HOST = os.environ.get("WS_METRICS_HOST", "localhost")
+METRICS_PORT = int(os.environ.get("WS_METRICS_PORT", 9100))
+
+internal_stats = {"connections": 0, "frames": 0, "malformed": 0}
+internal_writers = set()
+publish_rate = RateMeter(lambda: engine.published)
+internal_rate = RateMeter(lambda: internal_stats["frames"])
+loop_monitor = LoopMonitor(meters=[publish_rate, internal_rate])
+
+def collect_metrics():
+    return engine_metrics(engine) + scheduler_metrics(scheduler) + [
+        Metric("ws_internal_connections", GAUGE, "Open internal publisher connections", internal_stats["connections"]),
+        Metric("ws_internal_frames_total", COUNTER, "Frames received on the internal listener", internal_stats["frames"]),
+        Metric("ws_internal_malformed_frames_total", COUNTER, "Internal frames dropped as malformed", internal_stats["malformed"]),
+        Metric("ws_event_loop_lag_seconds", HISTOGRAM, "How late the event loop runs a timer", loop_monitor.lag),
+    ]
+
+def debug_state():
+    return {
+        **render_json(collect_metrics()),
+        "publish_rate_per_second": round(publish_rate.rate(), 1),
+        "internal_frames_per_second": round(internal_rate.rate(), 1),
+        "event_loop_lag_ms": round(loop_monitor.last_lag * 1000, 3),
+        "latency": engine.latency_report(),
+        "snapshot_orgs": sorted(snapshot_orgs),
+    }
 
 async def handler(websocket: WebSocketServerProtocol):
-    joined_rooms = set()
-    print("✅ New client connected")
+    connection = engine.register(websocket)
+    principal = getattr(websocket, "principal", ANONYMOUS)
+    connection.authorize(principal.org_id, principal.expires_at)
+    log.debug("✅ New client connected (user %s, org %s)", principal.user_id, principal.org_id)
 
     try:
         async for msg in websocket:
+            connection.touch()
             try:
                 data = json.loads(msg)
                 action = data.get("action")
                 room = data.get("room")
 
                 if action == "join" and room:
-                    print(f"📥 Joining room: {room}")
-                    rooms.setdefault(room, set()).add(websocket)
-                    joined_rooms.add(room)
+                    if not isinstance(room, str) or not valid_topic(room):
+                        await websocket.send(json.dumps({ "error": f"Invalid room: {room}" }))
+                        continue
+                    if data.get("encoding", "json") not in ENCODINGS:
+                        await websocket.send(json.dumps({ "error": f"Unsupported encoding: {data['encoding']}" }))
+                        continue
+                    if not engine.can_join(connection, room):
+                        engine.rejected_joins += 1
+                        await websocket.send(json.dumps({ "error": f"Too many rooms (max {engine.max_rooms})" }))
+                        continue
+                    log.debug("📥 Joining room: %s", room)
+                    await join(connection, room, data)
+
+                elif action == "resume":
+                    session = sessions.load(data.get("session"))
+                    if session is None:
+                        await websocket.send(json.dumps({ "error": "Invalid or expired session" }))
+                        continue
+                    log.debug("♻️ Resuming session: %s", session["topics"])
+                    await resume(connection, session)
+
+                elif action == "session":
+                    await websocket.send(json.dumps({ "type": "session", "session": sessions.issue(connection, backplane.epoch) }))
 
                 elif action == "leave" and room:
-                    print(f"🚪 Leaving room: {room}")
-                    if room in rooms:
-                        rooms[room].discard(websocket)
-                        joined_rooms.discard(room)
+                    log.debug("🚪 Leaving room: %s", room)
+                    engine.leave(connection, room)
 
-                elif action == "message" and room:
+                elif action == "message" and isinstance(room, str) and room and not is_pattern(room):
+                    if org_topic_id(room) not in (None, connection.member_of):
+                        await websocket.send(json.dumps({ "error": f"Not allowed to publish to room: {room}" }))
+                        continue
                     message = data.get("data", "")
-                    print(f"📤 Message to room {room}: {message}")
+                    log.debug("📤 Message to room %s: %s", room, message)
                     await broadcast(room, {
                         "room": room,
                         "message": message
@@ -39,58 +272,267 @@ async def handler(websocket: WebSocketServerProtocol):
                 await websocket.send(json.dumps({ "error": "Invalid JSON" }))
 
     except Exception as e:
-        print(f"❌ Client disconnected unexpectedly: {e}")
+        if not connection.closed:
+            log.info(f"❌ Client disconnected unexpectedly: {e}")
 
     finally:
-        for room in joined_rooms:
-            rooms[room].discard(websocket)
-        print("🔌 Client disconnected")
+        await engine.unregister(websocket)
+        log.debug("🔌 Client disconnected")
 
-async def broadcast(room: str, data: dict):
-    print(f"📤 Broadcasting to room {room}: {rooms}")
-    if room not in rooms:
-        return
-    message = json.dumps(data)
-    dead = set()
-    for ws in rooms[room]:
-        try:
-            await ws.send(message)
-        except:
-            dead.add(ws)
-    rooms[room] -= dead
+async def join(connection, room: str, options: dict):
+    """
+    Add a client to a room and queue its first frames.
+
+    A client rejoining with `last_seq` gets the messages it missed. A client
+    asking for `snapshot` on an org room gets the org's current status first,
+    which is also how a rejoin whose gap is too old is answered. Otherwise a
+    rejoining client is told to resync over REST. `batch_ms` sets the
+    connection's batch window and `encoding` its wire encoding. With
+    `full_objects` the connection gets update events as full objects rather
+    than patches, built from the org snapshot. Clients outside the org only
+    get its public services, in the snapshot as in live events.
+    """
+    if isinstance(options.get("batch_ms"), (int, float)):
+        connection.set_batch_ms(options["batch_ms"])
+    if "encoding" in options:
+        connection.set_encoding(options["encoding"])
+    if options.get("full_objects") and org_topic_id(room) is not None:
+        # Patches are expanded against the org snapshot, so make sure it is tracked
+        if await org_snapshot(org_topic_id(room)) is not None:
+            connection.full_objects = True
+
+    last_seq = options.get("last_seq")
+    if last_seq is not None:
+        missed = replay.missed(room, last_seq) if isinstance(last_seq, int) else None
+        if missed is not None:
+            engine.join(connection, room)
+            # The client has the room up to last_seq, the replayed messages take it from there
+            connection.seen(room, last_seq)
+            for message in missed:
+                # Fresh copy so the replay doesn't count towards live delivery latency
+                connection.offer(message.copy())
+            return
+
+    org_id = org_room_id(room)
+    if options.get("snapshot") and org_id is not None:
+        frame = await snapshot_frame(room, org_id, public_only=connection.member_of != org_id)
+        if frame is not None:
+            # Offered and joined in one step, so no live message can slip in between
+            connection.offer(control_message(room, frame))
+            engine.join(connection, room)
+            return
+
+    engine.join(connection, room)
+    if last_seq is not None:
+        log.debug("🔁 Resync required for room %s (last_seq=%s)", room, last_seq)
+        connection.offer(control_message(room, resync_required(room, replay.last_seq(room))))
+    else:
+        connection.seen(room, replay.last_seq(room))
+
+def control_message(room: str, frame: dict):
+    message = engine.encode(room, frame)
+    # Once sent, the client is current as of the frame's seq
+    message.seq = frame["seq"]
+    return message
+
+async def resume(connection, session: dict):
+    """
+    Rejoin the topics of a session token, each from the last seq the client
+    was sent. Where this process can't tell what the client missed, an org
+    room is answered with the org snapshot, loaded once however many clients
+    resume, and any other room with a resync marker.
+    """
+    options = session_options(session)
+    for topic in session["topics"]:
+        if not isinstance(topic, str) or not valid_topic(topic):
+            continue
+        if not engine.can_join(connection, topic):
+            engine.rejected_joins += 1
+            continue
+        if is_pattern(topic):
+            # Wildcards have no sequence of their own
+            last_seq = UNKNOWN_SEQ
+        else:
+            last_seq = await resume_seq(topic, session["seqs"].get(topic), session.get("epoch"))
+        await join(connection, topic, {**options, "last_seq": last_seq, "snapshot": True})
+
+async def resume_seq(room: str, last_seq, epoch) -> int:
+    """A resumed client's last seq in this process's numbering, UNKNOWN_SEQ if the two can't be compared"""
+    if not isinstance(last_seq, int):
+        return UNKNOWN_SEQ
+    if epoch != backplane.epoch:
+        if not backplane.adopt_seq(room, last_seq):
+            return UNKNOWN_SEQ
+        replay.resume(room, last_seq)
+    elif replay.last_seq(room) == 0 and await backplane.current_seq(room) == last_seq:
+        # Nothing happened in the room since the client left, but this process never saw it
+        replay.resume(room, last_seq)
+    return last_seq
+
+async def org_snapshot(org_id: int):
+    # Receive all of the org's rooms from now on, so the snapshot stays complete
+    if org_id not in snapshot_orgs:
+        snapshot_orgs.add(org_id)
+        await backplane.watch(f"org_{org_id}_")
+    try:
+        return await snapshots.get(org_id)
+    except Exception as e:
+        log.error(f"❌ Failed to load snapshot for org {org_id}: {e}")
+        return None
 
-# Internal listener for Django to send messages to WebSocket server
+async def snapshot_frame(room: str, org_id: int, public_only: bool = False):
+    snapshot = await org_snapshot(org_id)
+    if snapshot is None:
+        return None
+    return snapshots.frame(room, org_id, snapshot, replay.last_seq(room), public_only)
+
+async def broadcast(room, data: dict):
+    # Goes through the backplane so clients on other ws_server processes get it too.
+    # Delivery only queues the message, each connection's writer task does the sending.
+    # `room` can be a list, the event is then published once to all of them.
+    await backplane.publish(room, data)
+
+async def report_latency():
+    """Periodically log per-room delivery latency and eviction counters"""
+    while True:
+        await asyncio.sleep(LATENCY_REPORT_INTERVAL)
+        report = engine.latency_report()
+        if report:
+            log.info(f"⏱️ Delivery latency per room: {json.dumps(report)}")
+        if engine.evictions or engine.rejected_joins:
+            log.info(f"🧹 Evictions: {json.dumps(engine.evictions)}, rejected joins: {engine.rejected_joins}")
+
+# Internal listener for Django to send messages to WebSocket server.
+# A publisher keeps one connection open and streams newline framed messages over it.
 async def handle_internal(reader, writer):
+    internal_stats["connections"] += 1
+    internal_writers.add(writer)
     try:
-        data = await reader.read(1024)
-        payload = json.loads(data.decode())
-        room = payload["room"]
-        message = payload["data"]
-        await broadcast(room, message)
-        writer.write(b"ok")
-        await writer.drain()
+        async for payload in read_frames(reader):
+            internal_stats["frames"] += 1
+            target = frame_rooms(payload)
+            if not target or any(is_pattern(room) for room in target):
+                internal_stats["malformed"] += 1
+                log.warning("⚠️ Dropping malformed internal frame")
+                continue
+            await broadcast(target, payload.get("data"))
     except Exception as e:
-        writer.write(str(e).encode())
+        log.error(f"❌ Internal publisher connection failed: {e}")
     finally:
+        internal_stats["connections"] -= 1
+        internal_writers.discard(writer)
         writer.close()
 
 # Start the internal listener
-async def start_internal_listener():
-    server = await asyncio.start_server(handle_internal, "localhost", 9000)
-    print("📡 TCP listener running at localhost:9000")
-    await server.serve_forever()
-    
+async def start_internal_listener(reuse_port: bool = False):
+    server = await asyncio.start_server(handle_internal, "localhost", 9000, limit=MAX_FRAME_SIZE, reuse_port=reuse_port)
+    log.info("📡 TCP listener running at localhost:9000")
+    return server
+
+async def drain(server, internal):
+    """
+    Hand every client off to another process: stop taking connections and
+    events, let send queues flush, then give each client a session token
+    and a jittered delay to reconnect after, so the next process resumes
+    them in a trickle rather than all at once.
+    """
+    log.info(f"🚰 Draining {len(engine.connections)} connection(s)")
+    # Existing connections stay open, the ports are free for the next process
+    server.close(close_connections=False)
+    if internal is not None:
+        internal.close()
+    # Publishers reconnect to the next process, this one must not take events its clients won't get
+    for writer in list(internal_writers):
+        writer.close()
+    await backplane.stop()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + DRAIN_TIMEOUT
+    # Lets handlers of the closed publishers deliver what they had already read
+    await asyncio.sleep(0.05)
+    while scheduler.pending or not all(connection.flushed for connection in engine.connections.values()):
+        if loop.time() >= deadline:
+            log.warning("⚠️ Drain timed out, unsent messages are left to session resume")
+            break
+        await asyncio.sleep(0.05)
+    connections = list(engine.connections.values())
+    await asyncio.gather(*(hand_off(connection) for connection in connections))
+    log.info(f"👋 Handed off {len(connections)} connection(s)")
+
+async def hand_off(connection):
+    # Nothing more is queued, so the token covers exactly what the client was sent
+    connection.closed = True
+    notice = {
+        "type": "reconnect",
+        "session": sessions.issue(connection, backplane.epoch),
+        "retry_after_ms": random.randint(0, DRAIN_JITTER_MS),
+    }
+    try:
+        await asyncio.wait_for(connection.websocket.send(json.dumps(notice)), engine.send_timeout)
+        await connection.websocket.close(CLOSE_SERVICE_RESTART, "server restart")
+    except Exception as e:
+        log.debug(f"❌ Failed to hand off connection: {e}")
+
+
 async def main():
-    print("🚀 Starting WebSocket server...")
-    await asyncio.gather(
-        serve(handler, "localhost", 8765),
-        start_internal_listener()
-    )
+    log.info(f"🚀 Starting WebSocket server{' (worker %d)' % WORKER if WORKER else ''}...")
+    try:
+        from realtime.django_loader import setup_django, load_org_snapshot, load_user_org
+        setup_django()
+        from django.conf import settings
+        authenticator.verifier = TokenVerifier.from_settings(settings.SIMPLE_JWT)
+        authenticator.scopes = ScopeCache(load_user_org, ttl=AUTH_SCOPE_TTL)
+        authenticator.cookie_name = settings.SIMPLE_JWT.get("AUTH_COOKIE", DEFAULT_COOKIE)
+        # The cookie authenticates the socket, so only the frontend's origins may open one
+        authenticator.allowed_origins = set(settings.CORS_ALLOWED_ORIGINS)
+        if not os.environ.get("WS_SESSION_KEY"):
+            sessions.key = derive_key(settings.SECRET_KEY)
+        if SNAPSHOT_SEED:
+            snapshots.loader = load_org_snapshot
+    except Exception as e:
+        log.warning(f"⚠️ Django is unavailable, clients stay anonymous and snapshots are not seeded: {e}")
+    await backplane.start()
+    if BACKPLANE_URL:
+        log.info(f"🔗 Using Redis backplane at {BACKPLANE_URL}")
+    if RELAY_SOCKET:
+        # Without the supervisor nothing reaches this worker any more, hand the clients off
+        backplane.on_close = lambda: os.kill(os.getpid(), signal.SIGTERM)
+    if METRICS_PORT:
+        # Worker N serves its metrics on WS_METRICS_PORT + N
+        await MetricsServer(collect_metrics, debug_state).start(METRICS_HOST, METRICS_PORT + WORKER)
+    # Keepalive pings come from the lifecycle manager, one sweep for all connections.
+    # Workers share the port, the kernel spreads new connections over them.
+    server = await serve(handler, "localhost", 8765, create_protocol=AuthenticatedProtocol, compression="deflate" if PERMESSAGE_DEFLATE else None, ping_interval=None, reuse_port=bool(WORKER))
+    # A relay supervisor owns the internal port, with Redis every worker takes publishes
+    internal = None if RELAY_SOCKET else await start_internal_listener(reuse_port=bool(WORKER))
+    tasks = [
+        asyncio.ensure_future(task)
+        for task in (report_latency(), lifecycle.run(), loop_monitor.run(), scheduler.run())
+    ]
+    stopping = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+    except NotImplementedError:
+        # No signal handlers on Windows, the server just stops there
+        pass
+    done, _ = await asyncio.wait([asyncio.ensure_future(stopping.wait()), *tasks], return_when=asyncio.FIRST_COMPLETED)
+    for task in done:
+        # Background tasks only finish by failing, which stops the server
+        task.result()
+    await drain(server, internal)
+    for task in tasks:
+        task.cancel()
+    log.info("🛑 WebSocket server drained")
 
 if __name__ == "__main__":
+    setup_logging()
+    if UVLOOP:
+        use_uvloop()
     try:
-        asyncio.run(main())
+        if WORKERS > 1 and not WORKER:
+            asyncio.run(Supervisor(WORKERS, relay=not BACKPLANE_URL).run())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
-        print("\n🛑 WebSocket server stopped by user")
+        log.info("🛑 WebSocket server stopped by user")
     except Exception as e:
-        print(f"❌ WebSocket server error: {e}")
+        log.error(f"❌ WebSocket server error: {e}")
@@ -9,6 +9,9 @@ class WebSocketManager {
   private connectionPromise: Promise<void> | null = null;
   private currentRoom: string | null = null;
   private listeners: Listener[] = [];
+  // Set when the server hands us off during a restart, used to resume on the next connection
+  private session: string | null = null;
+  private retryAfterMs = 0;
 
   connect(): Promise<void> {
     if (this.isConnected) return Promise.resolve();
@@ -21,6 +24,10 @@ class WebSocketManager {
         this.socket.onopen = () => {
           console.log("✅ WebSocket connected");
           this.isConnected = true;
+          if (this.session) {
+            this.socket?.send(JSON.stringify({ action: "resume", session: this.session }));
+            this.session = null;
+          }
           resolve();
         };
 
@@ -31,6 +38,12 @@ class WebSocketManager {
 
         this.socket.onmessage = (event) => {
           const data = JSON.parse(event.data);
+          if (data.type === "reconnect") {
+            // The server is restarting and closes the socket next
+            this.session = data.session;
+            this.retryAfterMs = data.retry_after_ms || 0;
+            return;
+          }
           this.listeners.forEach((cb) => cb(data));
         };
 
@@ -38,6 +51,14 @@ class WebSocketManager {
           console.log("🔌 WebSocket disconnected");
           this.isConnected = false;
           this.connectionPromise = null;
+          if (this.session) {
+            // Come back after the delay the server picked, so clients return spread out
+            setTimeout(() => {
+              this.connect().catch((err) => console.error("❌ WebSocket reconnect failed:", err));
+            }, this.retryAfterMs);
+            // Back off in case the next process isn't up yet
+            this.retryAfterMs = Math.min(Math.max(this.retryAfterMs * 2, 1000), 30000);
+          }
         };
       });
     }